@@ -0,0 +1,74 @@
+"""Startup benchmark: module import and application build times.
+
+Every sample runs in a fresh interpreter so module caches do not hide the
+cost. Reported phases:
+    import app        - importing the application module
+    create_app()      - building the first configured application
+    second app        - building another application in the same process
+    first DB service  - first access to a service (engine creation)
+
+Usage (from the repository root):
+    python benchmarks/bench_import.py [--runs N]
+"""
+
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+from pathlib import Path
+
+APP_DIR = Path(__file__).resolve().parents[1] / "flask_chat"
+
+PROBE = """
+import json, time
+start = time.perf_counter()
+import app
+imported = time.perf_counter()
+first = app.create_app({"DATABASE_URL": "sqlite://"})
+built = time.perf_counter()
+app.create_app({"DATABASE_URL": "sqlite://"})
+second = time.perf_counter()
+with first.app_context():
+    from extensions import get_services
+    get_services().user_service
+serviced = time.perf_counter()
+print(json.dumps({
+    "import app": imported - start,
+    "create_app()": built - imported,
+    "second app": second - built,
+    "first DB service": serviced - second,
+}))
+"""
+
+
+def run_probe():
+    """Run probe in fresh interpreter and return phase timings in seconds"""
+    output = subprocess.run(
+        [sys.executable, "-c", PROBE],
+        cwd=APP_DIR,
+        capture_output=True,
+        check=True,
+        text=True,
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main():
+    """Run benchmark and print median timings"""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=10)
+    args = parser.parse_args()
+
+    # Warm-up run populates bytecode caches
+    run_probe()
+    samples = [run_probe() for _ in range(args.runs)]
+
+    print(f"{'phase':<20}{'median, ms':>12}{'max, ms':>10}")
+    for phase in samples[0]:
+        values = [sample[phase] * 1000 for sample in samples]
+        print(f"{phase:<20}{statistics.median(values):>12.1f}{max(values):>10.1f}")
+
+
+if __name__ == "__main__":
+    main()
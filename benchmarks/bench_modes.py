@@ -0,0 +1,209 @@
+"""Serving mode benchmark: eventlet worker vs asyncio (ASGI) worker.
+
+Each mode is started as a real gunicorn worker against the same database.
+A fresh user is registered, then concurrent Socket.IO clients send chat
+messages while others request history. Reported per mode:
+    messages/s        - broadcasts received by senders per second
+    message p50/p99   - latency from emit to receipt of own broadcast
+    history p50/p99   - latency of `request_message` answered by `load`
+
+Runs against a temporary SQLite file unless --database-url points to a
+database with schema created (`flask --app app init-db`). Needs the asgi
+dependency group and aiohttp for the asyncio Socket.IO client.
+
+Usage (from the repository root):
+    python benchmarks/bench_modes.py [--database-url URL] [--clients N] [--messages N]
+"""
+
+import argparse
+import asyncio
+import http.cookiejar
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.error
+import urllib.parse
+import urllib.request
+import uuid
+from pathlib import Path
+
+import socketio
+from sqlalchemy import create_engine
+
+APP_DIR = Path(__file__).resolve().parents[1] / "flask_chat"
+sys.path.insert(0, str(APP_DIR))
+
+# pylint: disable=wrong-import-position
+from database import create_schema, seed_database
+
+MODES = {
+    "eventlet": ["--worker-class", "eventlet", "app:create_app()"],
+    "asgi": ["--worker-class", "uvicorn.workers.UvicornWorker", "asgi:create_asgi_app()"],
+}
+
+
+def start_server(mode, port, database_url):
+    """Start one gunicorn worker serving the app in given mode"""
+    env = {
+        **os.environ,
+        "DATABASE_URL": database_url,
+        "SERVER_MODE": mode,
+        "FLASK_SECRET_KEY": os.environ.get("FLASK_SECRET_KEY", uuid.uuid4().hex * 2),
+        "MAINTENANCE_INTERVAL": "0",
+    }
+    command = [sys.executable, "-m", "gunicorn", "-w", "1", "--bind", f"127.0.0.1:{port}"]
+    server = subprocess.Popen(  # pylint: disable=consider-using-with
+        command + MODES[mode],
+        cwd=APP_DIR,
+        env=env,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+
+    for _ in range(100):
+        try:
+            urllib.request.urlopen(f"http://127.0.0.1:{port}/healthz", timeout=1)
+            return server
+        except (urllib.error.URLError, ConnectionError):
+            time.sleep(0.1)
+
+    server.kill()
+    raise RuntimeError(f"{mode} server did not start")
+
+
+def login_cookie(base_url):
+    """Register a fresh user and return its session cookies as a header"""
+    username = "bench_" + uuid.uuid4().hex[:16]
+    password = uuid.uuid4().hex
+    jar = http.cookiejar.CookieJar()
+    opener = urllib.request.build_opener(urllib.request.HTTPCookieProcessor(jar))
+
+    opener.open(
+        base_url + "/register",
+        urllib.parse.urlencode(
+            {
+                "username": username,
+                "email": f"{username}@example.com",
+                "password": password,
+                "confirm": password,
+            }
+        ).encode(),
+    )
+    opener.open(
+        base_url + "/login",
+        urllib.parse.urlencode({"username": username, "password": password}).encode(),
+    )
+    return "; ".join(f"{cookie.name}={cookie.value}" for cookie in jar)
+
+
+async def chat_client(base_url, cookie, messages, history, results):
+    """Send messages one by one, waiting for own broadcast each time, and
+    interleave history requests"""
+    client = socketio.AsyncClient()
+    pending = {}
+    loaded = asyncio.Event()
+
+    def on_message(payload):
+        future = pending.pop(payload["message"], None)
+        if future is not None:
+            future.set_result(time.perf_counter())
+
+    client.on("message", on_message)
+    client.on("load", lambda payload: loaded.set())
+    client.on("loading_finished", loaded.set)
+    client.on("retry_later", lambda payload: loaded.set())
+
+    await client.connect(base_url, headers={"Cookie": cookie}, transports=["websocket"])
+
+    for index in range(messages):
+        text = uuid.uuid4().hex
+        pending[text] = asyncio.get_running_loop().create_future()
+        sent = time.perf_counter()
+        await client.emit("message", {"message": text})
+        results["message"].append(await asyncio.wait_for(pending[text], 30) - sent)
+
+        if history and index % history == 0:
+            loaded.clear()
+            sent = time.perf_counter()
+            await client.emit("request_message", index)
+            await asyncio.wait_for(loaded.wait(), 30)
+            results["history"].append(time.perf_counter() - sent)
+
+    await client.disconnect()
+
+
+def percentile(samples, share):
+    """Return sample at given share of sorted samples, in milliseconds"""
+    if not samples:
+        return float("nan")
+    ordered = sorted(samples)
+    return ordered[min(int(len(ordered) * share), len(ordered) - 1)] * 1000
+
+
+async def run_mode(base_url, clients, messages, history):
+    """Run all clients against one server and return measurements"""
+    cookie = login_cookie(base_url)
+    results = {"message": [], "history": []}
+
+    started = time.perf_counter()
+    await asyncio.gather(
+        *(chat_client(base_url, cookie, messages, history, results) for _ in range(clients))
+    )
+    elapsed = time.perf_counter() - started
+
+    return {
+        "messages/s": len(results["message"]) / elapsed,
+        "message p50": statistics.median(results["message"]) * 1000,
+        "message p99": percentile(results["message"], 0.99),
+        "history p50": percentile(results["history"], 0.5),
+        "history p99": percentile(results["history"], 0.99),
+    }
+
+
+def main():
+    """Run benchmark for every mode and print comparison table"""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--database-url")
+    parser.add_argument("--clients", type=int, default=50)
+    parser.add_argument("--messages", type=int, default=20)
+    parser.add_argument("--history-every", type=int, default=5)
+    parser.add_argument("--port", type=int, default=5055)
+    parser.add_argument("--modes", nargs="+", choices=MODES, default=list(MODES))
+    args = parser.parse_args()
+
+    if args.database_url is None:
+        directory = tempfile.mkdtemp(prefix="bench_modes_")
+        args.database_url = f"sqlite:///{directory}/chat.db"
+        engine = create_engine(args.database_url)
+        create_schema(engine)
+        seed_database(engine, users=10, messages=1000, password=uuid.uuid4().hex)
+        engine.dispose()
+
+    rows = {}
+    for mode in args.modes:
+        server = start_server(mode, args.port, args.database_url)
+        try:
+            rows[mode] = asyncio.run(
+                run_mode(
+                    f"http://127.0.0.1:{args.port}",
+                    args.clients,
+                    args.messages,
+                    args.history_every,
+                )
+            )
+        finally:
+            server.terminate()
+            server.wait()
+
+    columns = list(next(iter(rows.values())))
+    print(f"{'mode':<10}" + "".join(f"{column:>14}" for column in columns))
+    for mode, row in rows.items():
+        print(f"{mode:<10}" + "".join(f"{row[column]:>14.2f}" for column in columns))
+    print("latencies in ms")
+
+
+if __name__ == "__main__":
+    main()
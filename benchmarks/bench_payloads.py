@@ -0,0 +1,58 @@
+"""Microbenchmark: JSON vs MessagePack chat event payloads.
+
+Measures CPU per encoded `message` event and per `load` batch, and the
+size of each payload on the wire. JSON cost includes `json.dumps`, which
+Socket.IO applies to dict payloads; binary payloads are sent as is.
+
+Usage (from the repository root):
+    python benchmarks/bench_payloads.py [--calls N]
+"""
+
+import argparse
+import json
+import sys
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "flask_chat"))
+
+# pylint: disable=wrong-import-position
+from payloads import JSON, MSGPACK, encode_message, encode_messages
+
+MESSAGE = ("some_username", "Hello there, this is a typical chat message!", "1729339200.123456")
+BATCH = [MESSAGE] * 5
+
+
+def wire(payload):
+    """Return payload as it is sent on the wire"""
+    return payload if isinstance(payload, bytes) else json.dumps(payload).encode()
+
+
+def measure(func, calls):
+    """Return CPU microseconds per call"""
+    start = time.process_time()
+    for _ in range(calls):
+        func()
+    return (time.process_time() - start) / calls * 1e6
+
+
+def main():
+    """Run benchmark and print comparison table"""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--calls", type=int, default=100000)
+    args = parser.parse_args()
+
+    cases = [
+        ("message", lambda enc: wire(encode_message(*MESSAGE, enc))),
+        ("load (5 messages)", lambda enc: wire(encode_messages(BATCH, enc))),
+    ]
+
+    print(f"{'event':<20}{'encoding':<10}{'us/event':>10}{'bytes':>8}")
+    for name, build in cases:
+        for encoding in (JSON, MSGPACK):
+            cpu = measure(lambda: build(encoding), args.calls)  # pylint: disable=cell-var-from-loop
+            print(f"{name:<20}{encoding:<10}{cpu:>10.2f}{len(build(encoding)):>8}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,344 @@
+"""Service-layer benchmark: latency of UserService and MessageService methods.
+
+Seeds a synthetic dataset (generated users and messages, see
+`database.seed_database`) and times public service methods against it:
+reads by identifier and username, shallow and deep pages of history,
+counts, edits, and inserts made one at a time and from concurrent threads.
+Bulk purge, moderation and deletions are left out, as they change the dataset.
+Reported per method, in microseconds of wall time:
+    mean, p50, p95    - latency of single calls
+    ops/s             - calls completed per second (all threads)
+
+Runs against a temporary SQLite file unless --database-url points to a
+database with schema created (`flask --app app init-db`). A database that
+already holds the requested number of messages is not seeded again, so
+large datasets are generated once and reused by later runs.
+
+Results are written as JSON with --output; --baseline compares a run with
+saved results and exits with status 1 if any method got slower than the
+tolerance allows, so data access changes can be checked with numbers.
+
+Usage (from the repository root):
+    python benchmarks/bench_services.py [--dataset 10k|1m|10m] [--users N]
+        [--database-url URL] [--calls N] [--output FILE] [--baseline FILE]
+"""
+
+import argparse
+import itertools
+import json
+import platform
+import statistics
+import sys
+import tempfile
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "flask_chat"))
+
+# pylint: disable=wrong-import-position
+from sqlalchemy import create_engine, func, select
+
+from database import create_schema, engine_options, register_sqlite_pragmas, seed_database
+from models import Message, User
+from services import MessageService, UserService
+from utils.constants import MSG_LOAD_BATCH
+
+# Message counts of dataset presets
+DATASETS = {
+    "10k": 10_000,
+    "1m": 1_000_000,
+    "10m": 10_000_000,
+}
+
+
+def prepare_dataset(engine, users, messages):
+    """Create schema and seed users and messages missing from the database"""
+    create_schema(engine)
+
+    with engine.connect() as conn:
+        have_users = conn.scalar(select(func.count()).select_from(User))
+        have_messages = conn.scalar(select(func.count()).select_from(Message))
+
+    missing_users = max(users - have_users, 0)
+    missing_messages = max(messages - have_messages, 0)
+    if missing_users or missing_messages:
+        print(f"Seeding {missing_users} users and {missing_messages} messages...")
+        started = time.perf_counter()
+        seed_database(
+            engine, missing_users, missing_messages, password=uuid.uuid4().hex, batch_size=10_000
+        )
+        print(f"Seeded in {time.perf_counter() - started:.1f} s")
+
+    with engine.connect() as conn:
+        return {
+            "users": conn.scalar(select(func.count()).select_from(User)),
+            "messages": conn.scalar(select(func.count()).select_from(Message)),
+        }
+
+
+def dataset_fixtures(engine, dataset):
+    """Return identifiers benchmarked calls refer to: a user with messages,
+    its username and cursors of a page near the newest and the oldest end"""
+    with engine.connect() as conn:
+        user_id, username = conn.execute(
+            select(User.user_id, User.username)
+            .join(Message, Message.user_id == User.user_id)
+            .order_by(Message.message_id.desc())
+            .limit(1)
+        ).one()
+
+        def cursor(depth):
+            return conn.scalar(
+                select(Message.message_id)
+                .order_by(Message.message_id.desc())
+                .offset(min(depth, dataset["messages"] - 1))
+                .limit(1)
+            )
+
+        return {
+            "user_id": user_id,
+            "username": username,
+            "shallow": cursor(MSG_LOAD_BATCH),
+            "deep": cursor(int(dataset["messages"] * 0.95)),
+            "deep_offset": int(dataset["messages"] * 0.95),
+        }
+
+
+def measure(call, calls, threads=1):
+    """Call function `calls` times from `threads` threads after a short
+    warm-up and return latency stats in microseconds"""
+    for _ in range(min(calls, 10)):
+        call()
+
+    def timed(_):
+        start = time.perf_counter()
+        call()
+        return time.perf_counter() - start
+
+    started = time.perf_counter()
+    if threads == 1:
+        samples = [timed(index) for index in range(calls)]
+    else:
+        with ThreadPoolExecutor(threads) as pool:
+            samples = list(pool.map(timed, range(calls)))
+    elapsed = time.perf_counter() - started
+
+    ordered = sorted(samples)
+    return {
+        "calls": calls,
+        "threads": threads,
+        "mean_us": statistics.fmean(samples) * 1e6,
+        "p50_us": ordered[len(ordered) // 2] * 1e6,
+        "p95_us": ordered[min(int(len(ordered) * 0.95), len(ordered) - 1)] * 1e6,
+        "ops_per_s": calls / elapsed,
+    }
+
+
+def benchmark_cases(user_service, message_service, fixtures, args):
+    """Return (name, function, calls, threads) of every benchmarked call"""
+    user_id = fixtures["user_id"]
+    counter = itertools.count()
+    attachment_id = message_service.insert_attachment("bench.png", "image/png", 1024, user_id)
+    edited_id = message_service.insert_message("Benchmark message", user_id)["message_id"]
+
+    def new_user():
+        name = f"bench_{uuid.uuid4().hex[:16]}"
+        return user_service.insert_user(name, "benchmark", f"{name}@example.com")
+
+    def new_message():
+        return message_service.insert_message(f"Benchmark message {next(counter)}", user_id)
+
+    reads, writes = args.calls, args.write_calls
+    return [
+        ("UserService.get_user_by_id", lambda: user_service.get_user_by_id(user_id), reads, 1),
+        (
+            "UserService.get_user_info(username)",
+            lambda: user_service.get_user_info(username=fixtures["username"]),
+            reads,
+            1,
+        ),
+        (
+            "UserService.get_user_ids",
+            lambda: user_service.get_user_ids([fixtures["username"], "user_0"]),
+            reads,
+            1,
+        ),
+        (
+            "UserService.get_unread_counters",
+            lambda: user_service.get_unread_counters(user_id),
+            reads,
+            1,
+        ),
+        (
+            "UserService.get_profile_pictures",
+            user_service.get_profile_pictures,
+            max(reads // 10, 1),
+            1,
+        ),
+        (
+            "UserService.update_user",
+            lambda: user_service.update_user(user_id, bio=f"bio {next(counter)}"),
+            writes,
+            1,
+        ),
+        ("UserService.mark_read", lambda: user_service.mark_read(user_id), writes, 1),
+        # Dominated by password hashing, so it is called fewer times
+        ("UserService.insert_user", new_user, max(writes // 10, 1), 1),
+        ("MessageService.count", message_service.count, reads, 1),
+        ("MessageService.retrieve_messages", message_service.retrieve_messages, reads, 1),
+        (
+            "MessageService.retrieve_messages(deep)",
+            lambda: message_service.retrieve_messages(
+                initial_load=False, counter=fixtures["deep_offset"]
+            ),
+            reads,
+            1,
+        ),
+        ("MessageService.history_page", message_service.history_page, reads, 1),
+        (
+            "MessageService.history_page(shallow)",
+            lambda: message_service.history_page(before=fixtures["shallow"]),
+            reads,
+            1,
+        ),
+        (
+            "MessageService.history_page(deep)",
+            lambda: message_service.history_page(before=fixtures["deep"]),
+            reads,
+            1,
+        ),
+        (
+            "MessageService.user_history_page",
+            lambda: message_service.user_history_page(user_id),
+            reads,
+            1,
+        ),
+        (
+            "MessageService.moderation_revision",
+            message_service.moderation_revision,
+            reads,
+            1,
+        ),
+        (
+            "MessageService.get_attachment",
+            lambda: message_service.get_attachment(attachment_id),
+            reads,
+            1,
+        ),
+        (
+            "MessageService.insert_attachment",
+            lambda: message_service.insert_attachment("bench.png", "image/png", 1024, user_id),
+            writes,
+            1,
+        ),
+        (
+            "MessageService.set_attachment_thumbnail",
+            lambda: message_service.set_attachment_thumbnail(attachment_id, "bench.webp"),
+            writes,
+            1,
+        ),
+        (
+            "MessageService.edit_message",
+            lambda: message_service.edit_message(
+                edited_id, user_id, f"Edited message {next(counter)}"
+            ),
+            writes,
+            1,
+        ),
+        ("MessageService.insert_message", new_message, writes, 1),
+        (
+            f"MessageService.insert_message(x{args.threads})",
+            new_message,
+            writes * args.threads,
+            args.threads,
+        ),
+    ]
+
+
+def compare(results, baseline, tolerance):
+    """Print p50 latency change of every method against baseline results
+    and return names of methods slower than tolerance (percent) allows"""
+    regressions = []
+    print(f"\n{'method':<44}{'baseline p50':>14}{'p50':>12}{'change':>10}")
+    for name, row in results.items():
+        before = baseline.get(name)
+        if before is None:
+            print(f"{name:<44}{'-':>14}{row['p50_us']:>12.1f}{'new':>10}")
+            continue
+        change = (row["p50_us"] - before["p50_us"]) / before["p50_us"] * 100
+        flag = ""
+        if change > tolerance:
+            regressions.append(name)
+            flag = "  slower"
+        print(f"{name:<44}{before['p50_us']:>14.1f}{row['p50_us']:>12.1f}{change:>9.1f}%{flag}")
+    return regressions
+
+
+def main():
+    """Seed dataset, run benchmark and print, save or compare results"""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--dataset", choices=DATASETS, default="10k")
+    parser.add_argument("--users", type=int, default=100)
+    parser.add_argument("--database-url")
+    parser.add_argument("--calls", type=int, default=1000, help="Calls of each read method.")
+    parser.add_argument("--write-calls", type=int, default=200, help="Calls of each write method.")
+    parser.add_argument("--threads", type=int, default=8, help="Threads of concurrent inserts.")
+    parser.add_argument("--output", type=Path, help="Write results as JSON to this file.")
+    parser.add_argument("--baseline", type=Path, help="Compare with results saved earlier.")
+    parser.add_argument(
+        "--tolerance", type=float, default=10.0, help="Allowed p50 slowdown, percent."
+    )
+    args = parser.parse_args()
+
+    if args.database_url is None:
+        directory = tempfile.mkdtemp(prefix="bench_services_")
+        args.database_url = f"sqlite:///{directory}/chat.db"
+
+    engine = create_engine(args.database_url, **engine_options(args.database_url))
+    register_sqlite_pragmas(engine)
+    dataset = prepare_dataset(engine, args.users, DATASETS[args.dataset])
+    fixtures = dataset_fixtures(engine, dataset)
+
+    user_service = UserService(engine)
+    message_service = MessageService(engine)
+
+    results = {}
+    print(f"{'method':<44}{'mean, us':>11}{'p50, us':>11}{'p95, us':>11}{'ops/s':>10}")
+    for name, call, calls, threads in benchmark_cases(
+        user_service, message_service, fixtures, args
+    ):
+        row = measure(call, calls, threads)
+        results[name] = row
+        print(
+            f"{name:<44}{row['mean_us']:>11.1f}{row['p50_us']:>11.1f}"
+            f"{row['p95_us']:>11.1f}{row['ops_per_s']:>10.0f}"
+        )
+
+    engine.dispose()
+
+    if args.output:
+        report = {
+            "created": datetime.now(timezone.utc).isoformat(),
+            "backend": engine.dialect.name,
+            "python": platform.python_version(),
+            "dataset": dataset,
+            "results": results,
+        }
+        args.output.write_text(json.dumps(report, indent=2))
+        print(f"\nResults written to {args.output}")
+
+    if args.baseline:
+        baseline = json.loads(args.baseline.read_text())
+        if baseline["dataset"] != dataset:
+            print(f"\nBaseline dataset differs: {baseline['dataset']}")
+        regressions = compare(results, baseline["results"], args.tolerance)
+        if regressions:
+            print(f"\n{len(regressions)} methods slower than {args.tolerance}% tolerance")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,157 @@
+"""Microbenchmark: legacy ORM queries vs prebuilt statements of the service layer.
+
+Runs against an in-memory SQLite database seeded with a handful of rows, so
+the timings are dominated by Python-side statement construction and
+compilation, which is exactly what the prebuilt statements cut.
+
+Usage (from the repository root):
+    python benchmarks/bench_statements.py [--calls N]
+"""
+
+import argparse
+import sys
+import time
+import warnings
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "flask_chat"))
+
+# pylint: disable=wrong-import-position
+from sqlalchemy import create_engine
+from sqlalchemy.exc import LegacyAPIWarning
+from sqlalchemy.orm import sessionmaker
+
+from models import Base, Message, Role, User
+from services import MessageService, UserService
+from statements import register_statement_stats, statement_cache_stats
+from utils.constants import MSG_LOAD_BATCH
+from utils.helpers import time_ordered_id
+
+
+def seed(engine):
+    """Create schema and insert a few users and messages, return user ids"""
+    Base.metadata.create_all(engine)
+    session = sessionmaker(engine)()
+    session.add(Role(role_id=3, role_name="User"))
+    user_ids = [time_ordered_id() for _ in range(5)]
+    for i, user_id in enumerate(user_ids):
+        session.add(
+            User(
+                user_id=user_id, username=f"user_{i}", passwd="x",
+                email=f"user_{i}@example.com", role_id=3,
+            )
+        )
+    for i in range(20):
+        session.add(
+            Message(
+                message_id=time_ordered_id(), message_content=f"message {i}",
+                message_timestamp=str(1700000000 + i), message_edited=False,
+                user_id=user_ids[i % 5],
+            )
+        )
+    session.commit()
+    session.close()
+    return user_ids
+
+
+def legacy_get_user_by_id(session_factory, identity):
+    """get_user_by_id as it was implemented with ORM Query objects"""
+    session = session_factory()
+    try:
+        return session.query(User).get(identity)
+    finally:
+        session.close()
+
+
+def legacy_get_user_info(session_factory, **kwargs):
+    """get_user_info as it was implemented with ORM Query objects"""
+    session = session_factory()
+    try:
+        return session.query(User).filter_by(**kwargs).all()
+    finally:
+        session.close()
+
+
+def legacy_retrieve_messages(session_factory):
+    """retrieve_messages (initial load) as it was implemented with ORM Query objects"""
+    session = session_factory()
+    try:
+        query = session.query(
+            Message.message_id,
+            Message.message_content,
+            Message.message_timestamp,
+            Message.message_edited,
+            User.user_id,
+            User.username,
+        ).join(User, Message.user_id == User.user_id)
+        return query.offset(
+            0
+            if session.query(Message).count() < MSG_LOAD_BATCH
+            else session.query(Message).count() - MSG_LOAD_BATCH
+        ).limit(MSG_LOAD_BATCH).all()
+    finally:
+        session.close()
+
+
+def measure(func, calls):
+    """Return CPU microseconds per call after a short warm-up"""
+    for _ in range(min(calls, 100)):
+        func()
+    start = time.process_time()
+    for _ in range(calls):
+        func()
+    return (time.process_time() - start) / calls * 1e6
+
+
+def main():
+    """Run benchmark and print comparison table"""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--calls", type=int, default=5000)
+    args = parser.parse_args()
+
+    # The legacy Query.get() path is measured on purpose
+    warnings.simplefilter("ignore", LegacyAPIWarning)
+
+    engine = create_engine("sqlite://")
+    user_id = seed(engine)[1]
+    register_statement_stats(engine)
+    session_factory = sessionmaker(engine)
+
+    user_service = UserService(engine)
+    message_service = MessageService(engine)
+
+    cases = [
+        (
+            "get_user_by_id",
+            lambda: legacy_get_user_by_id(session_factory, user_id),
+            lambda: user_service.get_user_by_id(user_id),
+        ),
+        (
+            "get_user_info(username)",
+            lambda: legacy_get_user_info(session_factory, username="user_1"),
+            lambda: user_service.get_user_info(username="user_1"),
+        ),
+        (
+            "retrieve_messages",
+            lambda: legacy_retrieve_messages(session_factory),
+            message_service.retrieve_messages,
+        ),
+    ]
+
+    print(f"{'query':<26}{'before, us':>12}{'after, us':>12}{'saved':>9}")
+    for name, before, after in cases:
+        before_us = measure(before, args.calls)
+        after_us = measure(after, args.calls)
+        saved = (before_us - after_us) / before_us * 100
+        print(f"{name:<26}{before_us:>12.1f}{after_us:>12.1f}{saved:>8.1f}%")
+
+    print("\nStatement cache stats:")
+    for name, stats in statement_cache_stats().items():
+        print(
+            f"  {name:<18} executions={stats['executions']:<8} "
+            f"hits={stats['cache_hits']:<8} ratio={stats['hit_ratio']:.3f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
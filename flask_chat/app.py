@@ -3,44 +3,281 @@
 import logging
 from os import getenv
 from datetime import timedelta
-from flask import Flask, redirect, render_template
-from flask_socketio import SocketIO
-from flask_jwt_extended import JWTManager, get_jwt_identity, jwt_required
 
-# from forms import MessageForm
-from utils.constants import MSG_MAX_LENGTH, SESSION_EXPIRY
-from services import UserService, MessageService
+import click
+from flask import Flask, current_app, redirect
+from flask.cli import with_appcontext
+from flask_socketio import SocketIO
+from flask_jwt_extended import JWTManager
+
+from broadcast import BroadcastCoalescer
+from database import create_schema, seed_database
+from events import register_events
+from health import health_bp
+from extensions import EXTENSION_NAME, AppServices, get_services
+from storage import check_storage, create_storage
+from maintenance import MaintenanceWorker, run_maintenance
+from metrics import StatsBroadcaster, live_stats
+from models import configure_password_hasher
+from presence import PresenceBroadcaster, presence
+from profiler import SamplingProfiler
+from services import conn_string
+from utils.constants import (
+    SESSION_EXPIRY,
+    PROFILE_PICTURE_STORAGE_PATH,
+    ATTACHMENT_STORAGE_PATH,
+    ATTACHMENT_UPLOAD_PATH,
+    ATTACHMENT_UPLOAD_TTL,
+    STATIC_FILES_PATH,
+    ASSETS_OUTPUT_PATH,
+    ASSETS_URL_PREFIX,
+    MAINTENANCE_INTERVAL,
+    MAINTENANCE_BATCH_SIZE,
+    PROFILE_PICTURE_GRACE_PERIOD,
+    SLOW_QUERY_MS,
+    PRESENCE_TICK,
+    ARGON2_PARAMS_PATH,
+    ARGON2_TARGET_MS,
+    ARGON2_MAX_MEMORY,
+    ARGON2_PARALLELISM,
+)
+from utils.assets import asset_url, build_assets
+from utils.password_params import calibrate, load_params, save_params
 from views import views_bp
 
-# Define app
-app = Flask(__name__)
-app.debug = True
-
-# Define app configurations
-# JWT
-app.config["SECRET_KEY"] = getenv("FLASK_SECRET_KEY")
-app.config["JWT_ACCESS_TOKEN_EXPIRES"] = timedelta(seconds=SESSION_EXPIRY)
-app.config["JWT_TOKEN_LOCATION"] = ["cookies"]
-app.config["JWT_CSRF_CHECK_FORM"] = True
-
-# Content validation
-app.config["MAX_CONTENT_LENGTH"] = 10 * 1024 * 1024
-
-app.register_blueprint(views_bp)
-
-# Create socket handle
-socket = SocketIO(app)
-socket.init_app(app, cors_allowed_origins="*")
+logger = logging.getLogger("gunicorn.access")
 
-# Create jwt manager handler
-jwt = JWTManager(app)
-jwt.init_app(app)
+# Create jwt manager handler, bound to applications in `create_app`
+jwt = JWTManager()
+
+
+def create_app(config=None):
+    """Build and configure an application instance. Engine and services are
+    created lazily on first use, so building an app is cheap and several
+    configured instances can live in one process.
+
+    ## Parameters:
+        **config** (_dict_, optional):
+        Configuration values overriding defaults taken from environment.
+        Defaults to _None_.
+
+    ### Returns:
+        _Flask_:
+        configured application.
+    """
+    app = Flask(__name__)
+    app.debug = True
+
+    # Define app configurations
+    # JWT
+    app.config["SECRET_KEY"] = getenv("FLASK_SECRET_KEY")
+    app.config["JWT_ACCESS_TOKEN_EXPIRES"] = timedelta(seconds=SESSION_EXPIRY)
+    app.config["JWT_TOKEN_LOCATION"] = ["cookies"]
+    app.config["JWT_CSRF_CHECK_FORM"] = True
+
+    # Content validation
+    app.config["MAX_CONTENT_LENGTH"] = 10 * 1024 * 1024
+
+    # Database
+    app.config["DATABASE_URL"] = getenv("DATABASE_URL", conn_string)
+    app.config["ASYNC_DATABASE_URL"] = getenv("ASYNC_DATABASE_URL")
+
+    # Serving mode: "eventlet" workers or "asgi" (see asgi.py), where
+    # Socket.IO is served by an asyncio server and views run in threads
+    app.config["SERVER_MODE"] = getenv("SERVER_MODE", "eventlet")
+
+    # Profile pictures storage: "local" sharded directories or "s3" object store
+    app.config["PROFILE_PICTURE_STORAGE"] = getenv("PROFILE_PICTURE_STORAGE", "local")
+    app.config["PROFILE_PICTURE_STORAGE_PATH"] = PROFILE_PICTURE_STORAGE_PATH
+    app.config["S3_ENDPOINT_URL"] = getenv("S3_ENDPOINT_URL")
+    app.config["S3_BUCKET"] = getenv("S3_BUCKET", "profile-pictures")
+    app.config["S3_PREFIX"] = getenv("S3_PREFIX", "")
+    app.config["S3_ACCESS_KEY_ID"] = getenv("S3_ACCESS_KEY_ID")
+    app.config["S3_SECRET_ACCESS_KEY"] = getenv("S3_SECRET_ACCESS_KEY")
+    app.config["S3_REGION"] = getenv("S3_REGION")
+
+    # Image attachments: stored like profile pictures, in their own directory
+    # or bucket; unfinished chunked uploads are spooled on local disk
+    app.config["ATTACHMENT_STORAGE_PATH"] = ATTACHMENT_STORAGE_PATH
+    app.config["S3_ATTACHMENT_BUCKET"] = getenv("S3_ATTACHMENT_BUCKET", "attachments")
+    app.config["ATTACHMENT_UPLOAD_PATH"] = getenv("ATTACHMENT_UPLOAD_PATH", ATTACHMENT_UPLOAD_PATH)
+    app.config["ATTACHMENT_UPLOAD_TTL"] = ATTACHMENT_UPLOAD_TTL
+
+    # Maintenance: message retention (0 keeps messages forever) and
+    # sweeping of unreferenced profile pictures; interval 0 disables worker
+    app.config["MESSAGE_RETENTION_DAYS"] = int(getenv("MESSAGE_RETENTION_DAYS", "0"))
+    app.config["MAINTENANCE_INTERVAL"] = int(
+        getenv("MAINTENANCE_INTERVAL", str(MAINTENANCE_INTERVAL))
+    )
+    app.config["MAINTENANCE_BATCH_SIZE"] = MAINTENANCE_BATCH_SIZE
+    app.config["PROFILE_PICTURE_GRACE_PERIOD"] = PROFILE_PICTURE_GRACE_PERIOD
+
+    # Fingerprinted static assets
+    app.config["ASSETS_OUTPUT_PATH"] = getenv("ASSETS_OUTPUT_PATH", ASSETS_OUTPUT_PATH)
+    app.config["ASSETS_URL_PREFIX"] = ASSETS_URL_PREFIX
+
+    # Message queue relaying Socket.IO broadcasts between worker processes,
+    # e.g. redis://redis:6379/0; required when more than one worker serves
+    app.config["SOCKETIO_MESSAGE_QUEUE"] = getenv("SOCKETIO_MESSAGE_QUEUE") or None
+
+    # Chat broadcasts sent within this many milliseconds share one frame;
+    # 0 sends every message in its own frame
+    app.config["BROADCAST_TICK_MS"] = int(getenv("BROADCAST_TICK_MS", "0"))
+
+    # Statements running at least this many milliseconds are logged with plan
+    app.config["SLOW_QUERY_MS"] = float(getenv("SLOW_QUERY_MS", str(SLOW_QUERY_MS)))
+
+    # Argon2 parameters written by `flask calibrate-argon2`
+    app.config["ARGON2_PARAMS_PATH"] = getenv("ARGON2_PARAMS_PATH", ARGON2_PARAMS_PATH)
+
+    if config:
+        app.config.update(config)
+
+    argon2_params = load_params(app.config["ARGON2_PARAMS_PATH"])
+    if argon2_params:
+        configure_password_hasher(**argon2_params)
+        logger.debug("Argon2 parameters loaded: %s", argon2_params)
+
+    # Init custom services, built on first access
+    app.extensions[EXTENSION_NAME] = AppServices(app.config)
+
+    app.jinja_env.globals["asset_url"] = asset_url
+    app.register_blueprint(views_bp)
+    app.register_blueprint(health_bp)
+    app.cli.add_command(build_assets_command)
+    app.cli.add_command(maintenance_command)
+    app.cli.add_command(calibrate_argon2_command)
+    app.cli.add_command(init_db_command)
+    app.cli.add_command(seed_command)
+    app.cli.add_command(check_storage_command)
+
+    # Create socket handle; in ASGI mode it only runs background tasks
+    asgi_mode = app.config["SERVER_MODE"] == "asgi"
+    socket = SocketIO(
+        app,
+        cors_allowed_origins="*",
+        async_mode="threading" if asgi_mode else None,
+        message_queue=app.config["SOCKETIO_MESSAGE_QUEUE"],
+    )
+    register_events(socket)
+
+    tick = app.config["BROADCAST_TICK_MS"] / 1000
+    app.extensions["broadcast"] = BroadcastCoalescer(socket, tick) if tick else None
+
+    # Maintenance runs in the serving process, started with the first request
+    maintenance = MaintenanceWorker(app, socket)
+    app.extensions["maintenance"] = maintenance
+    if app.config["MAINTENANCE_INTERVAL"]:
+        app.before_request(maintenance.start)
+
+    # Live stats: connected sockets are sampled from the first request on
+    stats = StatsBroadcaster(socket, live_stats)
+    app.extensions["stats"] = stats
+    if not asgi_mode:
+        app.before_request(stats.start)
+
+    # Presence: silent clients expire and deltas are broadcast once per tick,
+    # from the first authenticated connection on
+    app.extensions["presence"] = PresenceBroadcaster(socket, presence, PRESENCE_TICK)
+
+    # Sampling profiler of this worker, driven from the admin panel
+    app.extensions["profiler"] = SamplingProfiler()
+
+    jwt.init_app(app)
+
+    return app
+
+
+@click.command("build-assets")
+@with_appcontext
+def build_assets_command():
+    """Fingerprint and pre-compress static files for nginx to serve"""
+    output_path = current_app.config["ASSETS_OUTPUT_PATH"]
+    manifest = build_assets(STATIC_FILES_PATH, output_path)
+    print(f"{len(manifest)} assets written to {output_path}")
+
+
+@click.command("maintenance")
+@with_appcontext
+def maintenance_command():
+    """Purge expired messages and sweep unreferenced profile pictures once"""
+    report = run_maintenance(get_services(), current_app.config)
+    print(
+        f"{report['messages_deleted']} messages deleted, "
+        f"{report['files_deleted']} files deleted, "
+        f"{report['uploads_deleted']} unfinished uploads deleted, "
+        f"{report['bytes_reclaimed']} bytes reclaimed in {report['duration']}s"
+    )
 
-logger = logging.getLogger("gunicorn.access")
 
-# Init custom services
-user_service = UserService()
-message_service = MessageService()
+@click.command("init-db")
+@with_appcontext
+def init_db_command():
+    """Create tables from model metadata and insert default roles"""
+    create_schema(get_services().engine)
+    print(f"Schema created in {get_services().engine.url!r}")
+
+
+@click.command("seed")
+@click.option("--users", default=10, show_default=True, help="Users to create.")
+@click.option("--messages", default=1000, show_default=True, help="Messages to create.")
+@click.option("--password", default="password123", show_default=True,
+              help="Password of every seeded user.")
+@with_appcontext
+def seed_command(users, messages, password):
+    """Fill database with generated users and messages"""
+    users, messages = seed_database(get_services().engine, users, messages, password)
+    print(f"{users} users and {messages} messages inserted")
+
+
+@click.command("check-storage")
+@click.option("--backend", type=click.Choice(["local", "s3"]), default=None,
+              help="Backend to check instead of PROFILE_PICTURE_STORAGE.")
+@with_appcontext
+def check_storage_command(backend):
+    """Save, read back and delete a file in profile pictures and attachments
+    storages; exits with status 1 if any of them fails"""
+    config = dict(current_app.config)
+    if backend:
+        config["PROFILE_PICTURE_STORAGE"] = backend
+
+    failed = False
+    for label, root, bucket in (
+        ("profile pictures", config["PROFILE_PICTURE_STORAGE_PATH"], config["S3_BUCKET"]),
+        ("attachments", config["ATTACHMENT_STORAGE_PATH"], config["S3_ATTACHMENT_BUCKET"]),
+    ):
+        try:
+            storage = create_storage(config, root, bucket)
+            with current_app.test_request_context():
+                check_storage(storage)
+        except Exception as error:  # pylint: disable=broad-exception-caught
+            failed = True
+            print(f"{label}: failed, {error}")
+            continue
+        print(f"{label}: ok ({type(storage).__name__})")
+
+    if failed:
+        raise SystemExit(1)
+
+
+@click.command("calibrate-argon2")
+@click.option("--target-ms", default=ARGON2_TARGET_MS, show_default=True,
+              help="Latency budget of one password hash.")
+@click.option("--max-memory", default=ARGON2_MAX_MEMORY, show_default=True,
+              help="Upper bound of hash memory in KiB.")
+@click.option("--parallelism", default=ARGON2_PARALLELISM, show_default=True)
+@with_appcontext
+def calibrate_argon2_command(target_ms, max_memory, parallelism):
+    """Measure argon2 on this host and save parameters hitting the budget.
+    Users with older hashes are rehashed on their next login."""
+    params = calibrate(target_ms, max_memory, parallelism)
+    path = current_app.config["ARGON2_PARAMS_PATH"]
+    save_params(path, params)
+    print(
+        f"time_cost={params['time_cost']} memory_cost={params['memory_cost']} "
+        f"parallelism={params['parallelism']}: {params['measured_ms']} ms per hash, "
+        f"written to {path}"
+    )
 
 
 # Custom exceptions for error responses
@@ -64,81 +301,3 @@ def invalid_token_loader_error(error):
     """Custom handler for invalid jwt token provided when accessing an endpoint"""
     logger.error(error)
     return redirect("/login")
-
-
-@socket.on("message")
-@jwt_required()
-def handle_message(msg):
-    """handle initial messages sent via websocket and saves them to database"""
-
-    # If recevived message length is more than required
-    if len(msg.get("message")) > MSG_MAX_LENGTH:
-        logger.debug("Message length limit exceeded")
-        socket.emit("message_too_long", {"msg_length": MSG_MAX_LENGTH})
-        return
-
-    # Getting the username of message sender
-    user_id = get_jwt_identity()
-
-    # Retrieve message
-    message = msg.get("message")
-    logger.debug("Message received: %s", message)
-
-    # Save to database
-    result = message_service.insert_message(message, user_id)
-    if not result:
-        logger.error("An error occured while inserting message")
-        return render_template(
-            "error.html", message="An error occured while inserting message"
-        )
-
-    username = user_service.get_user_by_id(user_id).username
-    logger.debug("Current user: %s", username)
-
-    # Append username info to pass through socket
-    msg["username"] = username
-    socket.emit("message", msg)
-
-
-@socket.on("request_message")
-@jwt_required()
-def load_messages(cnt):
-    """handle socket request to load bunch of messages from database"""
-
-    logger.debug("Messages loaded: %s", cnt)
-
-    # Validation piece: handles random other tampered values in global
-    # counter variable than numbers
-    try:
-        int(cnt)
-    except ValueError:
-        logger.error(
-            """Variale 'cnt' value is not expected: not convertable to int
-            Current 'cnt' value - %s""",
-            cnt,
-        )
-        return
-
-    # if no messages to load remain sends event via socket
-    if message_service.count() <= int(cnt):
-        socket.emit("loading_finished")
-        return
-
-    # retrieve batch of messages or whatever less that is remained
-    messages = message_service.retrieve_messages(
-        initial_load=False, counter=int(cnt), jsonify=True
-    )
-    if not messages:
-        logger.error("An error occured while loading messages.")
-        return
-
-    logger.debug("%s messages retrieved from collection.", len(messages))
-
-    # sort messages in reversed order by date to send via socket event one by one
-    for msg in sorted(messages, key=lambda x: x.message_timestamp, reverse=True):
-        message = {
-            "username": msg.username,
-            "message": msg.message_content,
-            "timestamp": str(msg.message_timestamp),
-        }
-        socket.emit("load", message)
@@ -0,0 +1,47 @@
+"""ASGI entry point: asyncio Socket.IO server with non-blocking database
+access. HTTP views stay synchronous and run in a thread pool.
+
+Run with `uvicorn --factory asgi:create_asgi_app` or
+`gunicorn -k uvicorn.workers.UvicornWorker "asgi:create_asgi_app()"`.
+"""
+
+import socketio
+from a2wsgi import WSGIMiddleware
+
+from app import create_app
+from async_events import AsyncEvents
+from async_services import AsyncServices
+from utils.constants import ASGI_VIEW_THREADS
+
+
+def create_asgi_app(config=None):
+    """Build ASGI application serving Socket.IO events on the event loop and
+    routing other requests to the Flask application.
+
+    ## Parameters:
+        **config** (_dict_, optional):
+        Configuration values overriding defaults taken from environment.
+        Defaults to _None_.
+
+    ### Returns:
+        _ASGIApp_:
+        application to be served by an ASGI server.
+    """
+    app = create_app({**(config or {}), "SERVER_MODE": "asgi"})
+
+    services = AsyncServices(app.config)
+    app.extensions["async_services"] = services
+
+    # Broadcasts reach clients of other workers through the message queue
+    queue = app.config["SOCKETIO_MESSAGE_QUEUE"]
+    sio = socketio.AsyncServer(
+        async_mode="asgi",
+        cors_allowed_origins="*",
+        client_manager=socketio.AsyncRedisManager(queue) if queue else None,
+    )
+    app.extensions["async_socketio"] = sio
+    AsyncEvents(sio, app, services)
+
+    return socketio.ASGIApp(
+        sio, other_asgi_app=WSGIMiddleware(app, workers=ASGI_VIEW_THREADS)
+    )
@@ -0,0 +1,458 @@
+"""Socket.IO event handlers of the ASGI serving mode"""
+
+import time
+import asyncio
+import logging
+from functools import wraps
+from http.cookies import SimpleCookie
+
+from flask_jwt_extended import decode_token
+from flask_jwt_extended.exceptions import JWTExtendedException
+from jwt import PyJWTError
+
+from broadcast import AsyncBroadcastCoalescer
+from loadshed import load_shedder, retry_later
+from metrics import (
+    HISTORY_REQUESTS,
+    MESSAGES,
+    SOCKETS,
+    STATS_NAMESPACE,
+    live_stats,
+)
+from moderation import ModerationBatches
+from payloads import JSON, encoding_room, negotiate_encoding
+from presence import DELTA_EVENT, SNAPSHOT_EVENT, presence
+from unread import parse_mentions, unread_cache, user_room
+from event_logic import (
+    Rejected,
+    accept_attachment,
+    change_broadcast,
+    deletion_author,
+    load_payload,
+    mention_targets,
+    message_broadcasts,
+    moderated_author,
+    moderation_outcome,
+    parse_change,
+    parse_history_counter,
+    parse_moderation_request,
+    parse_new_message,
+    parse_user_messages_request,
+    read_counters,
+    user_messages_payload,
+)
+from utils.constants import (
+    MODERATION_BATCH_SIZE,
+    MODERATION_PAUSE,
+    PRESENCE_TICK,
+    PROFILE_HISTORY_PAGE,
+)
+
+logger = logging.getLogger("gunicorn.access")
+
+
+def token_identity(app, environ):
+    r"""Return identity and expiry of the access token cookie of a handshake.
+
+    ## Parameters:
+        **app** (_Flask_):
+        Application whose JWT settings are used. <br>
+
+        **environ** (_dict_):
+        Environment of the Socket.IO handshake request.
+
+    ### Returns:
+        _Tuple\[str, int\]_:
+        user identifier and token expiry. _None_ if token is missing or invalid.
+    """
+    cookies = SimpleCookie(environ.get("HTTP_COOKIE", ""))
+    cookie = cookies.get(app.config["JWT_ACCESS_COOKIE_NAME"])
+    if cookie is None:
+        return None
+
+    try:
+        with app.app_context():
+            token = decode_token(cookie.value)
+    except (PyJWTError, JWTExtendedException) as error:
+        logger.debug("Socket handshake with invalid token: %s", error)
+        return None
+
+    return token["sub"], token["exp"]
+
+
+def answer_rejection(handler):
+    """Send refusal of the event back to the requesting client"""
+
+    @wraps(handler)
+    async def decorated_function(self, sid, *args):
+        try:
+            return await handler(self, sid, *args)
+        except Rejected as rejected:
+            await self.sio.emit(rejected.event, rejected.payload, to=sid)
+            return None
+
+    return decorated_function
+
+
+class AsyncEvents:
+    """Handlers of chat and live stats events served by an `AsyncServer`.
+    Clients authenticate once with the handshake cookie; the token expiry
+    is kept in the socket session and checked on every event.
+
+    ## Parameters:
+        **sio** (_AsyncServer_):
+        Socket.IO server handlers are registered on. <br>
+
+        **app** (_Flask_):
+        Application providing configuration. <br>
+
+        **services** (_AsyncServices_):
+        Async services of the application.
+    """
+
+    def __init__(self, sio, app, services):
+        self.sio = sio
+        self.app = app
+        self.services = services
+        self.stats_listeners = set()
+        self._stats_started = False
+        self._presence_started = False
+
+        tick = app.config["BROADCAST_TICK_MS"] / 1000
+        self.coalescer = AsyncBroadcastCoalescer(sio, tick) if tick else None
+
+        sio.on("connect", self.handle_connect)
+        sio.on("disconnect", self.handle_disconnect)
+        sio.on("heartbeat", self.handle_heartbeat)
+        sio.on("request_presence", self.handle_request_presence)
+        sio.on("message", self.handle_message)
+        sio.on("edit_message", self.handle_edit_message)
+        sio.on("delete_message", self.handle_delete_message)
+        sio.on("request_message", self.load_messages)
+        sio.on("mark_read", self.handle_mark_read)
+        sio.on("moderate", self.handle_moderate)
+        sio.on("request_user_messages", self.load_user_messages)
+        sio.on("connect", self.handle_stats_connect, namespace=STATS_NAMESPACE)
+        sio.on("disconnect", self.handle_stats_disconnect, namespace=STATS_NAMESPACE)
+
+    async def identity(self, sid, namespace=None):
+        """Return user of the socket while its token is valid"""
+        session = await self.sio.get_session(sid, namespace=namespace)
+        if session.get("expires", 0) < time.time():
+            return None
+        return session["user_id"]
+
+    async def handle_connect(self, sid, environ, auth=None):
+        """authenticate client, put it to the room of its payload encoding and
+        make its user online"""
+
+        identity = token_identity(self.app, environ)
+        if identity is None:
+            return False
+
+        user_id, expires = identity
+        encoding = negotiate_encoding(auth)
+
+        await self.sio.save_session(
+            sid, {"user_id": user_id, "expires": expires, "encoding": encoding}
+        )
+        await self.sio.enter_room(sid, encoding_room(encoding))
+        await self.sio.enter_room(sid, user_room(user_id))
+        self.start_stats()
+
+        # Username is looked up once per connection, never per heartbeat
+        user = await self.services.user_service.get_user_by_id(user_id)
+        if user:
+            presence.connect(sid, user.username)
+            self.start_presence()
+        logger.debug("Client connected with %s encoding", encoding)
+        return True
+
+    async def handle_disconnect(self, sid, reason=None):  # pylint: disable=unused-argument
+        """make user offline if it was its last connected client"""
+        presence.disconnect(sid)
+
+    async def handle_heartbeat(self, sid):
+        """keep user of the client online"""
+        presence.heartbeat(sid)
+
+    async def handle_request_presence(self, sid):
+        """send users online on this worker to the requesting client"""
+        await self.sio.emit(SNAPSHOT_EVENT, presence.snapshot(), to=sid)
+
+    @answer_rejection
+    async def handle_message(self, sid, msg):
+        """save message sent via websocket and broadcast it to every client"""
+
+        user_id = await self.identity(sid)
+        if user_id is None:
+            await self.sio.disconnect(sid)
+            return
+
+        message = parse_new_message(msg)
+
+        attachment_id = msg.get("attachment")
+        if attachment_id is not None:
+            attachment = await self.services.message_service.get_attachment(str(attachment_id))
+            attachment_id = accept_attachment(attachment_id, attachment, user_id)
+
+        user_service = self.services.user_service
+        mentioned_ids = mention_targets(
+            await user_service.get_user_ids(parse_mentions(message)), user_id
+        )
+
+        with load_shedder.track():
+            result = await self.services.message_service.insert_message(
+                message, user_id, attachment_id, mentioned_ids
+            )
+            if not result:
+                logger.error("An error occured while inserting message")
+                return
+
+            live_stats.record(MESSAGES)
+            user = await user_service.get_user_by_id(user_id)
+
+        if self.coalescer is not None:
+            await self.coalescer.publish(
+                user.username,
+                message,
+                result["message_timestamp"],
+                attachment_id,
+                result["message_id"],
+            )
+        else:
+            for room, payload in message_broadcasts(
+                user.username, message, result, attachment_id
+            ):
+                await self.sio.emit("message", payload, to=room)
+
+        # Only sockets of mentioned users learn about their new counters
+        for mentioned_id in mentioned_ids:
+            counters = await user_service.get_unread_counters(mentioned_id)
+            if counters is not None:
+                unread_cache.put(mentioned_id, counters)
+                await self.sio.emit("unread", counters, to=user_room(mentioned_id))
+
+    @answer_rejection
+    async def handle_edit_message(self, sid, data):
+        """replace content of a message sent by the client's user and tell
+        every client the new content"""
+
+        user_id = await self.identity(sid)
+        if user_id is None:
+            await self.sio.disconnect(sid)
+            return
+
+        message_id, message = parse_change(data, edit=True)
+
+        with load_shedder.track():
+            edited = await self.services.message_service.edit_message(
+                message_id, user_id, message
+            )
+        await self.sio.emit(*change_broadcast(edited, message_id, message, edit=True))
+
+    @answer_rejection
+    async def handle_delete_message(self, sid, data):
+        """delete a message sent by the client's user, or any message on
+        behalf of a moderator, and tell every client to remove it"""
+
+        user_id = await self.identity(sid)
+        if user_id is None:
+            await self.sio.disconnect(sid)
+            return
+
+        message_id, _ = parse_change(data, edit=False)
+
+        with load_shedder.track():
+            user = await self.services.user_service.get_user_by_id(user_id)
+            if not user:
+                return
+
+            deleted = await self.services.message_service.delete_message(
+                message_id, deletion_author(user)
+            )
+        await self.sio.emit(*change_broadcast(deleted, message_id, None, edit=False))
+
+    async def handle_mark_read(self, sid):
+        """mark all messages as read by the client's user and reset its
+        counters on every socket of the user"""
+
+        user_id = await self.identity(sid)
+        if user_id is None:
+            await self.sio.disconnect(sid)
+            return
+
+        if not await self.services.user_service.mark_read(user_id):
+            logger.error("An error occured while marking messages as read")
+            return
+
+        counters = read_counters()
+        unread_cache.put(user_id, counters)
+        await self.sio.emit("unread", counters, to=user_room(user_id))
+
+    @answer_rejection
+    async def handle_moderate(self, sid, data):
+        """delete or hide messages in bulk on behalf of a moderator and tell
+        every client which messages to remove"""
+
+        user_id = await self.identity(sid)
+        if user_id is None:
+            await self.sio.disconnect(sid)
+            return
+
+        user_service = self.services.user_service
+        moderator = await user_service.get_user_by_id(user_id)
+        moderation = parse_moderation_request(moderator, data)
+
+        author = None
+        if "username" in moderation:
+            author = moderated_author(
+                moderation, await user_service.get_user_ids([moderation["username"]])
+            )
+
+        # Same batches as `moderation.moderate_messages`, awaiting between them
+        batches = ModerationBatches(moderation, author, MODERATION_BATCH_SIZE)
+        changed = None
+        while True:
+            batch = await self.services.message_service.moderate_messages(
+                batches.criteria, batches.cursor, MODERATION_BATCH_SIZE, batches.hide
+            )
+            if batch is None:
+                break
+            if not batches.advance(batch):
+                changed = batches.changed
+                break
+            await asyncio.sleep(MODERATION_PAUSE)
+
+        removed, done = moderation_outcome(moderator, moderation, changed)
+        if removed is not None:
+            await self.sio.emit(*removed)
+        await self.sio.emit("moderation_done", done, to=sid)
+
+    async def shed(self, sid, event_name):
+        """Answer the event with `retry_later` and return _True_ when overloaded"""
+        retry = retry_later(event_name)
+        if retry is None:
+            return False
+        await self.sio.emit("retry_later", retry, to=sid)
+        return True
+
+    async def load_messages(self, sid, cnt):
+        """send batch of older messages to the requesting client"""
+
+        if await self.identity(sid) is None:
+            await self.sio.disconnect(sid)
+            return
+
+        loaded = parse_history_counter(cnt)
+        if loaded is None or await self.shed(sid, "request_message"):
+            return
+
+        live_stats.record(HISTORY_REQUESTS)
+        service = self.services.message_service
+
+        with load_shedder.track():
+            if await service.count() <= loaded:
+                await self.sio.emit("loading_finished", to=sid)
+                return
+
+            messages = await service.retrieve_messages(
+                initial_load=False, counter=loaded, jsonify=True
+            )
+
+        if not messages:
+            logger.error("An error occured while loading messages.")
+            return
+
+        session = await self.sio.get_session(sid)
+        await self.sio.emit("load", load_payload(messages, session["encoding"]), to=sid)
+
+    async def load_user_messages(self, sid, data):
+        """send page of messages of one user, newest first, to the requesting
+        client; `before` of the answer requests the next page"""
+
+        if await self.identity(sid) is None:
+            await self.sio.disconnect(sid)
+            return
+
+        request_data = parse_user_messages_request(data)
+        if request_data is None or await self.shed(sid, "request_user_messages"):
+            return
+        username, before = request_data
+
+        with load_shedder.track():
+            user_ids = await self.services.user_service.get_user_ids([username])
+            if user_ids is None:
+                logger.error("An error occured while loading user messages.")
+                return
+            if username not in user_ids:
+                await self.sio.emit(
+                    "user_messages", user_messages_payload(username, None, JSON), to=sid
+                )
+                return
+
+            live_stats.record(HISTORY_REQUESTS)
+            messages = await self.services.message_service.user_history_page(
+                user_ids[username], before=before, limit=PROFILE_HISTORY_PAGE
+            )
+
+        if messages is None:
+            logger.error("An error occured while loading user messages.")
+            return
+
+        session = await self.sio.get_session(sid)
+        await self.sio.emit(
+            "user_messages",
+            user_messages_payload(username, messages, session["encoding"]),
+            to=sid,
+        )
+
+    async def handle_stats_connect(self, sid, environ, auth=None):  # pylint: disable=unused-argument
+        """admit privileged users to live stats and send them the whole window"""
+
+        identity = token_identity(self.app, environ)
+        user = (
+            await self.services.user_service.get_user_by_id(identity[0]) if identity else None
+        )
+        if not user or not user.is_privileged():
+            logger.info("Live stats connection refused")
+            return False
+
+        self.stats_listeners.add(sid)
+        self.start_stats()
+        await self.sio.emit(
+            "stats_snapshot", live_stats.snapshot(), to=sid, namespace=STATS_NAMESPACE
+        )
+        return True
+
+    async def handle_stats_disconnect(self, sid, reason=None):  # pylint: disable=unused-argument
+        """stop sending live stats to disconnected client"""
+
+        self.stats_listeners.discard(sid)
+
+    def start_stats(self):
+        """Start sampling connected sockets once per process"""
+        if not self._stats_started:
+            self._stats_started = True
+            self.sio.start_background_task(self._broadcast_stats)
+
+    async def _broadcast_stats(self):
+        while True:
+            await self.sio.sleep(1)
+            live_stats.record(SOCKETS, len(self.sio.eio.sockets))
+
+            if self.stats_listeners:
+                await self.sio.emit("stats_tick", live_stats.tick(), namespace=STATS_NAMESPACE)
+
+    def start_presence(self):
+        """Start expiring silent clients once per process"""
+        if not self._presence_started:
+            self._presence_started = True
+            self.sio.start_background_task(self._broadcast_presence)
+
+    async def _broadcast_presence(self):
+        while True:
+            await self.sio.sleep(PRESENCE_TICK)
+            delta = presence.tick()
+            if delta is not None:
+                await self.sio.emit(DELTA_EVENT, delta)
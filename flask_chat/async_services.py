@@ -0,0 +1,693 @@
+"""Asyncio counterparts of the services, used by the ASGI serving mode"""
+
+import asyncio
+import logging
+from datetime import datetime
+from functools import cached_property
+
+from sqlalchemy import select, update
+from sqlalchemy.engine import make_url
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.ext.asyncio import create_async_engine
+
+from database import register_sqlite_pragmas, track_engine
+from loadshed import register_load_shedding
+from metrics import register_query_timing
+from querylog import TracedAsyncSessionmaker, query_log
+from models import UnreadCounter, User, Message
+from statements import (
+    ADD_MENTIONS,
+    ADVANCE_MESSAGE_SEQUENCE,
+    ADVANCE_MODERATION_REVISION,
+    ALL_USERS,
+    ATTACHMENT_BY_ID,
+    DELETE_MESSAGE,
+    DELETE_OWN_MESSAGE,
+    EDIT_MESSAGE,
+    MARK_READ,
+    MESSAGE_SEQUENCE,
+    MESSAGES_COUNT,
+    MESSAGES_PAGE,
+    PROFILE_PICTURES,
+    PURGE_MESSAGES,
+    UNREAD_COUNTERS,
+    USER_HISTORY_BEFORE,
+    USER_HISTORY_LATEST,
+    USER_BY_ID,
+    USER_LOOKUPS,
+    USERS_BY_USERNAMES,
+    moderation_batch,
+    register_statement_stats,
+)
+from utils.helpers import time_ordered_id
+from utils.constants import MSG_LOAD_BATCH, ADMIN_ROLE_ID, USER_ROLE_ID
+
+# Initialise logger
+logger = logging.getLogger("gunicorn.access")
+
+# Blocking drivers and their asyncio counterparts
+ASYNC_DRIVERS = {
+    "postgresql": "postgresql+asyncpg",
+    "postgresql+psycopg2": "postgresql+asyncpg",
+    "sqlite": "sqlite+aiosqlite",
+    "sqlite+pysqlite": "sqlite+aiosqlite",
+}
+
+
+def async_database_url(url):
+    """Return database URL with its driver replaced by an asyncio one.
+
+    ## Parameters:
+        **url** (_str_):
+        Database URL of the blocking engine.
+
+    ### Returns:
+        _URL_:
+        URL usable by `create_async_engine`.
+    """
+    url = make_url(url)
+    return url.set(drivername=ASYNC_DRIVERS.get(url.drivername, url.drivername))
+
+
+class AsyncUserService:
+    """Operate user-related transactions without blocking the event loop"""
+
+    def __init__(self, engine):
+        self.session = TracedAsyncSessionmaker(engine)
+
+    async def get_user_by_id(self, identity):
+        """Return User object by its identifier.
+
+        ## Parameters:
+            **identity** (_str_):
+            User unique identifier.
+
+        ### Returns:
+            _User_:
+            User object. _None_ if exception caught.
+        """
+        session = self.session()
+        logger.debug("Starting a session.")
+
+        try:
+            result = await session.scalars(USER_BY_ID, {"user_id": identity})
+            return result.first()
+        except SQLAlchemyError as error:
+            logger.error("An error occured while establishing conection with PostgreSQL instance: %s", error)
+            return None
+        finally:
+            logger.debug("Closing session.")
+            await session.close()
+
+    async def get_user_info(self, **kwargs):
+        r"""Retrieve list of users from connected database. Provide additional
+        arguments to filter results by column (i.e. `WHERE` clause).
+
+        ### Returns:
+            _List\[User\]_:
+            list of User objects. _None_ if an exception is caught.
+        """
+        session = self.session()
+        logger.debug("Starting a session.")
+
+        try:
+            if not kwargs:
+                results = await session.scalars(ALL_USERS)
+            elif len(kwargs) == 1 and next(iter(kwargs)) in USER_LOOKUPS:
+                [(column, value)] = kwargs.items()
+                results = await session.scalars(USER_LOOKUPS[column], {column: value})
+            else:
+                results = await session.scalars(select(User).filter_by(**kwargs))
+
+            return results.all()
+        except SQLAlchemyError as error:
+            logger.error("An error occured while establishing conection with PostgreSQL instance: %s", error)
+            return None
+        finally:
+            logger.debug("Closing session.")
+            await session.close()
+
+    async def get_profile_pictures(self):
+        r"""Return names of all profile pictures referenced by users.
+
+        ### Returns:
+            _Set\[str\]_:
+            referenced file names. _None_ if an exception is caught.
+        """
+        session = self.session()
+        logger.debug("Starting a session.")
+
+        try:
+            return set(await session.scalars(PROFILE_PICTURES))
+        except SQLAlchemyError as error:
+            logger.error("An error occured while establishing conection with PostgreSQL instance: %s", error)
+            return None
+        finally:
+            logger.debug("Closing session.")
+            await session.close()
+
+    async def insert_user(self, username, password, email):
+        """Insert row in a database which with all user info provided.
+        Password is hashed in a worker thread, as argon2 is CPU bound.
+
+        ## Parameters:
+            **username** (_str_):
+            Username to insert. <br>
+
+            **password** (_str_):
+            Plain text password. Will be hashed with argon2 algorithm. <br>
+
+            **email** (_str_):
+            Email.
+
+        ### Returns:
+            _bool_:
+            _True_ if operation is successful, otherwise _False_.
+        """
+        session = self.session()
+        logger.debug("Starting a session.")
+
+        try:
+            if await session.scalar(select(User.user_id).limit(1)):
+                role = USER_ROLE_ID
+            else:
+                role = ADMIN_ROLE_ID
+
+            new_user = User(
+                user_id=time_ordered_id(),
+                username=username,
+                email=email,
+                role_id=role,
+            )
+            await asyncio.to_thread(new_user.set_password, password)
+
+            session.add(new_user)
+            # Messages sent before registration are not unread
+            session.add(
+                UnreadCounter(
+                    user_id=new_user.user_id,
+                    read_mark=await session.scalar(MESSAGE_SEQUENCE) or 0,
+                    mentions=0,
+                )
+            )
+            await session.commit()
+            return True
+        except SQLAlchemyError as error:
+            logger.error("An error occured while establishing conection with PostgreSQL instance: %s", error)
+            return False
+        finally:
+            logger.debug("Closing session.")
+            await session.close()
+
+    async def update_user(self, identity, update_dict=None, **kwargs):
+        """Update User info with provided arguments.
+
+        ## Parameters:
+            **identity** (_str_):
+            User unique identification string. <br>
+
+            **update_dict** (_dict_, optional):
+            Dictionary of values to be updated, according to column names. Required to
+            use only either `update_dict` or specify parameters separately. Defaults to None.
+
+        ### Returns:
+            _bool_:
+            _True_ if update operation completed successfully, otherwise _False_.
+        """
+        values = update_dict or kwargs
+        if not values:
+            logger.debug("No update to execute, as parameters were not provided.")
+            return False
+
+        session = self.session()
+        logger.debug("Starting a session.")
+
+        try:
+            result = await session.execute(
+                update(User).where(User.user_id == identity).values(values)
+            )
+            await session.commit()
+        except SQLAlchemyError as error:
+            logger.error("An error occured while establishing conection with PostgreSQL instance: %s", error)
+            return False
+        finally:
+            logger.debug("Closing session.")
+            await session.close()
+
+        if result.rowcount < 1:
+            logger.debug("No rows affected after update operation.")
+            return False
+
+        logger.debug("User info updated successfully: %s row(s) affected.", result.rowcount)
+        return True
+
+
+    async def get_user_ids(self, usernames):
+        r"""Resolve usernames to user identifiers. Unknown usernames are skipped.
+
+        ## Parameters:
+            **usernames** (_List\[str\]_):
+            Usernames to look up.
+
+        ### Returns:
+            _dict\[str, UUID\]_:
+            user identifiers by username. _None_ if exception is caught.
+        """
+        if not usernames:
+            return {}
+
+        session = self.session()
+        logger.debug("Starting a session.")
+
+        try:
+            rows = await session.execute(USERS_BY_USERNAMES, {"usernames": list(usernames)})
+            return {row.username: row.user_id for row in rows}
+        except SQLAlchemyError as error:
+            logger.error("An error occured while establishing conection with PostgreSQL instance: %s", error)
+            return None
+        finally:
+            logger.debug("Closing session.")
+            await session.close()
+
+    async def get_unread_counters(self, identity):
+        """Return count of unread messages and mentions of user.
+
+        ## Parameters:
+            **identity** (_str_):
+            User unique identifier.
+
+        ### Returns:
+            _dict_:
+            `unread` and `mentions` counts. _None_ if exception is caught.
+        """
+        session = self.session()
+        logger.debug("Starting a session.")
+
+        try:
+            row = (await session.execute(UNREAD_COUNTERS, {"user_id": identity})).first()
+            if row is None:
+                return {"unread": 0, "mentions": 0}
+            return {"unread": row.unread, "mentions": row.mentions}
+        except SQLAlchemyError as error:
+            logger.error("An error occured while establishing conection with PostgreSQL instance: %s", error)
+            return None
+        finally:
+            logger.debug("Closing session.")
+            await session.close()
+
+    async def mark_read(self, identity):
+        """Mark every message sent so far as read by user and reset mentions.
+
+        ## Parameters:
+            **identity** (_str_):
+            User unique identifier.
+
+        ### Returns:
+            _bool_:
+            _True_ if operation is successful, otherwise _False_.
+        """
+        session = self.session()
+        logger.debug("Starting a session.")
+
+        try:
+            result = await session.execute(MARK_READ, {"reader_id": identity})
+            if result.rowcount < 1:
+                session.add(
+                    UnreadCounter(
+                        user_id=identity,
+                        read_mark=await session.scalar(MESSAGE_SEQUENCE) or 0,
+                        mentions=0,
+                    )
+                )
+            await session.commit()
+            return True
+        except SQLAlchemyError as error:
+            logger.error("An error occured while establishing conection with PostgreSQL instance: %s", error)
+            return False
+        finally:
+            logger.debug("Closing session.")
+            await session.close()
+
+
+class AsyncMessageService:
+    """Operate messages-related transactions without blocking the event loop"""
+
+    def __init__(self, engine):
+        self.session = TracedAsyncSessionmaker(engine)
+
+    async def count(self):
+        """Return total count of messages stored in database. Return _None_
+        if exception is caught.
+        """
+        session = self.session()
+        logger.debug("Starting a session.")
+
+        try:
+            return await session.scalar(MESSAGES_COUNT)
+        except SQLAlchemyError as error:
+            logger.error("An error occured while establishing conection with PostgreSQL instance: %s", error)
+            return None
+        finally:
+            logger.debug("Closing session.")
+            await session.close()
+
+    async def insert_message(self, message, user_id, attachment_id=None, mentioned=()):
+        r"""Insert all provided message info to database. Message sequence
+        and mention counters of mentioned users advance in the same transaction.
+
+        ## Parameters:
+            **message_content** (_str_):
+            Message to be inserted. <br>
+
+            **user_id** (_str_):
+            Author's unique identifier. <br>
+
+            **attachment_id** (_str_, optional):
+            Identifier of attached image. Defaults to _None_. <br>
+
+            **mentioned** (_List\[UUID\]_, optional):
+            Identifiers of users mentioned in message. Defaults to none.
+
+        ### Returns:
+            _dict_:
+            inserted message as JSON if operation is completed successfully,
+            otherwise _False_.
+        """
+        session = self.session()
+        logger.debug("Starting a session.")
+
+        try:
+            new_message = Message(
+                message_id=time_ordered_id(),
+                message_content=message,
+                message_timestamp=str(datetime.now().timestamp()),
+                message_edited=False,
+                user_id=user_id,
+                attachment_id=attachment_id,
+            )
+
+            inserted = new_message.to_json()
+
+            session.add(new_message)
+            await session.execute(ADVANCE_MESSAGE_SEQUENCE)
+            if mentioned:
+                await session.execute(ADD_MENTIONS, {"user_ids": list(mentioned)})
+            await session.commit()
+            return inserted
+        except SQLAlchemyError as error:
+            logger.error("An error occured while establishing conection with PostgreSQL instance: %s", error)
+            return False
+        finally:
+            logger.debug("Closing session.")
+            await session.close()
+
+    async def get_attachment(self, attachment_id):
+        """Return Attachment object by its identifier.
+
+        ## Parameters:
+            **attachment_id** (_str_):
+            Attachment unique identifier.
+
+        ### Returns:
+            _Attachment_:
+            Attachment object. _None_ if not found or exception caught.
+        """
+        session = self.session()
+        logger.debug("Starting a session.")
+
+        try:
+            result = await session.scalars(ATTACHMENT_BY_ID, {"attachment_id": attachment_id})
+            return result.first()
+        except SQLAlchemyError as error:
+            logger.error("An error occured while establishing conection with PostgreSQL instance: %s", error)
+            return None
+        finally:
+            logger.debug("Closing session.")
+            await session.close()
+
+    async def purge_messages(self, cutoff, limit):
+        """Delete one batch of messages older than cutoff.
+
+        ## Parameters:
+            **cutoff** (_float_):
+            POSIX timestamp. Messages sent before it are deleted. <br>
+
+            **limit** (_int_):
+            Maximum number of messages deleted in this batch.
+
+        ### Returns:
+            _int_:
+            count of deleted messages. _None_ if exception is caught.
+        """
+        session = self.session()
+        logger.debug("Starting a session.")
+
+        try:
+            result = await session.execute(
+                PURGE_MESSAGES, {"cutoff": str(cutoff), "limit": limit}
+            )
+            await session.commit()
+            return result.rowcount
+        except SQLAlchemyError as error:
+            logger.error("An error occured while establishing conection with PostgreSQL instance: %s", error)
+            return None
+        finally:
+            logger.debug("Closing session.")
+            await session.close()
+
+    async def moderate_messages(self, criteria, cursor, limit, hide=False):
+        r"""Delete or hide one batch of messages matching criteria, newest
+        first, advancing moderation revision if any changed.
+
+        ## Parameters:
+            **criteria** (_dict_):
+            Values bound to present criteria, see `moderation.batch_criteria`. <br>
+
+            **cursor** (_UUID_):
+            Only messages older than this identifier are changed. <br>
+
+            **limit** (_int_):
+            Maximum number of messages changed in this batch. <br>
+
+            **hide** (_bool_, optional):
+            Set _True_ to hide messages instead of deleting them. Defaults to _False_.
+
+        ### Returns:
+            _List\[UUID\]_:
+            identifiers of changed messages. _None_ if exception is caught.
+        """
+        statement = moderation_batch(hide, **dict.fromkeys(criteria, True))
+
+        session = self.session()
+        logger.debug("Starting a session.")
+
+        try:
+            changed = (
+                await session.scalars(statement, {**criteria, "cursor": cursor, "limit": limit})
+            ).all()
+            if changed:
+                await session.execute(ADVANCE_MODERATION_REVISION)
+            await session.commit()
+            return changed
+        except SQLAlchemyError as error:
+            logger.error("An error occured while establishing conection with PostgreSQL instance: %s", error)
+            return None
+        finally:
+            logger.debug("Closing session.")
+            await session.close()
+
+    async def edit_message(self, message_id, user_id, message):
+        """Replace content of a message sent by user and mark it edited.
+        History revision advances in the same transaction.
+
+        ## Parameters:
+            **message_id** (_UUID_):
+            Identifier of the message. <br>
+
+            **user_id** (_str_):
+            Identifier of the user editing it; only its author may. <br>
+
+            **message** (_str_):
+            New content.
+
+        ### Returns:
+            _bool_:
+            _True_ if message was edited, _False_ if user has no such message.
+            _None_ if exception is caught.
+        """
+        session = self.session()
+        logger.debug("Starting a session.")
+
+        try:
+            result = await session.execute(
+                EDIT_MESSAGE, {"target": message_id, "author": user_id, "content": message}
+            )
+            if result.rowcount:
+                await session.execute(ADVANCE_MODERATION_REVISION)
+            await session.commit()
+            return bool(result.rowcount)
+        except SQLAlchemyError as error:
+            logger.error("An error occured while establishing conection with PostgreSQL instance: %s", error)
+            return None
+        finally:
+            logger.debug("Closing session.")
+            await session.close()
+
+    async def delete_message(self, message_id, user_id=None):
+        """Delete one message. History revision advances in the same
+        transaction.
+
+        ## Parameters:
+            **message_id** (_UUID_):
+            Identifier of the message. <br>
+
+            **user_id** (_str_, optional):
+            Identifier of the user deleting it; only its author may. _None_
+            deletes message of any author, for moderators. Defaults to _None_.
+
+        ### Returns:
+            _bool_:
+            _True_ if message was deleted, _False_ if there is no such message
+            of the user. _None_ if exception is caught.
+        """
+        session = self.session()
+        logger.debug("Starting a session.")
+
+        try:
+            if user_id is None:
+                result = await session.execute(DELETE_MESSAGE, {"target": message_id})
+            else:
+                result = await session.execute(
+                    DELETE_OWN_MESSAGE, {"target": message_id, "author": user_id}
+                )
+            if result.rowcount:
+                await session.execute(ADVANCE_MODERATION_REVISION)
+            await session.commit()
+            return bool(result.rowcount)
+        except SQLAlchemyError as error:
+            logger.error("An error occured while establishing conection with PostgreSQL instance: %s", error)
+            return None
+        finally:
+            logger.debug("Closing session.")
+            await session.close()
+
+    async def retrieve_messages(self, initial_load=True, counter=None, jsonify=False):
+        r"""Retrieve messages from database ready to be rendered on page.
+
+        ## Parameters:
+            **initial_load** (_bool_, optional):
+            Set _True_ to load only the newest batch of messages, otherwise
+            _False_. Defaults to _True_. <br>
+
+            **counter** (_int_, optional):
+            Counter of already loaded messages. Applies only if `inital_load`
+            is set to _False_. Defaults to _None_. <br>
+
+            **jsonify** (bool, optional):
+            Set _True_ to return mappings instead of rows. Defaults to False.
+
+        ### Returns:
+            _List\[Row\]_ | _List\[dict\]_:
+            retrieved messages as join result of tables messages and users.
+        """
+        session = self.session()
+        logger.debug("Starting a session.")
+
+        try:
+            total_count = await session.scalar(MESSAGES_COUNT)
+            already_loaded = 0 if initial_load else counter
+
+            result = (
+                await session.execute(
+                    MESSAGES_PAGE,
+                    {
+                        "offset": max(total_count - MSG_LOAD_BATCH - already_loaded, 0),
+                        "limit": MSG_LOAD_BATCH,
+                    },
+                )
+            ).all()
+            logger.debug("%s rows retrieved.", len(result))
+        except SQLAlchemyError as error:
+            logger.error("An error occured while establishing conection with PostgreSQL instance: %s", error)
+            return None
+        finally:
+            logger.debug("Closing session.")
+            await session.close()
+
+        if jsonify:
+            return [message._mapping for message in result]
+
+        return result
+
+    async def user_history_page(self, user_id, before=None, limit=MSG_LOAD_BATCH):
+        r"""Retrieve page of messages sent by one user, newest first.
+
+        ## Parameters:
+            **user_id** (_UUID_):
+            Author's unique identifier. <br>
+
+            **before** (_UUID_, optional):
+            Identifier of a message; only older messages are returned. Newest
+            messages are returned if not specified. Defaults to _None_. <br>
+
+            **limit** (_int_, optional):
+            Maximum number of messages. Defaults to `MSG_LOAD_BATCH`.
+
+        ### Returns:
+            _List\[dict\]_:
+            messages with author username. _None_ if exception is caught.
+        """
+        session = self.session()
+        logger.debug("Starting a session.")
+
+        try:
+            if before is None:
+                result = await session.execute(
+                    USER_HISTORY_LATEST, {"author": user_id, "limit": limit}
+                )
+            else:
+                result = await session.execute(
+                    USER_HISTORY_BEFORE, {"author": user_id, "before": before, "limit": limit}
+                )
+            return [dict(row._mapping) for row in result]
+        except SQLAlchemyError as error:
+            logger.error("An error occured while establishing conection with PostgreSQL instance: %s", error)
+            return None
+        finally:
+            logger.debug("Closing session.")
+            await session.close()
+
+
+class AsyncServices:
+    """Async engine and services of one application instance, built on
+    first use"""
+
+    def __init__(self, config):
+        self.config = config
+
+    @cached_property
+    def engine(self):
+        """Async SQLAlchemy engine shared by all async services"""
+        engine = create_async_engine(
+            self.config.get("ASYNC_DATABASE_URL")
+            or async_database_url(self.config["DATABASE_URL"]),
+            hide_parameters=True,
+        )
+        # Hooks live on the blocking core the async engine drives
+        track_engine(engine.sync_engine)
+        register_sqlite_pragmas(engine.sync_engine)
+        register_statement_stats(engine.sync_engine)
+        register_query_timing(engine.sync_engine)
+        register_load_shedding(engine.sync_engine)
+        query_log.register(engine.sync_engine, self.config["SLOW_QUERY_MS"])
+        return engine
+
+    @cached_property
+    def user_service(self):
+        """Shared AsyncUserService instance"""
+        return AsyncUserService(self.engine)
+
+    @cached_property
+    def message_service(self):
+        """Shared AsyncMessageService instance"""
+        return AsyncMessageService(self.engine)
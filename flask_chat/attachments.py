@@ -0,0 +1,318 @@
+"""Chunked upload of image attachments and background thumbnail generation"""
+
+import io
+import os
+import re
+import sys
+import time
+import uuid
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+from storage import StorageError
+
+logger = logging.getLogger("gunicorn.access")
+
+CONTENT_RANGE = re.compile(r"^bytes (\d+)-(\d+)/(\d+)$")
+
+# Total size declared by the first chunk, kept next to the upload file
+TOTAL_SUFFIX = ".total"
+
+
+class UploadError(Exception):
+    """Raised when a chunk can not be accepted. Carries HTTP status and count
+    of bytes received so far, so client knows where to resume."""
+
+    def __init__(self, message, status, received=None):
+        super().__init__(message)
+        self.status = status
+        self.received = received
+
+
+def parse_content_range(header):
+    r"""Parse `Content-Range` header of an uploaded chunk.
+
+    ## Parameters:
+        **header** (_str_):
+        Header value, e.g. `bytes 0-262143/1048576`.
+
+    ### Returns:
+        _Tuple\[int, int, int\]_:
+        first byte, last byte and total size. _None_ if header is malformed.
+    """
+    match = CONTENT_RANGE.match(header or "")
+    if match is None:
+        return None
+
+    start, end, total = (int(group) for group in match.groups())
+    if start > end or end >= total:
+        return None
+    return start, end, total
+
+
+class UploadSpool:
+    """Unfinished uploads kept on local disk, one file per upload under the
+    uploader's directory. Chunks are appended in order and copied in small
+    blocks, so memory used per request does not depend on chunk or file size.
+    The total size is fixed by the first chunk; later chunks must repeat it.
+
+    ## Parameters:
+        **root** (_str_):
+        Directory of unfinished uploads, shared by workers of one host. <br>
+
+        **chunk_size** (_int_):
+        Largest accepted chunk in bytes. <br>
+
+        **max_bytes** (_int_):
+        Largest accepted file in bytes. <br>
+
+        **copy_block** (_int_):
+        Bytes read from request at once.
+    """
+
+    def __init__(self, root, chunk_size, max_bytes, copy_block):
+        self.root = root
+        self.chunk_size = chunk_size
+        self.max_bytes = max_bytes
+        self.copy_block = copy_block
+
+    def path(self, user_id, upload_id):
+        """Return path of unfinished upload. Only identifiers in canonical
+        UUID form are accepted, so paths never leave the uploader's directory.
+        """
+        try:
+            upload_id = str(uuid.UUID(upload_id))
+        except ValueError as error:
+            raise UploadError("Unknown upload", 404) from error
+        return os.path.join(self.root, str(user_id), upload_id)
+
+    def create(self, user_id):
+        """Start new upload.
+
+        ## Parameters:
+            **user_id** (_str_):
+            Uploader's unique identifier.
+
+        ### Returns:
+            _str_:
+            upload identifier.
+        """
+        upload_id = str(uuid.uuid4())
+        path = self.path(user_id, upload_id)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "xb"):
+            pass
+        return upload_id
+
+    def write_chunk(self, user_id, upload_id, content_range, stream):
+        r"""Append chunk to upload.
+
+        ## Parameters:
+            **user_id** (_str_):
+            Uploader's unique identifier. <br>
+
+            **upload_id** (_str_):
+            Upload identifier. <br>
+
+            **content_range** (_Tuple\[int, int, int\]_):
+            First byte, last byte and total size, as parsed by `parse_content_range`. <br>
+
+            **stream** (_BinaryIO_):
+            Request body holding the chunk.
+
+        ### Returns:
+            _int_:
+            count of bytes received so far.
+        """
+        start, end, total = content_range
+        path = self.path(user_id, upload_id)
+
+        if total > self.max_bytes:
+            raise UploadError(f"File exceeds {self.max_bytes} bytes", 413)
+        if end - start + 1 > self.chunk_size:
+            raise UploadError(f"Chunk exceeds {self.chunk_size} bytes", 413)
+
+        try:
+            file = open(path, "r+b")  # pylint: disable=consider-using-with
+        except FileNotFoundError as error:
+            raise UploadError("Unknown upload", 404) from error
+
+        with file:
+            received = file.seek(0, os.SEEK_END)
+            if start != received:
+                raise UploadError("Chunk does not continue upload", 409, received)
+            if total != self._declared_total(path, total, first=received == 0):
+                raise UploadError("Total size differs from the one declared first", 400)
+
+            remaining = end - start + 1
+            while remaining:
+                block = stream.read(min(self.copy_block, remaining))
+                if not block:
+                    # Client went away: drop partial chunk so it can be resent
+                    file.truncate(start)
+                    raise UploadError("Chunk is shorter than its range", 400, start)
+                file.write(block)
+                remaining -= len(block)
+
+            received = file.tell()
+
+        if received == total:
+            self._forget_total(path)
+        return received
+
+    def _declared_total(self, path, total, first):
+        """Return total size declared for upload, declaring `total` when
+        this is its first chunk"""
+        total_path = path + TOTAL_SUFFIX
+        if first:
+            try:
+                with open(total_path, "x", encoding="ascii") as file:
+                    file.write(str(total))
+                return total
+            except FileExistsError:
+                pass  # first chunk sent again after it was cut short
+
+        try:
+            with open(total_path, encoding="ascii") as file:
+                declared = int(file.read())
+        except FileNotFoundError as error:
+            raise UploadError("Unknown upload", 404) from error
+        except ValueError as error:
+            # First chunk is declaring it concurrently
+            raise UploadError("Chunk does not continue upload", 409, 0) from error
+
+        # Kept as long as the upload, which `sweep` judges by modification time
+        os.utime(total_path)
+        return declared
+
+    def _forget_total(self, path):
+        try:
+            os.remove(path + TOTAL_SUFFIX)
+        except FileNotFoundError:
+            pass
+
+    def discard(self, user_id, upload_id):
+        """Remove unfinished upload. Missing uploads are ignored."""
+        try:
+            path = self.path(user_id, upload_id)
+        except UploadError:
+            return
+
+        for name in (path, path + TOTAL_SUFFIX):
+            try:
+                os.remove(name)
+            except FileNotFoundError:
+                pass
+
+    def sweep(self, max_age):
+        """Remove uploads not written to for `max_age` seconds.
+
+        ### Returns:
+            _int_:
+            count of removed uploads.
+        """
+        threshold = time.time() - max_age
+        removed = 0
+
+        for root, _, files in os.walk(self.root):
+            for name in files:
+                path = os.path.join(root, name)
+                try:
+                    if os.stat(path).st_mtime < threshold:
+                        os.remove(path)
+                        removed += 1
+                except FileNotFoundError:
+                    continue
+
+        return removed
+
+
+def make_thumbnail(path, size):
+    r"""Render thumbnail of a verified image, keeping its aspect ratio.
+
+    ## Parameters:
+        **path** (_str_):
+        Image file. <br>
+
+        **size** (_Tuple\[int, int\]_):
+        Bounding box of thumbnail.
+
+    ### Returns:
+        _Tuple\[bytes, str\]_:
+        thumbnail content and its MIME type.
+    """
+    # Imported on first use: image libraries are only needed on upload paths
+    from PIL import Image  # pylint: disable=import-outside-toplevel
+
+    with Image.open(path) as image:
+        image.draft("RGB", size)  # JPEG decoder downscales while reading
+        image.thumbnail(size)
+
+        buffer = io.BytesIO()
+        if image.format == "PNG":
+            image.save(buffer, "PNG", optimize=True)
+            return buffer.getvalue(), "image/png"
+
+        image.convert("RGB").save(buffer, "JPEG", quality=80, optimize=True)
+        return buffer.getvalue(), "image/jpeg"
+
+
+def run_in_os_thread(function, *args):
+    """Call CPU-bound function in a native thread when the process runs on
+    eventlet: threads are green there, and C code that never yields would
+    stall every socket of the worker. Called directly otherwise."""
+    eventlet = sys.modules.get("eventlet")
+    if eventlet is None or not eventlet.patcher.is_monkey_patched("thread"):
+        return function(*args)
+
+    from eventlet import tpool  # pylint: disable=import-outside-toplevel
+
+    return tpool.execute(function, *args)
+
+
+class ThumbnailWorker:
+    """Generates thumbnails of uploaded attachments in background, so
+    requests finishing an upload never wait for image decoding. Images are
+    decoded and resized in a native thread, see `run_in_os_thread`.
+
+    ## Parameters:
+        **services** (_AppServices_):
+        Services of the application. <br>
+
+        **size** (_Tuple\[int, int\]_):
+        Bounding box of thumbnails.
+    """
+
+    def __init__(self, services, size):
+        self.services = services
+        self.size = size
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="thumbnails")
+
+    def submit(self, attachment_id, path):
+        """Schedule thumbnail generation. Source file is removed afterwards.
+
+        ## Parameters:
+            **attachment_id** (_UUID_):
+            Attachment unique identifier. <br>
+
+            **path** (_str_):
+            Local copy of the attached image.
+        """
+        self._executor.submit(self._generate, attachment_id, path)
+
+    def _generate(self, attachment_id, path):
+        storage = self.services.attachments
+        try:
+            data, content_type = run_in_os_thread(make_thumbnail, path, self.size)
+            name = storage.save(data, content_type=content_type)
+            if not self.services.message_service.set_attachment_thumbnail(attachment_id, name):
+                storage.delete_async(name)
+                return
+            logger.debug("Thumbnail of attachment %s is ready.", attachment_id)
+        except (OSError, StorageError):
+            logger.exception("Failed to generate thumbnail of attachment %s", attachment_id)
+        finally:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
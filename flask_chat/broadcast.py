@@ -0,0 +1,129 @@
+"""Coalescing of outgoing chat broadcasts into one frame per tick"""
+
+import time
+import logging
+import threading
+
+from payloads import ENCODINGS, encode_messages, encoding_room
+
+logger = logging.getLogger("gunicorn.access")
+
+# Batched event: a list of messages in the payload encoding of the client
+BATCH_EVENT = "messages"
+
+
+class _Coalescer:
+    """Buffer of messages waiting for the next tick. A message arriving
+    when nothing was sent during the last tick is flushed at once, so idle
+    chats get no added latency; during bursts messages are held until the
+    tick ends and leave together."""
+
+    def __init__(self, tick):
+        self.tick = tick
+        self._pending = []
+        self._scheduled = False
+        self._last_flush = 0.0
+        self._lock = threading.Lock()
+
+    def _add(self, row):
+        """Buffer message and return seconds until flush: 0 to flush now,
+        _None_ if a flush is already scheduled"""
+        with self._lock:
+            self._pending.append(row)
+            if self._scheduled:
+                return None
+
+            wait = self._last_flush + self.tick - time.monotonic()
+            if wait <= 0:
+                return 0
+
+            self._scheduled = True
+            return wait
+
+    def _take(self):
+        """Return buffered messages, starting a new tick"""
+        with self._lock:
+            rows, self._pending = self._pending, []
+            self._scheduled = False
+            self._last_flush = time.monotonic()
+        return rows
+
+
+class BroadcastCoalescer(_Coalescer):
+    """Coalescer emitting through a Flask-SocketIO server.
+
+    ## Parameters:
+        **socketio** (_SocketIO_):
+        Server whose encoding rooms receive the batches. <br>
+
+        **tick** (_float_):
+        Seconds messages may wait for others to share their frame.
+    """
+
+    def __init__(self, socketio, tick):
+        super().__init__(tick)
+        self.socketio = socketio
+
+    def publish(self, username, message, timestamp, attachment=None, message_id=None):
+        """Queue message for broadcast to every client"""
+        wait = self._add((username, message, timestamp, attachment, message_id))
+        if wait == 0:
+            self.flush()
+        elif wait is not None:
+            self.socketio.start_background_task(self._flush_later, wait)
+
+    def _flush_later(self, wait):
+        self.socketio.sleep(wait)
+        self.flush()
+
+    def flush(self):
+        """Send buffered messages, encoded once per encoding"""
+        rows = self._take()
+        if not rows:
+            return
+
+        logger.debug("Broadcasting batch of %s messages", len(rows))
+        for encoding in ENCODINGS:
+            self.socketio.emit(
+                BATCH_EVENT, encode_messages(rows, encoding), to=encoding_room(encoding)
+            )
+
+
+class AsyncBroadcastCoalescer(_Coalescer):
+    """Coalescer emitting through an asyncio Socket.IO server.
+
+    ## Parameters:
+        **sio** (_AsyncServer_):
+        Server whose encoding rooms receive the batches. <br>
+
+        **tick** (_float_):
+        Seconds messages may wait for others to share their frame.
+    """
+
+    def __init__(self, sio, tick):
+        super().__init__(tick)
+        self.sio = sio
+
+    async def publish(self, username, message, timestamp, attachment=None, message_id=None):
+        """Queue message for broadcast to every client"""
+        wait = self._add((username, message, timestamp, attachment, message_id))
+        if wait == 0:
+            await self.flush()
+        elif wait is not None:
+            self.sio.start_background_task(self._flush_later, wait)
+
+    async def _flush_later(self, wait):
+        await self.sio.sleep(wait)
+        await self.flush()
+
+    async def flush(self):
+        """Send buffered messages, encoded once per encoding"""
+        rows = self._take()
+        if not rows:
+            return
+
+        logger.debug("Broadcasting batch of %s messages", len(rows))
+        for encoding in ENCODINGS:
+            await self.sio.emit(
+                BATCH_EVENT, encode_messages(rows, encoding), to=encoding_room(encoding)
+            )
@@ -0,0 +1,213 @@
+"""Engine options per backend, schema creation and seeding"""
+
+import logging
+import time
+import weakref
+
+from sqlalchemy import event, insert, select, update
+from sqlalchemy.engine import make_url
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import StaticPool
+
+from models import Base, ChatCounter, Message, Role, UnreadCounter, User
+from utils.helpers import time_ordered_id
+from utils.constants import (
+    ADMIN_ROLE_ID,
+    MESSAGES_COUNTER,
+    MOD_ROLE_ID,
+    MODERATION_COUNTER,
+    USER_ROLE_ID,
+)
+
+logger = logging.getLogger("gunicorn.access")
+
+# Engines built in this process, see `dispose_engines`
+_engines = weakref.WeakSet()
+
+# Rows every database starts with
+DEFAULT_ROLES = {
+    ADMIN_ROLE_ID: "Admin",
+    MOD_ROLE_ID: "Moderator",
+    USER_ROLE_ID: "User",
+}
+
+
+def is_memory_database(url):
+    """Whether URL points to an in-memory SQLite database"""
+    url = make_url(url)
+    return url.get_backend_name() == "sqlite" and url.database in (None, "", ":memory:")
+
+
+def engine_options(url):
+    """Return `create_engine` arguments suited to the database backend.
+
+    An in-memory SQLite database lives as long as its connection, so all
+    sessions share a single connection. File-backed SQLite is used in WAL
+    mode, which lets readers proceed while a message is being written.
+
+    ## Parameters:
+        **url** (_str_):
+        Database URL.
+
+    ### Returns:
+        _dict_:
+        keyword arguments for `create_engine`.
+    """
+    # Failed statements are logged without values of their parameters
+    options = {"hide_parameters": True}
+    if make_url(url).get_backend_name() != "sqlite":
+        return options
+
+    options["connect_args"] = {"check_same_thread": False}
+    if is_memory_database(url):
+        options["poolclass"] = StaticPool
+    return options
+
+
+def _sqlite_pragmas(dbapi_connection, connection_record):  # pylint: disable=unused-argument
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA foreign_keys=ON")
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.close()
+
+
+def register_sqlite_pragmas(engine):
+    """Enable foreign keys and WAL journal on connections of a SQLite engine.
+
+    ## Parameters:
+        **engine** (_Engine_):
+        SQLAlchemy engine; engines of other backends are left untouched.
+    """
+    if engine.dialect.name == "sqlite" and not event.contains(
+        engine, "connect", _sqlite_pragmas
+    ):
+        event.listen(engine, "connect", _sqlite_pragmas)
+
+
+def track_engine(engine):
+    """Remember engine, so processes forked from this one can drop its
+    pooled connections with `dispose_engines`.
+
+    ## Parameters:
+        **engine** (_Engine_):
+        SQLAlchemy engine; the blocking core of an async engine.
+    """
+    _engines.add(engine)
+
+
+def dispose_engines():
+    """Replace connection pools of all engines built in this process. Called
+    in a worker right after fork: connections inherited from the parent are
+    dropped without being closed, so the parent can keep using them, and
+    the worker opens its own ones on demand.
+    """
+    for engine in list(_engines):
+        engine.dispose(close=False)
+        logger.debug("Connection pool of %r replaced after fork", engine.url)
+
+
+def create_schema(engine):
+    """Create missing tables from model metadata and insert default roles
+    and counters. Safe to run on an initialised database.
+
+    ## Parameters:
+        **engine** (_Engine_):
+        Engine of the target database.
+    """
+    Base.metadata.create_all(engine)
+
+    with sessionmaker(engine)() as session:
+        existing = set(session.scalars(select(Role.role_id)))
+        for role_id, role_name in DEFAULT_ROLES.items():
+            if role_id not in existing:
+                session.add(Role(role_id=role_id, role_name=role_name))
+        for counter_name in (MESSAGES_COUNTER, MODERATION_COUNTER):
+            if session.get(ChatCounter, counter_name) is None:
+                session.add(ChatCounter(counter_name=counter_name, counter_value=0))
+        session.commit()
+
+    logger.info("Database schema is ready")
+
+
+def seed_database(engine, users, messages, password, batch_size=1000):
+    r"""Insert generated users and messages. All users share one password,
+    hashed once, so seeding large datasets is bound by the database only.
+
+    ## Parameters:
+        **engine** (_Engine_):
+        Engine of the target database with schema created. <br>
+
+        **users** (_int_):
+        Number of users, named `user_<n>`. <br>
+
+        **messages** (_int_):
+        Number of messages, one per second up to now, authors in turn. <br>
+
+        **password** (_str_):
+        Password of every seeded user. <br>
+
+        **batch_size** (_int_, optional):
+        Rows per insert statement. Defaults to 1000.
+
+    ### Returns:
+        _Tuple\[int, int\]_:
+        count of inserted users and messages.
+    """
+    passwd = User().set_password(password)
+
+    with sessionmaker(engine)() as session:
+        # Continue numbering after previously seeded users
+        offset = len(session.scalars(select(User.user_id)).all())
+        user_ids = [time_ordered_id() for _ in range(users)]
+
+        if user_ids:
+            session.execute(
+                insert(User),
+                [
+                    {
+                        "user_id": user_id,
+                        "username": f"user_{offset + index}",
+                        "passwd": passwd,
+                        "email": f"user_{offset + index}@example.com",
+                        "role_id": USER_ROLE_ID,
+                    }
+                    for index, user_id in enumerate(user_ids)
+                ],
+            )
+            session.execute(
+                insert(UnreadCounter),
+                [{"user_id": user_id, "read_mark": 0, "mentions": 0} for user_id in user_ids],
+            )
+        else:
+            # Messages are written by existing users
+            user_ids = list(session.scalars(select(User.user_id)))
+            if not user_ids:
+                logger.error("No users to author seeded messages.")
+                return 0, 0
+
+        start = time.time() - messages
+        for first in range(0, messages, batch_size):
+            session.execute(
+                insert(Message),
+                [
+                    {
+                        "message_id": time_ordered_id(),
+                        "message_content": f"Seeded message {index}",
+                        "message_timestamp": f"{start + index:.6f}",
+                        "message_edited": False,
+                        "user_id": user_ids[index % len(user_ids)],
+                    }
+                    for index in range(first, min(first + batch_size, messages))
+                ],
+            )
+
+        # Seeded messages advance the sequence unread counters are based on
+        session.execute(
+            update(ChatCounter)
+            .where(ChatCounter.counter_name == MESSAGES_COUNTER)
+            .values(counter_value=ChatCounter.counter_value + messages)
+        )
+        session.commit()
+
+    return users, messages
@@ -3,7 +3,7 @@
 from functools import wraps
 from flask import abort
 from flask_jwt_extended import jwt_required, get_jwt_identity
-from services import UserService
+from extensions import user_service
 
 
 def privilege_required(f):
@@ -12,7 +12,7 @@ def privilege_required(f):
     @wraps(f)
     @jwt_required()
     def decorated_function(*args, **kwargs):
-        user = UserService().get_user_by_id(get_jwt_identity())
+        user = user_service.get_user_by_id(get_jwt_identity())
         if not user.is_privileged():
             return abort(403)
         return f(*args, **kwargs)
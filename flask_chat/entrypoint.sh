@@ -3,8 +3,14 @@
 # activates prepared virtual environment 
 . ./.venv/bin/activate
 
-# generates secret key for application
-export FLASK_SECRET_KEY="$(tr -dc 'A-Za-z0-9' < /dev/urandom | head -c 256)"
+# fingerprints and pre-compresses static files for nginx
+flask --app app build-assets
 
-# runs the app
-gunicorn --worker-class eventlet -w 1 --bind 0.0.0.0:5000 -c logging_config.py app:app --log-level "${LOGGING_LEVEL}"
+# runs the app with one worker per CPU (see gunicorn_config.py): eventlet
+# workers by default, asyncio workers with SERVER_MODE=asgi; exec lets
+# gunicorn receive stop and reload signals sent to the container
+if [ "${SERVER_MODE}" = "asgi" ]; then
+    exec gunicorn -c gunicorn_config.py "asgi:create_asgi_app()"
+else
+    exec gunicorn -c gunicorn_config.py "app:create_app()"
+fi
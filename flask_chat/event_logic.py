@@ -0,0 +1,362 @@
+"""Request parsing, permission decisions and payloads of Socket.IO events,
+shared by the handlers of both serving modes. Handlers in `events` and
+`async_events` only run the database calls and emits around them."""
+
+import uuid
+import logging
+
+from moderation import TOMBSTONE_EVENT, parse_moderation, tombstone
+from payloads import (
+    DELETE_EVENT,
+    EDIT_EVENT,
+    ENCODINGS,
+    encode_message,
+    encode_messages,
+    encoding_room,
+    parse_message_change,
+)
+from utils.constants import MSG_MAX_LENGTH, PROFILE_HISTORY_PAGE
+
+logger = logging.getLogger("gunicorn.access")
+
+# Errors sent back when a message change fails in the database, or is refused
+CHANGE_ERRORS = {
+    True: ("Edit failed, please repeat it", "Only your own messages can be edited"),
+    False: ("Deletion failed, please repeat it", "Message not found or not yours"),
+}
+
+
+class Rejected(Exception):
+    """Event refused: `event` with `payload` is sent back to the requesting
+    client only.
+
+    ## Parameters:
+        **event** (_str_):
+        Event answering the client. <br>
+
+        **payload** (_dict_):
+        Reason of the refusal.
+    """
+
+    def __init__(self, event, payload):
+        super().__init__(event)
+        self.event = event
+        self.payload = payload
+
+
+def parse_new_message(msg):
+    """Return content of a message sent by a client.
+    _Rejected_ is raised if it is too long."""
+    message = msg.get("message")
+    if len(message) > MSG_MAX_LENGTH:
+        logger.debug("Message length limit exceeded")
+        raise Rejected("message_too_long", {"msg_length": MSG_MAX_LENGTH})
+    logger.debug("Message received: %s", message)
+    return message
+
+
+def accept_attachment(attachment_id, attachment, user_id):
+    """Return identifier of the attachment referenced by a new message.
+    _Rejected_ is raised unless it was uploaded by the author.
+
+    ## Parameters:
+        **attachment_id** (_str_):
+        Identifier sent by the client. <br>
+
+        **attachment** (_Attachment_):
+        Attachment loaded by that identifier, _None_ if missing. <br>
+
+        **user_id** (_str_):
+        Identifier of the author.
+
+    ### Returns:
+        _UUID_:
+        identifier of the stored attachment.
+    """
+    if attachment is None or str(attachment.user_id) != user_id:
+        logger.debug("Attachment rejected: %s", attachment_id)
+        raise Rejected("attachment_rejected", {"attachment": attachment_id})
+    return attachment.attachment_id
+
+
+def mention_targets(mentioned, user_id):
+    r"""Return identifiers of mentioned users whose counters advance: the
+    author mentioning itself is left out.
+
+    ## Parameters:
+        **mentioned** (_dict_):
+        User identifiers keyed by mentioned username, _None_ on failure. <br>
+
+        **user_id** (_str_):
+        Identifier of the author.
+
+    ### Returns:
+        _List\[UUID\]_:
+        identifiers of mentioned users.
+    """
+    return [
+        mentioned_id
+        for mentioned_id in (mentioned or {}).values()
+        if str(mentioned_id) != user_id
+    ]
+
+
+def message_broadcasts(username, message, result, attachment_id):
+    r"""Return new message encoded once per encoding, with the room of the
+    clients using it.
+
+    ## Parameters:
+        **username** (_str_):
+        Author of the message. <br>
+
+        **message** (_str_):
+        Message content. <br>
+
+        **result** (_dict_):
+        `message_timestamp` and `message_id` of the inserted message. <br>
+
+        **attachment_id** (_UUID_):
+        Attachment of the message, _None_ without one.
+
+    ### Returns:
+        _List\[Tuple\[str, object\]\]_:
+        room and payload of the `message` event.
+    """
+    return [
+        (
+            encoding_room(encoding),
+            encode_message(
+                username,
+                message,
+                result["message_timestamp"],
+                encoding,
+                attachment_id,
+                result["message_id"],
+            ),
+        )
+        for encoding in ENCODINGS
+    ]
+
+
+def parse_change(data, edit):
+    r"""Validate an edit or deletion request like `parse_message_change`.
+    _Rejected_ is raised for malformed requests.
+
+    ### Returns:
+        _Tuple\[UUID, str\]_:
+        message identifier and new content, _None_ for deletions.
+    """
+    try:
+        return parse_message_change(data, edit)
+    except ValueError as error:
+        raise Rejected("message_change_rejected", {"error": str(error)}) from error
+
+
+def deletion_author(user):
+    """Return author whose messages the user may delete, _None_ if the user
+    may delete any message"""
+    return None if user.is_privileged() else user.user_id
+
+
+def change_broadcast(changed, message_id, message, edit):
+    r"""Return event telling every client about a changed message.
+    _Rejected_ is raised unless the change was applied.
+
+    ## Parameters:
+        **changed** (_bool_):
+        Result of the service call: _None_ on database failure, _False_ if
+        the message is missing or not the user's. <br>
+
+        **message_id** (_UUID_):
+        Changed message. <br>
+
+        **message** (_str_):
+        New content, _None_ for deletions. <br>
+
+        **edit** (_bool_):
+        Whether the message was edited rather than deleted.
+
+    ### Returns:
+        _Tuple\[str, dict\]_:
+        event and its payload.
+    """
+    failed, refused = CHANGE_ERRORS[edit]
+    if changed is None:
+        logger.error("An error occured while %s message", "editing" if edit else "deleting")
+        raise Rejected("message_change_rejected", {"error": failed})
+    if not changed:
+        raise Rejected("message_change_rejected", {"error": refused})
+
+    if edit:
+        return EDIT_EVENT, {"message_id": str(message_id), "message": message}
+    return DELETE_EVENT, {"message_id": str(message_id)}
+
+
+def read_counters():
+    """Return counters of a user who has read every message"""
+    return {"unread": 0, "mentions": 0}
+
+
+def parse_moderation_request(moderator, data):
+    """Validate moderation request of a user like `parse_moderation`.
+    _Rejected_ is raised if the user is no moderator or the request is
+    malformed.
+
+    ## Parameters:
+        **moderator** (_User_):
+        User sending the request, _None_ if missing. <br>
+
+        **data** (_dict_):
+        Request sent by the client.
+
+    ### Returns:
+        _dict_:
+        validated request.
+    """
+    if not moderator or not moderator.is_privileged():
+        logger.info("Moderation refused")
+        raise Rejected("moderation_rejected", {"error": "Moderators only"})
+
+    try:
+        return parse_moderation(data)
+    except ValueError as error:
+        raise Rejected("moderation_rejected", {"error": str(error)}) from error
+
+
+def moderated_author(moderation, user_ids):
+    """Return identifier of the user named in moderation request.
+    _Rejected_ is raised if no such user exists.
+
+    ## Parameters:
+        **moderation** (_dict_):
+        Request returned by `parse_moderation`, naming `username`. <br>
+
+        **user_ids** (_dict_):
+        User identifiers keyed by username, _None_ on failure.
+    """
+    author = (user_ids or {}).get(moderation["username"])
+    if author is None:
+        raise Rejected("moderation_rejected", {"error": "Unknown user"})
+    return author
+
+
+def moderation_outcome(moderator, moderation, changed):
+    r"""Return events concluding a moderation request.
+    _Rejected_ is raised if a batch failed.
+
+    ## Parameters:
+        **moderator** (_User_):
+        User who sent the request. <br>
+
+        **moderation** (_dict_):
+        Request returned by `parse_moderation`. <br>
+
+        **changed** (_int_):
+        Count of changed messages, _None_ if a batch failed.
+
+    ### Returns:
+        _Tuple\[Tuple\[str, dict\], dict\]_:
+        tombstone event broadcast to every client, _None_ if no message
+        changed, and payload of `moderation_done` sent to the moderator.
+    """
+    if changed is None:
+        logger.error("An error occured while moderating messages")
+        raise Rejected("moderation_rejected", {"error": "Moderation failed, please repeat it"})
+
+    logger.info("Moderation by %s: %s messages, %s", moderator.username, changed, moderation)
+
+    # Clients drop shown messages matching the tombstone: sent only when the
+    # database changed, so they never hide messages still stored
+    removed = (TOMBSTONE_EVENT, tombstone(moderation)) if changed else None
+    return removed, {"action": moderation["action"], "count": changed}
+
+
+def parse_history_counter(cnt):
+    """Return count of messages the client already shows, _None_ if
+    the value sent is no number"""
+    # Validation piece: handles random other tampered values in global
+    # counter variable than numbers
+    try:
+        return int(cnt)
+    except ValueError:
+        logger.error(
+            """Variale 'cnt' value is not expected: not convertable to int
+            Current 'cnt' value - %s""",
+            cnt,
+        )
+        return None
+
+
+def history_rows(messages):
+    r"""Return history messages as rows of `encode_messages`, in order.
+
+    ### Returns:
+        _List\[tuple\]_:
+        username, content, timestamp, attachment, identifier and edit flag.
+    """
+    return [
+        (
+            msg["username"],
+            msg["message_content"],
+            msg["message_timestamp"],
+            msg["attachment_id"],
+            msg["message_id"],
+            msg["message_edited"],
+        )
+        for msg in messages
+    ]
+
+
+def load_payload(messages, encoding):
+    """Return `load` payload: batch of older messages sorted newest first"""
+    return encode_messages(
+        history_rows(sorted(messages, key=lambda x: x["message_timestamp"], reverse=True)),
+        encoding,
+    )
+
+
+def parse_user_messages_request(data):
+    r"""Validate request for a page of messages of one user.
+
+    ### Returns:
+        _Tuple\[str, UUID\]_:
+        username and message the page ends before, _None_ for the newest
+        page. _None_ if the request is malformed.
+    """
+    try:
+        username = str(data["username"])
+        before = data.get("before")
+        if before is not None:
+            before = uuid.UUID(before)
+    except (KeyError, TypeError, AttributeError, ValueError):
+        logger.debug("Malformed user messages request: %s", data)
+        return None
+    return username, before
+
+
+def user_messages_payload(username, messages, encoding):
+    """Return `user_messages` payload: page of messages of one user and
+    `before` requesting the next page, _None_ on the last one.
+
+    ## Parameters:
+        **username** (_str_):
+        Author of the messages. <br>
+
+        **messages** (_list_):
+        Page of messages newest first, _None_ if the user does not exist. <br>
+
+        **encoding** (_str_):
+        Payload encoding of the requesting client.
+    """
+    if messages is None:
+        return {"username": username, "messages": [], "before": None}
+
+    older = None
+    if len(messages) == PROFILE_HISTORY_PAGE:
+        older = str(messages[-1]["message_id"])
+
+    return {
+        "username": username,
+        "messages": encode_messages(history_rows(messages), encoding),
+        "before": older,
+    }
@@ -0,0 +1,333 @@
+"""Socket.IO event handlers"""
+
+import logging
+from functools import wraps
+from flask import current_app, render_template, request
+from flask_socketio import emit, join_room, rooms
+from flask_jwt_extended import get_jwt_identity, jwt_required, verify_jwt_in_request
+
+from extensions import user_service, message_service, socket
+from loadshed import critical, shed_event
+from metrics import HISTORY_REQUESTS, MESSAGES, STATS_NAMESPACE, live_stats
+from moderation import moderate_messages
+from presence import SNAPSHOT_EVENT, presence
+from unread import parse_mentions, unread_cache, user_room
+from payloads import ENCODINGS, JSON, encoding_room, negotiate_encoding
+from event_logic import (
+    Rejected,
+    accept_attachment,
+    change_broadcast,
+    deletion_author,
+    load_payload,
+    mention_targets,
+    message_broadcasts,
+    moderated_author,
+    moderation_outcome,
+    parse_change,
+    parse_history_counter,
+    parse_moderation_request,
+    parse_new_message,
+    parse_user_messages_request,
+    read_counters,
+    user_messages_payload,
+)
+from utils.constants import MODERATION_BATCH_SIZE, MODERATION_PAUSE, PROFILE_HISTORY_PAGE
+
+logger = logging.getLogger("gunicorn.access")
+
+
+def answer_rejection(f):
+    """Send refusal of the event back to the requesting client"""
+
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        try:
+            return f(*args, **kwargs)
+        except Rejected as rejected:
+            emit(rejected.event, rejected.payload)
+            return None
+
+    return decorated_function
+
+
+def handle_connect(auth=None):
+    """put connected client to the room of its payload encoding and to the
+    room of its user, which receives unread counters, and make its user
+    online"""
+
+    encoding = negotiate_encoding(auth)
+    join_room(encoding_room(encoding))
+
+    verify_jwt_in_request(optional=True)
+    user_id = get_jwt_identity()
+    if user_id:
+        join_room(user_room(user_id))
+
+        # Username is looked up once per connection, never per heartbeat
+        user = user_service.get_user_by_id(user_id)
+        if user:
+            presence.connect(request.sid, user.username)
+            current_app.extensions["presence"].start()
+    logger.debug("Client connected with %s encoding", encoding)
+
+
+def handle_disconnect(reason=None):  # pylint: disable=unused-argument
+    """make user offline if it was its last connected client"""
+
+    presence.disconnect(request.sid)
+
+
+def handle_heartbeat():
+    """keep user of the client online"""
+
+    presence.heartbeat(request.sid)
+
+
+def handle_request_presence():
+    """send users online on this worker to the requesting client"""
+
+    emit(SNAPSHOT_EVENT, presence.snapshot())
+
+
+def client_encoding():
+    """Return payload encoding negotiated by the client of current event"""
+    joined = rooms()
+    for encoding in ENCODINGS:
+        if encoding_room(encoding) in joined:
+            return encoding
+    return JSON
+
+
+@jwt_required()
+@critical
+@answer_rejection
+def handle_message(msg):
+    """handle initial messages sent via websocket and saves them to database"""
+
+    message = parse_new_message(msg)
+
+    # Getting the username of message sender
+    user_id = get_jwt_identity()
+
+    # Attachment is referenced by identifier and must be uploaded by the author
+    attachment_id = msg.get("attachment")
+    if attachment_id is not None:
+        attachment = message_service.get_attachment(str(attachment_id))
+        attachment_id = accept_attachment(attachment_id, attachment, user_id)
+
+    # Mentioned users get their mention counter advanced with the insert
+    mentioned_ids = mention_targets(
+        user_service.get_user_ids(parse_mentions(message)), user_id
+    )
+
+    # Save to database
+    result = message_service.insert_message(message, user_id, attachment_id, mentioned_ids)
+    if not result:
+        logger.error("An error occured while inserting message")
+        return render_template(
+            "error.html", message="An error occured while inserting message"
+        )
+
+    live_stats.record(MESSAGES)
+
+    username = user_service.get_user_by_id(user_id).username
+    logger.debug("Current user: %s", username)
+
+    # Bursts are batched into one frame per tick when coalescing is enabled
+    coalescer = current_app.extensions["broadcast"]
+    if coalescer is not None:
+        coalescer.publish(
+            username, message, result["message_timestamp"], attachment_id, result["message_id"]
+        )
+    else:
+        # Encode once per encoding and broadcast to every client using it
+        for room, payload in message_broadcasts(username, message, result, attachment_id):
+            socket.emit("message", payload, to=room)
+
+    # Only sockets of mentioned users learn about their new counters
+    for mentioned_id in mentioned_ids:
+        counters = user_service.get_unread_counters(mentioned_id)
+        if counters is not None:
+            unread_cache.put(mentioned_id, counters)
+            socket.emit("unread", counters, to=user_room(mentioned_id))
+
+
+@jwt_required()
+@critical
+@answer_rejection
+def handle_edit_message(data):
+    """replace content of a message sent by current user and tell every
+    client the new content"""
+
+    message_id, message = parse_change(data, edit=True)
+
+    # Mentions are not parsed again: counters only advance for new messages
+    edited = message_service.edit_message(message_id, get_jwt_identity(), message)
+    socket.emit(*change_broadcast(edited, message_id, message, edit=True))
+
+
+@jwt_required()
+@critical
+@answer_rejection
+def handle_delete_message(data):
+    """delete a message sent by current user, or any message on behalf of a
+    moderator, and tell every client to remove it"""
+
+    message_id, _ = parse_change(data, edit=False)
+
+    user = user_service.get_user_by_id(get_jwt_identity())
+    if not user:
+        return
+
+    deleted = message_service.delete_message(message_id, deletion_author(user))
+    socket.emit(*change_broadcast(deleted, message_id, None, edit=False))
+
+
+@jwt_required()
+def handle_mark_read():
+    """mark all messages as read by current user and reset its counters on
+    every socket of the user"""
+
+    user_id = get_jwt_identity()
+    if not user_service.mark_read(user_id):
+        logger.error("An error occured while marking messages as read")
+        return
+
+    counters = read_counters()
+    unread_cache.put(user_id, counters)
+    socket.emit("unread", counters, to=user_room(user_id))
+
+
+@jwt_required()
+@answer_rejection
+def handle_moderate(data):
+    """delete or hide messages in bulk on behalf of a moderator and tell every
+    client which messages to remove"""
+
+    moderator = user_service.get_user_by_id(get_jwt_identity())
+    moderation = parse_moderation_request(moderator, data)
+
+    author = None
+    if "username" in moderation:
+        author = moderated_author(
+            moderation, user_service.get_user_ids([moderation["username"]])
+        )
+
+    changed = moderate_messages(
+        message_service,
+        moderation,
+        author,
+        MODERATION_BATCH_SIZE,
+        MODERATION_PAUSE,
+        socket.sleep,
+    )
+    removed, done = moderation_outcome(moderator, moderation, changed)
+
+    if removed is not None:
+        socket.emit(*removed)
+    emit("moderation_done", done)
+
+
+@jwt_required()
+@shed_event("request_message")
+def load_messages(cnt):
+    """handle socket request to load bunch of messages from database"""
+
+    logger.debug("Messages loaded: %s", cnt)
+
+    loaded = parse_history_counter(cnt)
+    if loaded is None:
+        return
+
+    live_stats.record(HISTORY_REQUESTS)
+
+    # if no messages to load remain sends event via socket
+    if message_service.count() <= loaded:
+        emit("loading_finished")
+        return
+
+    # retrieve batch of messages or whatever less that is remained
+    messages = message_service.retrieve_messages(
+        initial_load=False, counter=loaded, jsonify=True
+    )
+    if not messages:
+        logger.error("An error occured while loading messages.")
+        return
+
+    logger.debug("%s messages retrieved from collection.", len(messages))
+
+    # sent in one batch to the requesting client only
+    emit("load", load_payload(messages, client_encoding()))
+
+
+@jwt_required()
+@shed_event("request_user_messages")
+def load_user_messages(data):
+    """send page of messages of one user, newest first, to the requesting
+    client; `before` of the answer requests the next page"""
+
+    request_data = parse_user_messages_request(data)
+    if request_data is None:
+        return
+    username, before = request_data
+
+    user_ids = user_service.get_user_ids([username])
+    if user_ids is None:
+        logger.error("An error occured while loading user messages.")
+        return
+    if username not in user_ids:
+        emit("user_messages", user_messages_payload(username, None, JSON))
+        return
+
+    live_stats.record(HISTORY_REQUESTS)
+
+    messages = message_service.user_history_page(
+        user_ids[username], before=before, limit=PROFILE_HISTORY_PAGE
+    )
+    if messages is None:
+        logger.error("An error occured while loading user messages.")
+        return
+
+    emit("user_messages", user_messages_payload(username, messages, client_encoding()))
+
+
+def handle_stats_connect(auth=None):  # pylint: disable=unused-argument
+    """admit privileged users to live stats and send them the whole window"""
+
+    verify_jwt_in_request(optional=True)
+    user_id = get_jwt_identity()
+    user = user_service.get_user_by_id(user_id) if user_id else None
+    if not user or not user.is_privileged():
+        logger.info("Live stats connection refused")
+        raise ConnectionRefusedError("unauthorized")
+
+    current_app.extensions["stats"].add_listener(request.sid)
+    emit("stats_snapshot", live_stats.snapshot())
+
+
+def handle_stats_disconnect(reason=None):  # pylint: disable=unused-argument
+    """stop sending live stats to disconnected client"""
+
+    current_app.extensions["stats"].remove_listener(request.sid)
+
+
+def register_events(socketio):
+    """Attach event handlers to Socket.IO server of an application.
+
+    ## Parameters:
+        **socketio** (_SocketIO_):
+        Socket.IO server instance bound to the application.
+    """
+    socketio.on_event("connect", handle_connect)
+    socketio.on_event("disconnect", handle_disconnect)
+    socketio.on_event("heartbeat", handle_heartbeat)
+    socketio.on_event("request_presence", handle_request_presence)
+    socketio.on_event("message", handle_message)
+    socketio.on_event("edit_message", handle_edit_message)
+    socketio.on_event("delete_message", handle_delete_message)
+    socketio.on_event("request_message", load_messages)
+    socketio.on_event("mark_read", handle_mark_read)
+    socketio.on_event("moderate", handle_moderate)
+    socketio.on_event("request_user_messages", load_user_messages)
+    socketio.on_event("connect", handle_stats_connect, namespace=STATS_NAMESPACE)
+    socketio.on_event("disconnect", handle_stats_disconnect, namespace=STATS_NAMESPACE)
@@ -0,0 +1,114 @@
+"""Shared per-application objects, built lazily on first use"""
+
+from functools import cached_property
+
+from flask import current_app
+from sqlalchemy import create_engine
+from werkzeug.local import LocalProxy
+
+from attachments import ThumbnailWorker, UploadSpool
+from database import (
+    create_schema,
+    engine_options,
+    is_memory_database,
+    register_sqlite_pragmas,
+    track_engine,
+)
+from loadshed import register_load_shedding
+from metrics import register_query_timing
+from services import UserService, MessageService
+from querylog import query_log
+from statements import register_statement_stats
+from storage import create_storage
+from utils.constants import (
+    ATTACHMENT_CHUNK_SIZE,
+    ATTACHMENT_COPY_BLOCK,
+    ATTACHMENT_MAX_BYTES,
+    ATTACHMENT_THUMBNAIL_SIZE,
+)
+
+EXTENSION_NAME = "flask_chat"
+
+
+class AppServices:
+    """Engine and services of one application instance. Nothing touches the
+    database driver until a service is used for the first time."""
+
+    def __init__(self, config):
+        self.config = config
+
+    @cached_property
+    def engine(self):
+        """Single SQLAlchemy engine shared by all services of the application"""
+        url = self.config["DATABASE_URL"]
+        engine = create_engine(url, **engine_options(url))
+        track_engine(engine)
+        register_sqlite_pragmas(engine)
+        register_statement_stats(engine)
+        register_query_timing(engine)
+        register_load_shedding(engine)
+        query_log.register(engine, self.config["SLOW_QUERY_MS"])
+
+        # Nothing else could have created the schema of a fresh in-memory database
+        if is_memory_database(url):
+            create_schema(engine)
+        return engine
+
+    @cached_property
+    def user_service(self):
+        """Shared UserService instance"""
+        return UserService(self.engine)
+
+    @cached_property
+    def message_service(self):
+        """Shared MessageService instance"""
+        return MessageService(self.engine)
+
+    @cached_property
+    def profile_pictures(self):
+        """Storage backend for profile pictures"""
+        return create_storage(
+            self.config, self.config["PROFILE_PICTURE_STORAGE_PATH"], self.config["S3_BUCKET"]
+        )
+
+    @cached_property
+    def attachments(self):
+        """Storage backend for images attached to messages and their thumbnails"""
+        return create_storage(
+            self.config, self.config["ATTACHMENT_STORAGE_PATH"], self.config["S3_ATTACHMENT_BUCKET"]
+        )
+
+    @cached_property
+    def uploads(self):
+        """Unfinished chunked uploads of attachments"""
+        return UploadSpool(
+            self.config["ATTACHMENT_UPLOAD_PATH"],
+            ATTACHMENT_CHUNK_SIZE,
+            ATTACHMENT_MAX_BYTES,
+            ATTACHMENT_COPY_BLOCK,
+        )
+
+    @cached_property
+    def thumbnails(self):
+        """Background generator of attachment thumbnails"""
+        return ThumbnailWorker(self, ATTACHMENT_THUMBNAIL_SIZE)
+
+
+def get_services():
+    """Return AppServices of the current application.
+
+    ### Returns:
+        _AppServices_:
+        container with lazily built engine and services.
+    """
+    return current_app.extensions[EXTENSION_NAME]
+
+
+# Proxies resolving to the services of the application handling the request
+user_service = LocalProxy(lambda: get_services().user_service)
+message_service = LocalProxy(lambda: get_services().message_service)
+profile_pictures = LocalProxy(lambda: get_services().profile_pictures)
+attachments = LocalProxy(lambda: get_services().attachments)
+uploads = LocalProxy(lambda: get_services().uploads)
+thumbnails = LocalProxy(lambda: get_services().thumbnails)
+socket = LocalProxy(lambda: current_app.extensions["socketio"])
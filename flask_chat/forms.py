@@ -2,13 +2,19 @@
 
 from wtforms import (
     Form,
+    IntegerField,
     StringField,
     PasswordField,
     validators,
     TextAreaField,
     HiddenField,
 )
-from utils.constants import WEBSITE_NAME
+from utils.constants import (
+    WEBSITE_NAME,
+    PROFILER_DEFAULT_DURATION,
+    PROFILER_DEFAULT_INTERVAL_MS,
+    PROFILER_MAX_DURATION,
+)
 
 
 class RegForm(Form):
@@ -91,3 +97,19 @@ class EditProfileForm(Form):
         render_kw={"class": "editable", "readonly": True},
         name="bio",
     )
+
+
+class ProfilerForm(Form):
+    """Form to start sampling profile of the serving worker"""
+
+    csrf_token = HiddenField("Hidden", name="csrf_token")
+    duration = IntegerField(
+        "Duration (seconds)",
+        [validators.InputRequired(), validators.NumberRange(min=1, max=PROFILER_MAX_DURATION)],
+        default=PROFILER_DEFAULT_DURATION,
+    )
+    interval = IntegerField(
+        "Sampling interval (milliseconds)",
+        [validators.InputRequired(), validators.NumberRange(min=1, max=1000)],
+        default=PROFILER_DEFAULT_INTERVAL_MS,
+    )
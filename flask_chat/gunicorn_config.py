@@ -0,0 +1,128 @@
+"""Gunicorn configuration: workers on every CPU sharing a persistent secret key
+
+Run with `gunicorn -c gunicorn_config.py "app:create_app()"`, or with
+`"asgi:create_asgi_app()"` when `SERVER_MODE=asgi`.
+
+The application is loaded once in the master process and forked into
+workers. Each worker replaces the database connection pools it inherited,
+so no connection is shared between processes.
+
+Several workers need:
+    - the same secret key, so a session token issued by one worker is valid
+      in all of them and across restarts (see `load_secret_key`);
+    - a message queue (`SOCKETIO_MESSAGE_QUEUE`), so a chat message sent to
+      one worker is broadcast to clients connected to the others; one
+      worker per CPU is run when it is set, a single one otherwise;
+    - clients using WebSocket transport only: long-polling requests of one
+      session would land on different workers.
+
+Graceful reload: `kill -HUP <master pid>` (pid is written to
+`GUNICORN_PIDFILE`) starts a new generation of workers and stops the old
+one after it finished requests in progress, up to `GRACEFUL_TIMEOUT`
+seconds; the listening socket stays open meanwhile, so no connection is
+refused and Socket.IO clients reconnect to the new workers. As the app is
+preloaded, new workers run the code loaded by the master: deploying new
+code takes a restart of the master, e.g. by replacing the container.
+"""
+
+import os
+import secrets
+from os import getenv
+
+from logging_config import logconfig_dict  # pylint: disable=unused-import
+from utils.constants import GRACEFUL_TIMEOUT, GUNICORN_PIDFILE, SECRET_KEY_PATH
+
+WORKER_CLASSES = {
+    "eventlet": "eventlet",
+    "asgi": "uvicorn.workers.UvicornWorker",
+}
+
+
+def load_secret_key(path):
+    """Return secret key stored in file, generating it on first start. The
+    file is created exclusively, so processes starting at once agree on
+    one key.
+
+    ## Parameters:
+        **path** (_str_):
+        Key file on a persistent volume, readable by the app user only.
+
+    ### Returns:
+        _str_:
+        secret key.
+    """
+    try:
+        descriptor = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+    except FileExistsError:
+        with open(path, encoding="utf-8") as file:
+            return file.read().strip()
+
+    key = secrets.token_urlsafe(64)
+    with os.fdopen(descriptor, "w", encoding="utf-8") as file:
+        file.write(key)
+    return key
+
+
+def cpu_count():
+    """Return CPUs this process may run on, honouring container CPU sets"""
+    if hasattr(os, "sched_getaffinity"):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+
+# Key given in environment wins; workers inherit it from the master
+if not getenv("FLASK_SECRET_KEY"):
+    os.environ["FLASK_SECRET_KEY"] = load_secret_key(getenv("SECRET_KEY_PATH", SECRET_KEY_PATH))
+
+SERVER_MODE = getenv("SERVER_MODE", "eventlet")
+
+bind = getenv("GUNICORN_BIND", "0.0.0.0:5000")
+worker_class = WORKER_CLASSES[SERVER_MODE]
+
+MESSAGE_QUEUE = getenv("SOCKETIO_MESSAGE_QUEUE")
+
+# Workers are asynchronous and each serves many connections, so one per
+# CPU keeps all cores busy without processes competing for them. Without
+# a message queue, broadcasts would not cross workers, so one is run.
+workers = int(getenv("WEB_CONCURRENCY") or (cpu_count() if MESSAGE_QUEUE else 1))
+
+preload_app = True
+graceful_timeout = int(getenv("GRACEFUL_TIMEOUT") or GRACEFUL_TIMEOUT)
+pidfile = getenv("GUNICORN_PIDFILE", GUNICORN_PIDFILE)
+loglevel = getenv("LOGGING_LEVEL", "info").lower()
+
+if SERVER_MODE == "eventlet":
+    # Modules imported by the preloaded app must see cooperative sockets
+    # and locks, so patching cannot wait for the worker to do it. `os` is
+    # left to the worker: the master wakes on signals through a pipe read
+    # with blocking `os.read`, and a green one never returns.
+    import eventlet  # pylint: disable=import-outside-toplevel
+
+    eventlet.monkey_patch(os=False)
+
+
+def post_fork(server, worker):  # pylint: disable=unused-argument
+    """Drop database connections inherited from the master process"""
+    from database import dispose_engines  # pylint: disable=import-outside-toplevel
+
+    dispose_engines()
+
+
+def when_ready(server):
+    """Log serving setup once the master is ready"""
+    server.log.info(
+        "Serving in %s mode with %s workers, message queue %s",
+        SERVER_MODE,
+        server.num_workers,
+        "enabled" if MESSAGE_QUEUE else "disabled",
+    )
+    if server.num_workers > 1 and not MESSAGE_QUEUE:
+        server.log.warning(
+            "Several workers without SOCKETIO_MESSAGE_QUEUE: chat messages only "
+            "reach clients connected to the worker they were sent to"
+        )
+
+
+def on_reload(server):
+    """Log graceful reload of workers"""
+    server.log.info("Reloading workers, old ones get %s seconds to finish", graceful_timeout)
@@ -0,0 +1,147 @@
+"""Liveness and readiness endpoints for orchestrators and load balancers"""
+
+import sys
+import time
+import logging
+from flask import Blueprint, current_app, jsonify
+from sqlalchemy import text
+from sqlalchemy.exc import SQLAlchemyError
+
+from extensions import get_services
+from loadshed import load_shedder
+
+health_bp = Blueprint("health", __name__)
+
+logger = logging.getLogger("gunicorn.access")
+
+
+def database_status(engine):
+    """Check database connectivity and describe connection pool state.
+
+    ## Parameters:
+        **engine** (_Engine_):
+        Engine of the application.
+
+    ### Returns:
+        _dict_:
+        connectivity, round trip latency and pool counters. A saturated pool
+        is reported without checking out a connection, which would block
+        for up to the pool timeout.
+    """
+    pool = engine.pool
+    status = {
+        "connected": False,
+        "pool": {
+            "size": getattr(pool, "size", lambda: None)(),
+            "checked_out": getattr(pool, "checkedout", lambda: None)(),
+            "overflow": getattr(pool, "overflow", lambda: None)(),
+            "max_overflow": getattr(pool, "_max_overflow", None),
+        },
+    }
+
+    if pool_saturated(status["pool"]):
+        status["saturated"] = True
+        return status
+    status["saturated"] = False
+
+    started = time.perf_counter()
+    try:
+        with engine.connect() as connection:
+            connection.execute(text("SELECT 1"))
+        status["connected"] = True
+    except SQLAlchemyError as error:
+        logger.error("Readiness check failed to reach database: %s", error)
+        status["error"] = str(error.__class__.__name__)
+    status["latency_ms"] = round((time.perf_counter() - started) * 1000, 2)
+
+    return status
+
+
+def pool_saturated(pool_status):
+    """Whether every pooled connection, overflow included, is checked out"""
+    size = pool_status["size"]
+    max_overflow = pool_status["max_overflow"]
+    if size is None or max_overflow is None or max_overflow < 0:
+        return False
+    return pool_status["checked_out"] >= size + max_overflow
+
+
+def eventlet_status():
+    """Describe the eventlet hub. Counters are read from the hub directly,
+    so the check costs O(1) regardless of heap size.
+
+    ### Returns:
+        _dict_:
+        file descriptors the hub waits on for reading and writing, and
+        scheduled timers. _None_ if the process does not run on eventlet.
+    """
+    eventlet = sys.modules.get("eventlet")
+    if eventlet is None or not eventlet.patcher.is_monkey_patched("socket"):
+        return None
+
+    hub = eventlet.hubs.get_hub()
+    return {
+        "hub_readers": len(hub.get_readers()),
+        "hub_writers": len(hub.get_writers()),
+        "hub_timers": hub.get_timers_count(),
+    }
+
+
+def background_status():
+    """Describe background work pending in this process"""
+    services = get_services()
+    maintenance = current_app.extensions.get("maintenance")
+
+    # Storage is not built just to report on it
+    storage = services.__dict__.get("profile_pictures")
+
+    return {
+        "storage_deletions": storage.pending_deletions if storage else 0,
+        "maintenance_running": bool(maintenance and maintenance.running),
+    }
+
+
+def socketio_clients():
+    """Return count of Socket.IO clients connected to this process"""
+    # In ASGI mode clients are served by the asyncio server
+    async_socketio = current_app.extensions.get("async_socketio")
+    if async_socketio is not None:
+        return len(async_socketio.eio.sockets)
+
+    socketio = current_app.extensions.get("socketio")
+    if socketio is None or socketio.server is None:
+        return 0
+    return len(socketio.server.eio.sockets)
+
+
+@health_bp.route("/healthz", methods=["GET"])
+def liveness():
+    """Liveness probe: the process is up and serving requests"""
+    return jsonify(status="ok")
+
+
+@health_bp.route("/readyz", methods=["GET"])
+def readiness():
+    """Readiness probe: database is reachable and the worker is not saturated.
+    Responds 503 when traffic should be routed to other workers."""
+
+    database = database_status(get_services().engine)
+
+    report = {
+        "database": database,
+        "eventlet": eventlet_status(),
+        "socketio_clients": socketio_clients(),
+        "background": background_status(),
+        "load_shedding": load_shedder.status(),
+    }
+
+    if database["saturated"]:
+        report["status"] = "saturated"
+    elif not database["connected"]:
+        report["status"] = "database unavailable"
+    else:
+        report["status"] = "ready"
+        return jsonify(report)
+
+    logger.info("Readiness check failed: %s", report["status"])
+    return jsonify(report), 503
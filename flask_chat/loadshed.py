@@ -0,0 +1,222 @@
+"""Adaptive load shedding of low-priority work when the database degrades"""
+
+import time
+import logging
+import threading
+from functools import wraps
+
+from flask import make_response, render_template
+from flask_socketio import emit
+
+from metrics import observe_queries, register_query_timing
+from utils.constants import (
+    LOAD_SHED_HALF_LIFE,
+    LOAD_SHED_LATENCY_MS,
+    LOAD_SHED_MAX_IN_FLIGHT,
+    LOAD_SHED_RETRY_AFTER,
+)
+
+logger = logging.getLogger("gunicorn.access")
+
+
+class LoadShedder:
+    """Tracks recent query latency and handlers in flight, and tells whether
+    low-priority work should be turned away.
+
+    Latency is an exponentially weighted moving average decaying with time,
+    so a burst of slow queries is forgotten once the database recovers, even
+    if shedding cut the traffic that would have measured it. Shedding starts
+    above the thresholds and stops only below half of them, so the state
+    does not flap on the boundary.
+
+    ## Parameters:
+        **latency_ms** (_float_):
+        Average query latency above which shedding starts. <br>
+
+        **max_in_flight** (_int_):
+        Handlers in progress above which shedding starts. <br>
+
+        **half_life** (_float_):
+        Seconds in which an observed latency loses half of its weight. <br>
+
+        **retry_after** (_int_):
+        Seconds clients are asked to wait before retrying.
+    """
+
+    def __init__(self, latency_ms, max_in_flight, half_life, retry_after):
+        self.latency_threshold = latency_ms
+        self.max_in_flight = max_in_flight
+        self.half_life = half_life
+        self.retry_after = retry_after
+        self.in_flight = 0
+        self.shed_count = 0
+        self._latency = 0.0
+        self._observed_at = time.monotonic()
+        self._shedding = False
+        self._lock = threading.Lock()
+
+    @property
+    def latency(self):
+        """Average query latency in milliseconds, decayed to this moment"""
+        elapsed = time.monotonic() - self._observed_at
+        return self._latency * 0.5 ** (elapsed / self.half_life)
+
+    def observe(self, latency_ms):
+        """Account duration of one executed query"""
+        with self._lock:
+            now = time.monotonic()
+            decay = 0.5 ** ((now - self._observed_at) / self.half_life)
+            # Recent observation weighs more the longer the previous is ago
+            self._latency = self._latency * decay * 0.8 + latency_ms * (1 - decay * 0.8)
+            self._observed_at = now
+
+    def overloaded(self):
+        """Whether low-priority work should be rejected right now"""
+        latency, in_flight = self.latency, self.in_flight
+
+        if self._shedding:
+            self._shedding = (
+                latency > self.latency_threshold / 2 or in_flight > self.max_in_flight / 2
+            )
+            if not self._shedding:
+                logger.warning("Load shedding stopped: latency %.1f ms", latency)
+        else:
+            self._shedding = (
+                latency > self.latency_threshold or in_flight > self.max_in_flight
+            )
+            if self._shedding:
+                logger.warning(
+                    "Load shedding started: latency %.1f ms, %s handlers in flight",
+                    latency,
+                    in_flight,
+                )
+
+        return self._shedding
+
+    def track(self):
+        """Return context manager counting handler as in flight"""
+        return _InFlight(self)
+
+    def status(self):
+        """Return current state for health reports"""
+        return {
+            "shedding": self._shedding,
+            "latency_ms": round(self.latency, 3),
+            "in_flight": self.in_flight,
+            "shed_total": self.shed_count,
+        }
+
+
+class _InFlight:
+    def __init__(self, shedder):
+        self.shedder = shedder
+
+    def __enter__(self):
+        with self.shedder._lock:  # pylint: disable=protected-access
+            self.shedder.in_flight += 1
+
+    def __exit__(self, *exc):
+        with self.shedder._lock:  # pylint: disable=protected-access
+            self.shedder.in_flight -= 1
+
+
+# Load shedder of this process, shared by all applications it serves
+load_shedder = LoadShedder(
+    LOAD_SHED_LATENCY_MS,
+    LOAD_SHED_MAX_IN_FLIGHT,
+    LOAD_SHED_HALF_LIFE,
+    LOAD_SHED_RETRY_AFTER,
+)
+
+
+def _observe_query(conn, statement, parameters, context, executemany, elapsed_ms):
+    load_shedder.observe(elapsed_ms)
+
+
+def register_load_shedding(engine):
+    """Feed latency of every query executed on engine to the load shedder.
+    Durations come from the query timing of live stats.
+
+    ## Parameters:
+        **engine** (_Engine_):
+        SQLAlchemy engine to attach the hooks to.
+    """
+    register_query_timing(engine)
+    observe_queries(_observe_query)
+
+
+def critical(f):
+    """Count handler as in flight; it is never shed"""
+
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        with load_shedder.track():
+            return f(*args, **kwargs)
+
+    return decorated_function
+
+
+def shed_request(f):
+    """Respond 503 with `Retry-After` to the request when overloaded"""
+
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        if load_shedder.overloaded():
+            load_shedder.shed_count += 1
+            logger.info("Request shed under load")
+            response = make_response(
+                render_template(
+                    "error.html", message="Server is busy. Please try again shortly."
+                ),
+                503,
+            )
+            response.headers["Retry-After"] = str(load_shedder.retry_after)
+            return response
+
+        with load_shedder.track():
+            return f(*args, **kwargs)
+
+    return decorated_function
+
+
+def retry_later(event_name):
+    """Tell whether the socket event is shed, counting it if it is.
+
+    ## Parameters:
+        **event_name** (_str_):
+        Event the client should emit again.
+
+    ### Returns:
+        _dict_:
+        payload of `retry_later` answering the event. _None_ if it may run.
+    """
+    if not load_shedder.overloaded():
+        return None
+
+    load_shedder.shed_count += 1
+    logger.info("Event %s shed under load", event_name)
+    return {"event": event_name, "retry_after": load_shedder.retry_after}
+
+
+def shed_event(event_name):
+    """Answer the socket event with `retry_later` when overloaded.
+
+    ## Parameters:
+        **event_name** (_str_):
+        Event the client should emit again after `retry_after` seconds.
+    """
+
+    def decorator(f):
+        @wraps(f)
+        def decorated_function(*args, **kwargs):
+            retry = retry_later(event_name)
+            if retry is not None:
+                emit("retry_later", retry)
+                return None
+
+            with load_shedder.track():
+                return f(*args, **kwargs)
+
+        return decorated_function
+
+    return decorator
@@ -0,0 +1,175 @@
+"""Scheduled maintenance: message retention, storage compaction and
+expiry of unfinished uploads"""
+
+import time
+import logging
+import threading
+
+from extensions import get_services
+
+logger = logging.getLogger("gunicorn.access")
+
+
+def purge_expired_messages(message_service, retention, batch_size, pause=0.1):
+    """Delete messages older than retention period in small batches.
+
+    ## Parameters:
+        **message_service** (_MessageService_):
+        Service used to delete messages. <br>
+
+        **retention** (_float_):
+        Retention period in seconds. <br>
+
+        **batch_size** (_int_):
+        Maximum number of messages deleted per transaction. <br>
+
+        **pause** (_float_, optional):
+        Seconds to wait between batches, yielding to live traffic. Defaults to 0.1.
+
+    ### Returns:
+        _int_:
+        total count of deleted messages.
+    """
+    cutoff = time.time() - retention
+    deleted = 0
+
+    while True:
+        count = message_service.purge_messages(cutoff, batch_size)
+        if not count:
+            break
+
+        deleted += count
+        logger.debug("%s expired messages deleted", count)
+
+        if count < batch_size:
+            break
+        time.sleep(pause)
+
+    return deleted
+
+
+def sweep_profile_pictures(user_service, storage, grace_period):
+    r"""Delete stored profile pictures no user refers to.
+
+    ## Parameters:
+        **user_service** (_UserService_):
+        Service used to find referenced pictures. <br>
+
+        **storage** (_FileStorage_):
+        Profile pictures storage. <br>
+
+        **grace_period** (_float_):
+        Files younger than this many seconds are kept, as they may belong
+        to an upload whose database update is still in progress.
+
+    ### Returns:
+        _Tuple\[int, int\]_:
+        count of deleted files and bytes reclaimed.
+    """
+    referenced = user_service.get_profile_pictures()
+    if referenced is None:
+        logger.error("Unable to load referenced profile pictures: sweep skipped.")
+        return 0, 0
+
+    threshold = time.time() - grace_period
+    files, reclaimed = 0, 0
+
+    for name, size, modified in storage.iter_files():
+        if name in referenced or modified > threshold:
+            continue
+
+        if storage.delete(name):
+            files += 1
+            reclaimed += size
+
+    return files, reclaimed
+
+
+def run_maintenance(services, config):
+    """Run all maintenance tasks once.
+
+    ## Parameters:
+        **services** (_AppServices_):
+        Services of the application. <br>
+
+        **config** (_Config_):
+        Application configuration.
+
+    ### Returns:
+        _dict_:
+        report with deleted messages, deleted files, reclaimed bytes and
+        deleted unfinished uploads.
+    """
+    started = time.monotonic()
+    report = {
+        "messages_deleted": 0,
+        "files_deleted": 0,
+        "bytes_reclaimed": 0,
+        "uploads_deleted": 0,
+    }
+
+    if config["MESSAGE_RETENTION_DAYS"]:
+        report["messages_deleted"] = purge_expired_messages(
+            services.message_service,
+            config["MESSAGE_RETENTION_DAYS"] * 24 * 60 * 60,
+            config["MAINTENANCE_BATCH_SIZE"],
+        )
+
+    report["files_deleted"], report["bytes_reclaimed"] = sweep_profile_pictures(
+        services.user_service,
+        services.profile_pictures,
+        config["PROFILE_PICTURE_GRACE_PERIOD"],
+    )
+
+    report["uploads_deleted"] = services.uploads.sweep(config["ATTACHMENT_UPLOAD_TTL"])
+
+    report["duration"] = round(time.monotonic() - started, 3)
+    logger.info(
+        "Maintenance finished: %s messages deleted, %s files deleted, %s bytes reclaimed, "
+        "%s unfinished uploads deleted",
+        report["messages_deleted"],
+        report["files_deleted"],
+        report["bytes_reclaimed"],
+        report["uploads_deleted"],
+    )
+    return report
+
+
+class MaintenanceWorker:
+    """Background task running maintenance of one application periodically"""
+
+    def __init__(self, app, socketio):
+        self.app = app
+        self.socketio = socketio
+        self.last_report = None
+        self.running = False
+        self._started = False
+        self._lock = threading.Lock()
+
+    def start(self):
+        """Start background task once per process"""
+        if self._started:
+            return
+
+        with self._lock:
+            if self._started:
+                return
+            self._started = True
+
+        self.socketio.start_background_task(self._run)
+        logger.info(
+            "Maintenance worker started: every %s seconds",
+            self.app.config["MAINTENANCE_INTERVAL"],
+        )
+
+    def _run(self):
+        while True:
+            self.socketio.sleep(self.app.config["MAINTENANCE_INTERVAL"])
+            self.running = True
+            try:
+                with self.app.app_context():
+                    self.last_report = run_maintenance(get_services(), self.app.config)
+            except Exception:  # pylint: disable=broad-exception-caught
+                logger.exception("Maintenance run failed")
+            finally:
+                self.running = False
@@ -0,0 +1,217 @@
+"""Live throughput stats kept in fixed-size in-memory ring buffers"""
+
+import time
+import logging
+import threading
+
+from sqlalchemy import event
+
+from utils.constants import STATS_WINDOW
+
+logger = logging.getLogger("gunicorn.access")
+
+STATS_NAMESPACE = "/stats"
+
+# Counters: events per second
+MESSAGES = "messages"
+HISTORY_REQUESTS = "history_requests"
+LOGINS = "logins"
+DB_QUERIES = "db_queries"
+# Averages and gauges: one value per second
+DB_LATENCY = "db_latency_ms"
+SOCKETS = "sockets"
+
+
+class RingBuffer:
+    """Per-second buckets of the last `size` seconds. Each bucket holds
+    count and sum of values recorded during its second; buckets are reused
+    in place as time goes, so memory never grows."""
+
+    def __init__(self, size):
+        self.size = size
+        self._seconds = [-1] * size
+        self._counts = [0] * size
+        self._totals = [0.0] * size
+        self._lock = threading.Lock()
+
+    def add(self, value=0.0, now=None):
+        """Record one event with optional value at second `now`"""
+        second = int(now if now is not None else time.time())
+        index = second % self.size
+
+        with self._lock:
+            if self._seconds[index] != second:
+                self._seconds[index] = second
+                self._counts[index] = 0
+                self._totals[index] = 0.0
+            self._counts[index] += 1
+            self._totals[index] += value
+
+    def bucket(self, second):
+        r"""Return count and sum of values of one second.
+
+        ### Returns:
+            _Tuple\[int, float\]_:
+            zeros if the second is out of window or had no events.
+        """
+        index = second % self.size
+        if self._seconds[index] != second:
+            return 0, 0.0
+        return self._counts[index], self._totals[index]
+
+
+class LiveStats:
+    """Ring buffers of all live stats of the process.
+
+    ## Parameters:
+        **window** (_int_):
+        Seconds of history kept per series.
+    """
+
+    def __init__(self, window):
+        self.window = window
+        self._buffers = {
+            name: RingBuffer(window)
+            for name in (MESSAGES, HISTORY_REQUESTS, LOGINS, DB_QUERIES, SOCKETS)
+        }
+
+    def record(self, name, value=0.0):
+        """Record one event of series `name`, e.g. a delivered message"""
+        self._buffers[name].add(value)
+
+    def second(self, second):
+        r"""Return values of all series for one second.
+
+        ### Returns:
+            _dict\[str, float\]_:
+            events per second of counters, average query latency and
+            connected sockets.
+        """
+        values = {
+            name: self._buffers[name].bucket(second)[0]
+            for name in (MESSAGES, HISTORY_REQUESTS, LOGINS, DB_QUERIES)
+        }
+
+        queries, latency = self._buffers[DB_QUERIES].bucket(second)
+        values[DB_LATENCY] = round(latency / queries, 3) if queries else 0.0
+
+        count, sockets = self._buffers[SOCKETS].bucket(second)
+        values[SOCKETS] = int(sockets / count) if count else 0
+
+        return values
+
+    def tick(self, now=None):
+        """Return values of the last complete second, sent to listeners
+        once per second.
+
+        ### Returns:
+            _dict_:
+            `second` and its `values`, see `second`.
+        """
+        second = int(now if now is not None else time.time()) - 1
+        return {"second": second, "values": self.second(second)}
+
+    def snapshot(self, now=None):
+        """Return all series over the whole window, oldest second first.
+        The current, incomplete second is left out.
+
+        ### Returns:
+            _dict_:
+            last complete second and per-series lists of values.
+        """
+        last = int(now if now is not None else time.time()) - 1
+        seconds = [self.second(second) for second in range(last - self.window + 1, last + 1)]
+
+        return {
+            "window": self.window,
+            "second": last,
+            "series": {name: [values[name] for values in seconds] for name in seconds[0]},
+        }
+
+
+# Stats of this process, shared by all applications it serves
+live_stats = LiveStats(STATS_WINDOW)
+
+
+# Called with connection, statement, parameters, execution context,
+# executemany flag and duration in milliseconds of every timed query
+_query_observers = []
+
+
+def observe_queries(observer):
+    """Hand duration of every query timed by `register_query_timing` to
+    observer, so the query is measured once whatever consumes it"""
+    if observer not in _query_observers:
+        _query_observers.append(observer)
+
+
+def _start_query_timer(conn, cursor, statement, parameters, context, executemany):
+    context.query_started = time.perf_counter()
+
+
+def _record_query(conn, cursor, statement, parameters, context, executemany):
+    started = getattr(context, "query_started", None)
+    if started is None:
+        return
+
+    elapsed = (time.perf_counter() - started) * 1000
+    live_stats.record(DB_QUERIES, elapsed)
+    for observer in _query_observers:
+        observer(conn, statement, parameters, context, executemany, elapsed)
+
+
+def register_query_timing(engine):
+    """Record count and latency of every query executed on engine and hand
+    them to query observers.
+
+    ## Parameters:
+        **engine** (_Engine_):
+        SQLAlchemy engine to attach the hooks to.
+    """
+    if not event.contains(engine, "before_cursor_execute", _start_query_timer):
+        event.listen(engine, "before_cursor_execute", _start_query_timer)
+        event.listen(engine, "after_cursor_execute", _record_query)
+
+
+class StatsBroadcaster:
+    """Background task sampling connected sockets and pushing the last
+    complete second of stats to the privileged stats namespace"""
+
+    def __init__(self, socketio, stats):
+        self.socketio = socketio
+        self.stats = stats
+        self.listeners = set()
+        self._started = False
+        self._lock = threading.Lock()
+
+    def start(self):
+        """Start background task once per process"""
+        if self._started:
+            return
+
+        with self._lock:
+            if self._started:
+                return
+            self._started = True
+
+        self.socketio.start_background_task(self._run)
+        logger.info("Live stats broadcaster started")
+
+    def add_listener(self, sid):
+        """Subscribe client to per-second updates"""
+        self.listeners.add(sid)
+        self.start()
+
+    def remove_listener(self, sid):
+        """Unsubscribe client from updates"""
+        self.listeners.discard(sid)
+
+    def _run(self):
+        while True:
+            self.socketio.sleep(1)
+
+            server = self.socketio.server
+            self.stats.record(SOCKETS, len(server.eio.sockets) if server else 0)
+
+            if self.listeners:
+                self.socketio.emit("stats_tick", self.stats.tick(), namespace=STATS_NAMESPACE)
@@ -1,15 +1,63 @@
 """models connecting to database"""
 
+import uuid
 import logging
 from typing import Optional
 from argon2 import PasswordHasher, exceptions
-from sqlalchemy import String, ForeignKey, Boolean, Integer
+from sqlalchemy import (
+    BigInteger,
+    Boolean,
+    ForeignKey,
+    Index,
+    Integer,
+    String,
+    TypeDecorator,
+    Uuid,
+)
 from sqlalchemy.orm import DeclarativeBase, Mapped, mapped_column, relationship
 
 from utils.constants import ADMIN_ROLE_ID, MOD_ROLE_ID
 
 logger = logging.getLogger("gunicorn.access")
 
+# Single hasher shared by all password operations of the process
+password_hasher = PasswordHasher()
+
+
+def configure_password_hasher(time_cost, memory_cost, parallelism):
+    """Replace parameters of the shared hasher. Hashes made with other
+    parameters still verify and are reported by `User.password_needs_rehash`.
+
+    ## Parameters:
+        **time_cost** (_int_):
+        Number of iterations. <br>
+
+        **memory_cost** (_int_):
+        Memory in kibibytes. <br>
+
+        **parallelism** (_int_):
+        Number of lanes.
+    """
+    global password_hasher  # pylint: disable=global-statement
+    password_hasher = PasswordHasher(
+        time_cost=time_cost, memory_cost=memory_cost, parallelism=parallelism
+    )
+
+
+class Identifier(TypeDecorator):  # pylint: disable=too-many-ancestors
+    """Row identifier stored as native UUID (16 bytes on PostgreSQL, hex
+    string elsewhere). Also accepts identifiers in their string form, as
+    received from JWT identities and request arguments; malformed strings
+    fail the statement."""
+
+    impl = Uuid
+    cache_ok = True
+
+    def process_bind_param(self, value, dialect):
+        if value is None or isinstance(value, uuid.UUID):
+            return value
+        return uuid.UUID(value)
+
 
 class Base(DeclarativeBase):
     """DeclarativeBase class wrapped around"""
@@ -29,7 +77,7 @@ class User(Base):
 
     __tablename__ = "users"
 
-    user_id: Mapped[str] = mapped_column(String(36), primary_key=True)
+    user_id: Mapped[uuid.UUID] = mapped_column(Identifier(), primary_key=True)
     username: Mapped[str] = mapped_column(String(32))
     passwd: Mapped[str] = mapped_column(String(256))
     email: Mapped[str] = mapped_column(String(320))
@@ -52,8 +100,7 @@ class User(Base):
             **str**:
             hashed password with algorithm argon2
         """
-        ph = PasswordHasher()
-        hashed_password = ph.hash(plain_password)
+        hashed_password = password_hasher.hash(plain_password)
         self.passwd = hashed_password
         return hashed_password
 
@@ -68,13 +115,25 @@ class User(Base):
             _bool_:
             _True_ if password is verified successfully, otherwise _False_.
         """
-        ph = PasswordHasher()
         try:
-            return ph.verify(self.passwd, plain_password)
+            return password_hasher.verify(self.passwd, plain_password)
         except exceptions.Argon2Error:
             logger.error("Password hash verification failed")
             return False
 
+    def password_needs_rehash(self):
+        """Check whether password hash was made with outdated parameters.
+
+        ### Returns:
+            _bool_:
+            _True_ if hash parameters differ from the current ones.
+        """
+        try:
+            return password_hasher.check_needs_rehash(self.passwd)
+        except exceptions.InvalidHashError:
+            logger.error("Stored password hash is malformed")
+            return False
+
     def is_privileged(self):
         """Check whether user within User model has privileged role.
 
@@ -93,21 +152,53 @@ class User(Base):
         return {c.name: getattr(self, c.name) for c in self.__table__.columns}
 
 
+class Attachment(Base):
+    """Image attachment model. Messages refer to attachments by identifier
+    only; image and thumbnail are kept in attachments storage."""
+
+    __tablename__ = "attachments"
+
+    attachment_id: Mapped[uuid.UUID] = mapped_column(Identifier(), primary_key=True)
+    file_name: Mapped[str] = mapped_column(String(36))
+    thumbnail_name: Mapped[Optional[str]] = mapped_column(String(36))
+    content_type: Mapped[str] = mapped_column(String(32))
+    file_size: Mapped[int] = mapped_column(Integer())
+    user_id: Mapped[uuid.UUID] = mapped_column(
+        Identifier(), ForeignKey("users.user_id", onupdate="CASCADE")
+    )
+
+    def to_json(self):
+        """Represent Attachment class as JSON.
+
+        Returns:
+            _str_: JSON string that contains all Attachment class parameters defined.
+        """
+        return {c.name: getattr(self, c.name) for c in self.__table__.columns}
+
+
 class Message(Base):
     """Message model"""
 
     __tablename__ = "messages"
 
-    message_id: Mapped[str] = mapped_column(String(36), primary_key=True)
+    message_id: Mapped[uuid.UUID] = mapped_column(Identifier(), primary_key=True)
     message_content: Mapped[str] = mapped_column(String(4096))
-    message_timestamp: Mapped[str] = mapped_column(String(32))
+    message_timestamp: Mapped[str] = mapped_column(String(32), index=True)
     message_edited: Mapped[bool] = mapped_column(Boolean(), default=False)
-    user_id: Mapped[str] = mapped_column(
-        String(36), ForeignKey("users.user_id", onupdate="CASCADE")
+    message_hidden: Mapped[bool] = mapped_column(Boolean(), default=False)
+    user_id: Mapped[uuid.UUID] = mapped_column(
+        Identifier(), ForeignKey("users.user_id", onupdate="CASCADE")
+    )
+
+    attachment_id: Mapped[Optional[uuid.UUID]] = mapped_column(
+        Identifier(), ForeignKey("attachments.attachment_id", ondelete="SET NULL")
     )
 
     msg_user_id: Mapped[str] = relationship("User", foreign_keys=[user_id])
 
+    # Messages of one author in id order: moderation batches walk it backwards
+    __table_args__ = (Index("ix_messages_user_id_message_id", "user_id", "message_id"),)
+
     def to_json(self):
         """Represent Message class as JSON.
 
@@ -115,3 +206,26 @@ class Message(Base):
             _str_: JSON string that contains all Message class parameters defined.
         """
         return {c.name: getattr(self, c.name) for c in self.__table__.columns}
+
+
+class ChatCounter(Base):
+    """Named counters of the chat. `messages` counts every message ever
+    sent and serves as sequence for unread counters."""
+
+    __tablename__ = "chat_counters"
+
+    counter_name: Mapped[str] = mapped_column(String(32), primary_key=True)
+    counter_value: Mapped[int] = mapped_column(BigInteger(), default=0)
+
+
+class UnreadCounter(Base):
+    """Per-user read state. Unread messages are those counted after the read
+    mark, so neither sending nor reading touches rows of other users."""
+
+    __tablename__ = "unread_counters"
+
+    user_id: Mapped[uuid.UUID] = mapped_column(
+        Identifier(), ForeignKey("users.user_id", ondelete="CASCADE"), primary_key=True
+    )
+    read_mark: Mapped[int] = mapped_column(BigInteger(), default=0)
+    mentions: Mapped[int] = mapped_column(Integer(), default=0)
@@ -0,0 +1,189 @@
+"""Bulk moderation of chat messages: set-based batches and tombstones"""
+
+import math
+import time
+import logging
+
+from utils.constants import MSG_MAX_LENGTH
+from utils.helpers import time_ordered_id
+
+logger = logging.getLogger("gunicorn.access")
+
+DELETE = "delete"
+HIDE = "hide"
+ACTIONS = (DELETE, HIDE)
+
+# Timestamps are stored as strings with 10 integer digits (from 2001-09-09
+# until year 2286), so text comparison of a bound matches numeric order only
+# within this range
+MIN_TIMESTAMP = 10**9
+MAX_TIMESTAMP = 10**10
+
+# Broadcast event carrying criteria of removed messages instead of their
+# identifiers, so its size does not depend on how many messages matched
+TOMBSTONE_EVENT = "messages_removed"
+
+
+def parse_moderation(data):
+    """Validate moderation request sent by a moderator. _ValueError_ with
+    the reason is raised for malformed requests.
+
+    ## Parameters:
+        **data** (_dict_):
+        `action` (`delete` or `hide`) and at least one criterion: `username`
+        of the author, `since` and `until` POSIX timestamps between
+        `MIN_TIMESTAMP` and `MAX_TIMESTAMP`, `match` text contained in
+        messages, case-insensitive.
+
+    ### Returns:
+        _dict_:
+        validated request. `until` is capped at current time, so messages
+        sent while the request runs are kept.
+    """
+    if not isinstance(data, dict) or data.get("action") not in ACTIONS:
+        raise ValueError("Unknown action")
+
+    moderation = {"action": data["action"]}
+
+    if data.get("username"):
+        moderation["username"] = str(data["username"])
+
+    for bound in ("since", "until"):
+        if data.get(bound) in (None, ""):
+            continue
+        try:
+            moderation[bound] = float(data[bound])
+        except (TypeError, ValueError) as error:
+            raise ValueError("Invalid time range") from error
+        if not MIN_TIMESTAMP <= moderation[bound] < MAX_TIMESTAMP:
+            raise ValueError("Invalid time range")
+
+    if data.get("match"):
+        if not isinstance(data["match"], str) or len(data["match"]) > MSG_MAX_LENGTH:
+            raise ValueError("Invalid text to match")
+        moderation["match"] = data["match"]
+
+    if len(moderation) == 1:
+        raise ValueError("At least one criterion is required")
+
+    moderation["until"] = min(moderation.get("until", math.inf), time.time())
+    if moderation.get("since", -math.inf) >= moderation["until"]:
+        raise ValueError("Invalid time range")
+
+    return moderation
+
+
+def batch_criteria(moderation, author=None):
+    """Return values bound to the batch statement of a validated request.
+
+    ## Parameters:
+        **moderation** (_dict_):
+        Request returned by `parse_moderation`. <br>
+
+        **author** (_UUID_, optional):
+        Identifier of the user named in request. Defaults to _None_.
+
+    ### Returns:
+        _dict_:
+        bound values keyed by criterion, see `statements.moderation_batch`.
+    """
+    # Bounds are validated to have 10 integer digits like stored timestamps,
+    # so string comparison matches numeric order
+    criteria = {"until": str(moderation["until"])}
+    if author is not None:
+        criteria["author"] = author
+    if "since" in moderation:
+        criteria["since"] = str(moderation["since"])
+    if "match" in moderation:
+        escaped = (
+            moderation["match"].replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+        )
+        criteria["pattern"] = f"%{escaped}%"
+    return criteria
+
+
+def tombstone(moderation):
+    """Return payload telling clients which messages to remove. Clients
+    apply the same criteria to messages they show."""
+    return {
+        key: moderation[key] for key in ("username", "since", "until", "match") if key in moderation
+    }
+
+
+class ModerationBatches:
+    """Progress of a request through its batches. Every batch is one
+    statement in its own short transaction, walking messages newest first
+    below the last changed one, so requests touching a large share of the
+    table neither hold long locks nor scan rows twice. The batches are run
+    by `moderate_messages` and by the async handler.
+
+    ## Parameters:
+        **moderation** (_dict_):
+        Request returned by `parse_moderation`. <br>
+
+        **author** (_UUID_):
+        Identifier of the user named in request, _None_ if none is. <br>
+
+        **batch_size** (_int_):
+        Maximum number of messages changed per transaction.
+    """
+
+    def __init__(self, moderation, author, batch_size):
+        self.criteria = batch_criteria(moderation, author)
+        self.hide = moderation["action"] == HIDE
+        self.batch_size = batch_size
+        # Messages sent after the request started get greater identifiers
+        self.cursor = time_ordered_id()
+        self.changed = 0
+
+    def advance(self, batch):
+        """Account identifiers of messages changed by a batch and return
+        whether another batch follows"""
+        self.changed += len(batch)
+        logger.debug("%s messages moderated", len(batch))
+
+        if len(batch) < self.batch_size:
+            return False
+        self.cursor = min(batch)
+        return True
+
+
+def moderate_messages(message_service, moderation, author, batch_size, pause, sleep=time.sleep):
+    """Delete or hide all messages matching request in batches, see
+    `ModerationBatches`.
+
+    ## Parameters:
+        **message_service** (_MessageService_):
+        Service used to change messages. <br>
+
+        **moderation** (_dict_):
+        Request returned by `parse_moderation`. <br>
+
+        **author** (_UUID_):
+        Identifier of the user named in request, _None_ if none is. <br>
+
+        **batch_size** (_int_):
+        Maximum number of messages changed per transaction. <br>
+
+        **pause** (_float_):
+        Seconds to wait between batches, yielding to live traffic. <br>
+
+        **sleep** (_Callable_, optional):
+        Function used to wait. Defaults to `time.sleep`.
+
+    ### Returns:
+        _int_:
+        total count of changed messages. _None_ if a batch failed; batches
+        before it stay applied and the request may be repeated.
+    """
+    batches = ModerationBatches(moderation, author, batch_size)
+
+    while True:
+        batch = message_service.moderate_messages(
+            batches.criteria, batches.cursor, batch_size, batches.hide
+        )
+        if batch is None:
+            return None
+        if not batches.advance(batch):
+            return batches.changed
+        sleep(pause)
@@ -0,0 +1,174 @@
+"""Encoding of chat events sent through Socket.IO.
+
+Clients choose encoding on connect (`auth={"encoding": "msgpack"}`):
+- `json` (default): dicts with named fields, timestamps as strings.
+- `msgpack`: binary frames with positional fields and integer
+  millisecond timestamps, `[username, message, timestamp]`.
+
+Messages with an image attachment carry only its identifier: an extra
+`attachment` field, or a fourth positional field in `msgpack`. Images are
+fetched over HTTP and never travel through the broadcast path.
+
+Stored messages also carry their identifier, so later edits and deletions
+can point at them: a `message_id` field, plus `edited` once the message was
+edited; in `msgpack`, fifth and sixth positional fields, the fourth being
+_nil_ without attachment.
+"""
+
+import uuid
+
+import msgpack
+
+from utils.constants import MSG_MAX_LENGTH
+
+JSON = "json"
+MSGPACK = "msgpack"
+ENCODINGS = (JSON, MSGPACK)
+
+# Changes of a sent message, broadcast as small deltas clients apply in
+# place: `message_id` and new `message` of an edit, `message_id` of a
+# deletion. Both encodings get the same dict.
+EDIT_EVENT = "message_edited"
+DELETE_EVENT = "message_deleted"
+
+
+def negotiate_encoding(auth):
+    """Pick encoding requested by client on connect.
+
+    ## Parameters:
+        **auth** (_dict_ | _None_):
+        Authentication data sent by client on connect.
+
+    ### Returns:
+        _str_:
+        supported encoding name, `json` if nothing valid was requested.
+    """
+    if isinstance(auth, dict) and auth.get("encoding") in ENCODINGS:
+        return auth["encoding"]
+    return JSON
+
+
+def encoding_room(encoding):
+    """Return name of room joined by all clients using encoding"""
+    return f"encoding:{encoding}"
+
+
+def to_millis(timestamp):
+    """Convert stored POSIX timestamp string to integer milliseconds"""
+    return int(float(timestamp) * 1000)
+
+
+def encode_message(
+    username, message, timestamp, encoding, attachment=None, message_id=None, edited=False
+):
+    """Build chat message payload in requested encoding.
+
+    ## Parameters:
+        **username** (_str_):
+        Author's username. <br>
+
+        **message** (_str_):
+        Message content. <br>
+
+        **timestamp** (_str_):
+        POSIX timestamp as stored in database. <br>
+
+        **encoding** (_str_):
+        One of `ENCODINGS`. <br>
+
+        **attachment** (_UUID_, optional):
+        Identifier of attached image. Defaults to _None_. <br>
+
+        **message_id** (_UUID_, optional):
+        Identifier of the message. Defaults to _None_. <br>
+
+        **edited** (_bool_, optional):
+        Set _True_ if message was edited. Defaults to _False_.
+
+    ### Returns:
+        _dict_ | _bytes_:
+        payload ready to emit.
+    """
+    fields = (username, message, timestamp, attachment, message_id, edited)
+    if encoding == MSGPACK:
+        return msgpack.packb(_positional(*fields))
+
+    return _named(*fields)
+
+
+def encode_messages(rows, encoding):
+    r"""Build one payload with a batch of chat messages.
+
+    ## Parameters:
+        **rows** (_List\[Tuple\[str, str, str, UUID, UUID, bool\]\]_):
+        username, message content, timestamp and optionally attachment
+        identifier (_None_ without attachment), message identifier and
+        edited flag of each message. <br>
+
+        **encoding** (_str_):
+        One of `ENCODINGS`.
+
+    ### Returns:
+        _List\[dict\]_ | _bytes_:
+        payload ready to emit.
+    """
+    if encoding == MSGPACK:
+        return msgpack.packb([_positional(*row) for row in rows])
+
+    return [_named(*row) for row in rows]
+
+
+def _positional(username, message, timestamp, attachment=None, message_id=None, edited=False):
+    fields = [username, message, to_millis(timestamp)]
+    if attachment is not None or message_id is not None:
+        fields.append(str(attachment) if attachment is not None else None)
+    if message_id is not None:
+        fields.append(str(message_id))
+        if edited:
+            fields.append(True)
+    return fields
+
+
+def _named(username, message, timestamp, attachment=None, message_id=None, edited=False):
+    fields = {"username": username, "message": message, "timestamp": str(timestamp)}
+    if attachment is not None:
+        fields["attachment"] = str(attachment)
+    if message_id is not None:
+        fields["message_id"] = str(message_id)
+        if edited:
+            fields["edited"] = True
+    return fields
+
+
+def parse_message_change(data, edit):
+    r"""Validate edit or deletion request of a sent message. _ValueError_
+    with the reason is raised for malformed requests.
+
+    ## Parameters:
+        **data** (_dict_):
+        `message_id` of the message and, for an edit, its new `message`. <br>
+
+        **edit** (_bool_):
+        _True_ for an edit, _False_ for a deletion.
+
+    ### Returns:
+        _Tuple\[UUID, str\]_:
+        message identifier and new content, _None_ for a deletion.
+    """
+    if not isinstance(data, dict):
+        raise ValueError("Malformed request")
+
+    try:
+        message_id = uuid.UUID(str(data["message_id"]))
+    except (KeyError, ValueError) as error:
+        raise ValueError("Unknown message") from error
+
+    if not edit:
+        return message_id, None
+
+    message = data.get("message")
+    if not isinstance(message, str) or not message.strip():
+        raise ValueError("Message cannot be empty")
+    if len(message) > MSG_MAX_LENGTH:
+        raise ValueError(f"The limit of message length ({MSG_MAX_LENGTH} symbols) is exceeded")
+    return message_id, message
@@ -0,0 +1,211 @@
+"""Online users of this worker, kept in memory from heartbeats of sockets"""
+
+import os
+import time
+import uuid
+import logging
+import threading
+
+from utils.constants import PRESENCE_HEARTBEAT, PRESENCE_TTL
+
+logger = logging.getLogger("gunicorn.access")
+
+# Full list of online users, sent to the client asking for it
+SNAPSHOT_EVENT = "presence_snapshot"
+# Users who came online or went offline since the last tick, broadcast
+DELTA_EVENT = "presence"
+
+
+class Presence:
+    """Sockets of users connected to this worker and the users they make
+    online. Heartbeats only refresh a timestamp; sockets silent for longer
+    than `ttl` are dropped by `sweep`, run once per tick for all of them.
+    Changes are collected between ticks, so a user reconnecting within a
+    tick produces no delta at all.
+
+    Each worker reports its own users under its `worker` identifier;
+    clients merge reports of all workers.
+
+    ## Parameters:
+        **ttl** (_float_):
+        Seconds a socket stays online after its last heartbeat. <br>
+
+        **heartbeat** (_float_):
+        Seconds between heartbeats clients are asked to send.
+    """
+
+    def __init__(self, ttl, heartbeat):
+        self.ttl = ttl
+        self.heartbeat_interval = heartbeat
+        self.worker = uuid.uuid4().hex[:12]
+        # sid -> [username, last heartbeat, online]
+        self._sockets = {}
+        # username -> count of its online sockets
+        self._online = {}
+        self._changed = set()
+        self._announced = set()
+        self._lock = threading.Lock()
+
+        # Workers forked from a preloaded app must not share the identifier
+        os.register_at_fork(after_in_child=self._renew_worker)
+
+    def _renew_worker(self):
+        self.worker = uuid.uuid4().hex[:12]
+
+    def _up(self, username):
+        count = self._online.get(username, 0)
+        self._online[username] = count + 1
+        if count == 0:
+            self._changed.add(username)
+
+    def _down(self, username):
+        count = self._online.pop(username) - 1
+        if count:
+            self._online[username] = count
+        else:
+            self._changed.add(username)
+
+    def connect(self, sid, username, now=None):
+        """Make user of a newly connected socket online"""
+        now = now if now is not None else time.monotonic()
+        with self._lock:
+            if sid in self._sockets:
+                return
+            self._sockets[sid] = [username, now, True]
+            self._up(username)
+
+    def heartbeat(self, sid, now=None):
+        """Keep socket online. A socket dropped by `sweep` comes back.
+
+        ### Returns:
+            _bool_:
+            _False_ if the socket is not known, e.g. it never connected.
+        """
+        entry = self._sockets.get(sid)
+        if entry is None:
+            return False
+
+        entry[1] = now if now is not None else time.monotonic()
+        if not entry[2]:
+            with self._lock:
+                if not entry[2]:
+                    entry[2] = True
+                    self._up(entry[0])
+        return True
+
+    def disconnect(self, sid):
+        """Forget socket, making its user offline if it was the last one"""
+        with self._lock:
+            entry = self._sockets.pop(sid, None)
+            if entry is not None and entry[2]:
+                self._down(entry[0])
+
+    def sweep(self, now=None):
+        """Drop sockets without heartbeat for `ttl` seconds.
+
+        ### Returns:
+            _int_:
+            count of dropped sockets.
+        """
+        deadline = (now if now is not None else time.monotonic()) - self.ttl
+        dropped = 0
+        with self._lock:
+            for entry in self._sockets.values():
+                if entry[2] and entry[1] < deadline:
+                    entry[2] = False
+                    self._down(entry[0])
+                    dropped += 1
+        if dropped:
+            logger.debug("%s silent sockets dropped from presence", dropped)
+        return dropped
+
+    def take_delta(self):
+        """Return users who came online or went offline since the last
+        call, _None_ if there are none.
+
+        ### Returns:
+            _dict_:
+            `worker` identifier, `joined` and `left` usernames.
+        """
+        with self._lock:
+            if not self._changed:
+                return None
+
+            joined, left = [], []
+            for username in self._changed:
+                if username in self._online and username not in self._announced:
+                    joined.append(username)
+                    self._announced.add(username)
+                elif username not in self._online and username in self._announced:
+                    left.append(username)
+                    self._announced.discard(username)
+            self._changed.clear()
+
+        if not joined and not left:
+            return None
+        return {"worker": self.worker, "joined": joined, "left": left}
+
+    def tick(self, now=None):
+        """Drop silent sockets and return the resulting delta, see
+        `sweep` and `take_delta`. Run by broadcasters once per tick."""
+        self.sweep(now)
+        return self.take_delta()
+
+    def snapshot(self):
+        """Return users online on this worker for a newly connected client.
+
+        ### Returns:
+            _dict_:
+            `worker` identifier, `online` usernames and `heartbeat` interval
+            in seconds.
+        """
+        with self._lock:
+            online = sorted(self._online)
+        return {"worker": self.worker, "online": online, "heartbeat": self.heartbeat_interval}
+
+
+class PresenceBroadcaster:
+    """Background task expiring silent sockets and broadcasting deltas of
+    online users once per tick
+
+    ## Parameters:
+        **socketio** (_SocketIO_):
+        Server broadcasting the deltas. <br>
+
+        **presence** (_Presence_):
+        Online users of this worker. <br>
+
+        **tick** (_float_):
+        Seconds between sweeps.
+    """
+
+    def __init__(self, socketio, presence, tick):
+        self.socketio = socketio
+        self.presence = presence
+        self.tick = tick
+        self._started = False
+        self._lock = threading.Lock()
+
+    def start(self):
+        """Start background task once per process"""
+        if self._started:
+            return
+
+        with self._lock:
+            if self._started:
+                return
+            self._started = True
+
+        self.socketio.start_background_task(self._run)
+        logger.info("Presence broadcaster started")
+
+    def _run(self):
+        while True:
+            self.socketio.sleep(self.tick)
+            delta = self.presence.tick()
+            if delta is not None:
+                self.socketio.emit(DELTA_EVENT, delta)
+
+
+# Online users of this process
+presence = Presence(PRESENCE_TTL, PRESENCE_HEARTBEAT)
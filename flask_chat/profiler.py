@@ -0,0 +1,195 @@
+"""Time-bounded sampling profiler of the serving worker"""
+
+import os
+import sys
+import time
+import signal
+import logging
+import threading
+from collections import Counter
+
+logger = logging.getLogger("gunicorn.access")
+
+
+def frame_label(code):
+    """Return flamegraph label of a code object: `module:function:line`"""
+    module = os.path.splitext(os.path.basename(code.co_filename))[0]
+    return f"{module}:{code.co_name}:{code.co_firstlineno}"
+
+
+def walk_stack(frame, skip=None):
+    r"""Return stack of frame as a tuple of code objects, outermost first.
+
+    ## Parameters:
+        **frame** (_FrameType_):
+        Innermost frame of the sampled stack. <br>
+
+        **skip** (_CodeType_, optional):
+        Code object of the sampler itself, dropped from the stack top.
+
+    ### Returns:
+        _Tuple\[CodeType, ...\]_:
+        code objects of the stack.
+    """
+    codes = []
+    while frame is not None:
+        if frame.f_code is not skip:
+            codes.append(frame.f_code)
+        frame = frame.f_back
+    codes.reverse()
+    return tuple(codes)
+
+
+class SamplingProfiler:
+    """Statistical profiler sampling call stacks of the process it runs in.
+
+    In the main thread of a worker the stack is sampled on `SIGPROF`, which
+    fires per consumed CPU time: under eventlet all request and socket
+    handlers run in greenlets of the main thread, so samples land on
+    whichever handler is burning CPU. Elsewhere, like threaded development
+    servers, a sampler thread reads stacks of all threads on wall clock.
+
+    Each gunicorn worker profiles only itself.
+    """
+
+    def __init__(self):
+        self.samples = Counter()
+        self.mode = None
+        self.interval = None
+        self.started_at = None
+        self.finished_at = None
+        self._deadline = 0.0
+        self._lock = threading.Lock()
+
+    @property
+    def running(self):
+        """Whether a profile is being collected"""
+        return (
+            self.started_at is not None
+            and self.finished_at is None
+            and time.monotonic() < self._deadline
+        )
+
+    @property
+    def sample_count(self):
+        """Total count of collected samples"""
+        return sum(self.samples.values())
+
+    def start(self, duration, interval):
+        """Start collecting a profile, discarding the previous one.
+
+        ## Parameters:
+            **duration** (_float_):
+            Seconds after which sampling stops by itself. <br>
+
+            **interval** (_float_):
+            Seconds between two samples.
+
+        ### Returns:
+            _bool_:
+            _False_ if a profile is already being collected.
+        """
+        with self._lock:
+            if self.running:
+                return False
+
+            # Release the timer of an expired profile no signal has stopped yet
+            self.stop()
+
+            self.samples = Counter()
+            self.interval = interval
+            self.started_at = time.time()
+            self.finished_at = None
+            self._deadline = time.monotonic() + duration
+
+            try:
+                # Signal handlers can only be set from the main OS thread
+                signal.signal(signal.SIGPROF, self._on_signal)
+                signal.setitimer(signal.ITIMER_PROF, interval, interval)
+                self.mode = "signal"
+            except (AttributeError, ValueError):
+                self.mode = "thread"
+                threading.Thread(
+                    target=self._sample_threads, name="profiler", daemon=True
+                ).start()
+
+        logger.info("Profiling started: %s mode for %s seconds", self.mode, duration)
+        return True
+
+    def stop(self):
+        """Stop collecting profile, keeping collected samples"""
+        if self.mode == "signal":
+            signal.setitimer(signal.ITIMER_PROF, 0, 0)
+            signal.signal(signal.SIGPROF, signal.SIG_IGN)
+
+        if self.started_at is not None and self.finished_at is None:
+            self.finished_at = time.time()
+            logger.info("Profiling finished: %s samples", self.sample_count)
+
+    def _on_signal(self, signum, frame):  # pylint: disable=unused-argument
+        if not self.running:
+            self.stop()
+            return
+        self.samples[walk_stack(frame)] += 1
+
+    def _sample_threads(self):
+        own = threading.get_ident()
+        skip = sys._getframe().f_code  # pylint: disable=protected-access
+
+        while self.running:
+            for ident, frame in sys._current_frames().items():  # pylint: disable=protected-access
+                if ident != own:
+                    self.samples[walk_stack(frame, skip)] += 1
+            time.sleep(self.interval)
+
+        self.stop()
+
+    def collapsed(self):
+        """Return profile in collapsed stack format read by flamegraph.pl,
+        speedscope and similar tools: `frame;frame;frame count` per line.
+
+        ### Returns:
+            _str_:
+            collapsed stacks, heaviest first.
+        """
+        lines = [
+            ";".join(frame_label(code) for code in stack) + f" {count}"
+            for stack, count in self.samples.most_common()
+            if stack
+        ]
+        return "\n".join(lines) + "\n"
+
+    def top(self, limit):
+        r"""Return hottest functions of collected profile.
+
+        ## Parameters:
+            **limit** (_int_):
+            Maximum count of functions returned.
+
+        ### Returns:
+            _List\[dict\]_:
+            function label with self and total (inclusive) sample counts and
+            their share of all samples, ordered by self samples.
+        """
+        own, total = Counter(), Counter()
+        for stack, count in self.samples.items():
+            if not stack:
+                continue
+            own[stack[-1]] += count
+            # Recursive functions are counted once per stack
+            for code in set(stack):
+                total[code] += count
+
+        samples = self.sample_count or 1
+        hottest = sorted(total, key=lambda code: (own[code], total[code]), reverse=True)
+        return [
+            {
+                "function": frame_label(code),
+                "file": code.co_filename,
+                "self": own[code],
+                "total": total[code],
+                "self_percent": round(own[code] / samples * 100, 1),
+                "total_percent": round(total[code] / samples * 100, 1),
+            }
+            for code in hottest[:limit]
+        ]
@@ -0,0 +1,265 @@
+"""Per-statement timing attributed to service methods: slow-query log with
+captured plans, per-shape stats and logging of database errors"""
+
+import re
+import sys
+import hashlib
+import logging
+import threading
+
+from sqlalchemy import event
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.ext.asyncio import async_sessionmaker
+
+from metrics import observe_queries, register_query_timing
+from utils.constants import QUERY_LOG_MAX_PARAMETERS, QUERY_LOG_MAX_SHAPES, SLOW_QUERY_MS
+
+logger = logging.getLogger("gunicorn.access")
+
+# Placeholder lists of expanded IN clauses and multi-row VALUES differ in
+# length only; they are collapsed so such statements share one shape
+_PLACEHOLDER = r"(?:\?|%s|%\(\w+\)s|\$\d+|:\w+)(?:::\w+)?"
+_PLACEHOLDER_LIST = re.compile(rf"\({_PLACEHOLDER}(?:, {_PLACEHOLDER})*\)")
+_REPEATED_LISTS = re.compile(r"\(\.\.\.\)(?:, \(\.\.\.\))+")
+
+# Statements prefixed to get the plan of a statement without running it
+EXPLAIN = {
+    "postgresql": "EXPLAIN ",
+    "sqlite": "EXPLAIN QUERY PLAN ",
+}
+
+
+def statement_shape(statement):
+    """Return statement text with placeholder lists collapsed"""
+    return _REPEATED_LISTS.sub("(...)", _PLACEHOLDER_LIST.sub("(...)", statement))
+
+
+def redact(parameters, executemany=False):
+    """Return parameters with values replaced by their type names, safe to
+    log: parameters hold password hashes, e-mails and message contents"""
+    if executemany:
+        return f"<{len(parameters)} rows>"
+    if len(parameters or ()) > QUERY_LOG_MAX_PARAMETERS:
+        return f"<{len(parameters)} parameters>"
+    if isinstance(parameters, dict):
+        return {key: type(value).__name__ for key, value in parameters.items()}
+    return [type(value).__name__ for value in parameters or ()]
+
+
+def _operation_bind(factory, operation):
+    """Return engine of a session factory labelling statements with the
+    service method opening the session, one per method"""
+    bind = factory.operation_binds.get(operation)
+    if bind is None:
+        bind = factory.kw["bind"].execution_options(operation=operation)
+        factory.operation_binds[operation] = bind
+    return bind
+
+
+class TracedSessionmaker(sessionmaker):
+    """Session factory of services. Sessions are bound to the engine with
+    `operation` execution option naming the method that opened them, so
+    every statement, flushes included, is attributed to a service method."""
+
+    def __init__(self, bind, **kw):
+        super().__init__(bind, **kw)
+        self.operation_binds = {}
+
+    def __call__(self, **local_kw):
+        operation = sys._getframe(1).f_code.co_qualname  # pylint: disable=protected-access
+        local_kw.setdefault("bind", _operation_bind(self, operation))
+        return super().__call__(**local_kw)
+
+
+class TracedAsyncSessionmaker(async_sessionmaker):
+    """Async session factory attributing statements like `TracedSessionmaker`"""
+
+    def __init__(self, bind, **kw):
+        super().__init__(bind, **kw)
+        self.operation_binds = {}
+
+    def __call__(self, **local_kw):
+        operation = sys._getframe(1).f_code.co_qualname  # pylint: disable=protected-access
+        local_kw.setdefault("bind", _operation_bind(self, operation))
+        return super().__call__(**local_kw)
+
+
+class QueryLog:
+    """Stats of executed statements grouped by shape: count, total and
+    maximum time, slow executions and errors, with the service methods
+    running them. Statements slower than threshold are logged with
+    redacted parameters, and the plan of each shape is captured the first
+    time it is slow.
+
+    ## Parameters:
+        **threshold_ms** (_float_):
+        Statements running at least this long are slow. <br>
+
+        **max_shapes** (_int_):
+        Shapes tracked at most; statements of further shapes are only logged.
+    """
+
+    def __init__(self, threshold_ms, max_shapes):
+        self.threshold_ms = threshold_ms
+        self.max_shapes = max_shapes
+        self._shapes = {}
+        self._lock = threading.Lock()
+
+    def _entry(self, statement):
+        """Return stats entry of statement shape, _None_ past `max_shapes`"""
+        shape = statement_shape(statement)
+        entry = self._shapes.get(shape)
+        if entry is not None or len(self._shapes) >= self.max_shapes:
+            return entry
+
+        with self._lock:
+            return self._shapes.setdefault(
+                shape,
+                {
+                    "shape_id": hashlib.sha1(shape.encode()).hexdigest()[:12],
+                    "statement": shape,
+                    "operations": {},
+                    "count": 0,
+                    "total_ms": 0.0,
+                    "max_ms": 0.0,
+                    "slow": 0,
+                    "errors": 0,
+                    "plan": None,
+                },
+            )
+
+    def _finish(self, conn, statement, parameters, context, executemany, elapsed):
+        operation = context.execution_options.get("operation", "-")
+        entry = self._entry(statement)
+
+        if entry is not None:
+            with self._lock:
+                entry["count"] += 1
+                entry["total_ms"] += elapsed
+                entry["max_ms"] = max(entry["max_ms"], elapsed)
+                entry["operations"][operation] = entry["operations"].get(operation, 0) + 1
+                if elapsed >= self.threshold_ms:
+                    entry["slow"] += 1
+
+        if elapsed < self.threshold_ms:
+            return
+
+        logger.warning(
+            "Slow query in %s: %.1f ms, parameters %s: %s",
+            operation,
+            elapsed,
+            redact(parameters, executemany),
+            " ".join(statement.split()),
+        )
+        if entry is not None and entry["plan"] is None and not executemany:
+            # Marked first, so a failing plan is not attempted again
+            entry["plan"] = ""
+            entry["plan"] = self.capture_plan(conn, statement, parameters)
+            if entry["plan"]:
+                logger.warning("Plan of query %s:\n%s", entry["shape_id"], entry["plan"])
+
+    def _error(self, exception_context):
+        context = exception_context.execution_context
+        operation = context.execution_options.get("operation", "-") if context else "-"
+        statement = exception_context.statement
+
+        if statement is not None:
+            entry = self._entry(statement)
+            if entry is not None:
+                with self._lock:
+                    entry["errors"] += 1
+
+        logger.error(
+            "Query failed in %s: %r: %s",
+            operation,
+            exception_context.original_exception,
+            " ".join((statement or "").split()),
+        )
+
+    def capture_plan(self, conn, statement, parameters):
+        """Return plan of a statement without running it again. On PostgreSQL
+        it is explained within a savepoint, so a failure leaves the
+        transaction of the caller usable.
+
+        ## Parameters:
+            **conn** (_Connection_):
+            Connection the statement ran on. <br>
+
+            **statement** (_str_):
+            Statement text as sent to the driver. <br>
+
+            **parameters** (_dict_ | _tuple_):
+            Parameters it ran with.
+
+        ### Returns:
+            _str_:
+            plan, one line per row. Empty if the backend is not supported.
+        """
+        dialect = conn.dialect.name
+        if dialect not in EXPLAIN:
+            return ""
+
+        cursor = conn.connection.dbapi_connection.cursor()
+        savepoint = dialect == "postgresql"
+        try:
+            if savepoint:
+                cursor.execute("SAVEPOINT query_plan")
+            cursor.execute(EXPLAIN[dialect] + statement, parameters)
+            plan = "\n".join(str(row[-1]) for row in cursor.fetchall())
+            if savepoint:
+                cursor.execute("RELEASE SAVEPOINT query_plan")
+            return plan
+        except conn.dialect.loaded_dbapi.Error as error:
+            logger.info("Plan could not be captured: %s", error)
+            if savepoint:
+                cursor.execute("ROLLBACK TO SAVEPOINT query_plan")
+            return ""
+        finally:
+            cursor.close()
+
+    def stats(self):
+        r"""Return stats of every tracked shape, most total time first.
+
+        ### Returns:
+            _List\[dict\]_:
+            shape stats with mean time, times rounded to 0.01 ms.
+        """
+        with self._lock:
+            entries = [
+                {**entry, "operations": dict(entry["operations"])}
+                for entry in self._shapes.values()
+            ]
+
+        for entry in entries:
+            entry["mean_ms"] = round(entry["total_ms"] / max(entry["count"], 1), 2)
+            entry["total_ms"] = round(entry["total_ms"], 2)
+            entry["max_ms"] = round(entry["max_ms"], 2)
+
+        return sorted(entries, key=lambda entry: entry["total_ms"], reverse=True)
+
+    def reset(self):
+        """Drop all collected stats and plans"""
+        with self._lock:
+            self._shapes.clear()
+
+    def register(self, engine, threshold_ms=None):
+        """Collect stats of statements executed on engine, timed by the
+        query timing of live stats.
+
+        ## Parameters:
+            **engine** (_Engine_):
+            SQLAlchemy engine to attach the hooks to. <br>
+
+            **threshold_ms** (_float_, optional):
+            New slow statement threshold. Defaults to _None_, keeping current one.
+        """
+        if threshold_ms is not None:
+            self.threshold_ms = threshold_ms
+        register_query_timing(engine)
+        observe_queries(self._finish)
+        if not event.contains(engine, "handle_error", self._error):
+            event.listen(engine, "handle_error", self._error)
+
+
+# Query log of this process, shared by all applications it serves
+query_log = QueryLog(SLOW_QUERY_MS, QUERY_LOG_MAX_SHAPES)
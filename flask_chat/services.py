@@ -4,12 +4,37 @@ import os
 import logging
 
 from datetime import datetime
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
 from sqlalchemy.exc import SQLAlchemyError
 
-from models import User, Message
-from utils.helpers import random_strings_generator
+from querylog import TracedSessionmaker
+from models import Attachment, UnreadCounter, User, Message
+from statements import (
+    ADD_MENTIONS,
+    ADVANCE_MESSAGE_SEQUENCE,
+    ADVANCE_MODERATION_REVISION,
+    ALL_USERS,
+    ATTACHMENT_BY_ID,
+    DELETE_MESSAGE,
+    DELETE_OWN_MESSAGE,
+    EDIT_MESSAGE,
+    HISTORY_BEFORE,
+    HISTORY_LATEST,
+    MARK_READ,
+    MESSAGE_SEQUENCE,
+    MESSAGES_COUNT,
+    MESSAGES_PAGE,
+    MODERATION_REVISION,
+    PROFILE_PICTURES,
+    PURGE_MESSAGES,
+    UNREAD_COUNTERS,
+    USER_HISTORY_BEFORE,
+    USER_HISTORY_LATEST,
+    USER_BY_ID,
+    USER_LOOKUPS,
+    USERS_BY_USERNAMES,
+    moderation_batch,
+)
+from utils.helpers import time_ordered_id
 from utils.constants import MSG_LOAD_BATCH, ADMIN_ROLE_ID, USER_ROLE_ID
 
 # Initialise logger
@@ -21,16 +46,15 @@ POSTGRES_PASSWORD = os.getenv("POSTGRES_PASSWORD")
 POSTGRES_DATABASE = os.getenv("PGDATABASE")
 POSTGRES_HOSTNAME = os.getenv("POSTGRES_HOSTNAME")
 
-# Connect to database
+# Default database connection string
 conn_string = f"postgresql+psycopg2://{POSTGRES_USER}:{POSTGRES_PASSWORD}@{POSTGRES_HOSTNAME}:5432/{POSTGRES_DATABASE}"
-engine = create_engine(conn_string)
 
 
 class UserService:
     """Operate user-related transactions"""
 
-    def __init__(self):
-        self.session = sessionmaker(engine)
+    def __init__(self, engine):
+        self.session = TracedSessionmaker(engine)
 
     def get_user_by_id(self, identity):
         """Return User object by its identifier.
@@ -47,10 +71,10 @@ class UserService:
         logger.debug("Starting a session.")
 
         try:
-            result = session.query(User).get(identity)
+            result = session.scalars(USER_BY_ID, {"user_id": identity}).first()
             return result
-        except SQLAlchemyError:
-            logger.error("An error occured while establishing conection with PostgreSQL instance.")
+        except SQLAlchemyError as error:
+            logger.error("An error occured while establishing conection with PostgreSQL instance: %s", error)
             return None
         finally:
             logger.debug("Closing session.")
@@ -68,14 +92,37 @@ class UserService:
         logger.debug("Starting a session.")
 
         try:
-            if kwargs:
-                results = session.query(User).filter_by(**kwargs).all()
+            if not kwargs:
+                results = session.scalars(ALL_USERS).all()
+            elif len(kwargs) == 1 and next(iter(kwargs)) in USER_LOOKUPS:
+                # Prebuilt statement for the common single-column lookups
+                [(column, value)] = kwargs.items()
+                results = session.scalars(USER_LOOKUPS[column], {column: value}).all()
             else:
-                results = session.query(User).all()
+                results = session.query(User).filter_by(**kwargs).all()
 
             return results
-        except SQLAlchemyError:
-            logger.error("An error occured while establishing conection with PostgreSQL instance.")
+        except SQLAlchemyError as error:
+            logger.error("An error occured while establishing conection with PostgreSQL instance: %s", error)
+            return None
+        finally:
+            logger.debug("Closing session.")
+            session.close()
+
+    def get_profile_pictures(self):
+        r"""Return names of all profile pictures referenced by users.
+
+        ### Returns:
+            _Set\[str\]_:
+            referenced file names. _None_ if an exception is caught.
+        """
+        session = self.session()
+        logger.debug("Starting a session.")
+
+        try:
+            return set(session.scalars(PROFILE_PICTURES))
+        except SQLAlchemyError as error:
+            logger.error("An error occured while establishing conection with PostgreSQL instance: %s", error)
             return None
         finally:
             logger.debug("Closing session.")
@@ -108,7 +155,7 @@ class UserService:
                 role = ADMIN_ROLE_ID
 
             new_user = User(
-                user_id=random_strings_generator(),
+                user_id=time_ordered_id(),
                 username=username,
                 email=email,
                 role_id=role,
@@ -116,10 +163,18 @@ class UserService:
             new_user.set_password(password)
 
             session.add(new_user)
+            # Messages sent before registration are not unread
+            session.add(
+                UnreadCounter(
+                    user_id=new_user.user_id,
+                    read_mark=session.scalar(MESSAGE_SEQUENCE) or 0,
+                    mentions=0,
+                )
+            )
             session.commit()
             return True
-        except SQLAlchemyError:
-            logger.error("An error occured while establishing conection with PostgreSQL instance.")
+        except SQLAlchemyError as error:
+            logger.error("An error occured while establishing conection with PostgreSQL instance: %s", error)
             return False
         finally:
             logger.debug("Closing session.")
@@ -153,8 +208,8 @@ class UserService:
                 return False
 
             session.commit()
-        except SQLAlchemyError:
-            logger.error("An error occured while establishing conection with PostgreSQL instance.")
+        except SQLAlchemyError as error:
+            logger.error("An error occured while establishing conection with PostgreSQL instance: %s", error)
             return False
         finally:
             logger.debug("Closing session.")
@@ -169,11 +224,99 @@ class UserService:
 
 
 
+    def get_user_ids(self, usernames):
+        r"""Resolve usernames to user identifiers. Unknown usernames are skipped.
+
+        ## Parameters:
+            **usernames** (_List\[str\]_):
+            Usernames to look up.
+
+        ### Returns:
+            _dict\[str, UUID\]_:
+            user identifiers by username. _None_ if exception is caught.
+        """
+        if not usernames:
+            return {}
+
+        session = self.session()
+        logger.debug("Starting a session.")
+
+        try:
+            rows = session.execute(USERS_BY_USERNAMES, {"usernames": list(usernames)})
+            return {row.username: row.user_id for row in rows}
+        except SQLAlchemyError as error:
+            logger.error("An error occured while establishing conection with PostgreSQL instance: %s", error)
+            return None
+        finally:
+            logger.debug("Closing session.")
+            session.close()
+
+    def get_unread_counters(self, identity):
+        """Return count of unread messages and mentions of user. Reads two
+        rows by primary key, whatever the size of the history.
+
+        ## Parameters:
+            **identity** (_str_):
+            User unique identifier.
+
+        ### Returns:
+            _dict_:
+            `unread` and `mentions` counts. _None_ if exception is caught.
+        """
+        session = self.session()
+        logger.debug("Starting a session.")
+
+        try:
+            row = session.execute(UNREAD_COUNTERS, {"user_id": identity}).first()
+            if row is None:
+                return {"unread": 0, "mentions": 0}
+            return {"unread": row.unread, "mentions": row.mentions}
+        except SQLAlchemyError as error:
+            logger.error("An error occured while establishing conection with PostgreSQL instance: %s", error)
+            return None
+        finally:
+            logger.debug("Closing session.")
+            session.close()
+
+    def mark_read(self, identity):
+        """Mark every message sent so far as read by user and reset mentions.
+
+        ## Parameters:
+            **identity** (_str_):
+            User unique identifier.
+
+        ### Returns:
+            _bool_:
+            _True_ if operation is successful, otherwise _False_.
+        """
+        session = self.session()
+        logger.debug("Starting a session.")
+
+        try:
+            if session.execute(MARK_READ, {"reader_id": identity}).rowcount < 1:
+                # Users registered before unread counters get theirs on first read
+                session.add(
+                    UnreadCounter(
+                        user_id=identity,
+                        read_mark=session.scalar(MESSAGE_SEQUENCE) or 0,
+                        mentions=0,
+                    )
+                )
+            session.commit()
+            return True
+        except SQLAlchemyError as error:
+            logger.error("An error occured while establishing conection with PostgreSQL instance: %s", error)
+            return False
+        finally:
+            logger.debug("Closing session.")
+            session.close()
+
+
 class MessageService:
     """Operate messages-related transactions"""
 
-    def __init__(self):
-        self.session = sessionmaker(engine)
+    def __init__(self, engine):
+        self.session = TracedSessionmaker(engine)
 
     def count(self):
         """Return total count of messages stored in database. Return _None_
@@ -183,45 +326,328 @@ class MessageService:
         logger.debug("Starting a session.")
 
         try:
-            total_count = session.query(Message).count()
+            total_count = session.scalar(MESSAGES_COUNT)
             return total_count
-        except SQLAlchemyError:
-            logger.error("An error occured while establishing conection with PostgreSQL instance.")
+        except SQLAlchemyError as error:
+            logger.error("An error occured while establishing conection with PostgreSQL instance: %s", error)
             return None
         finally:
             logger.debug("Closing session.")
             session.close()
 
-    def insert_message(self, message, user_id):
-        """Insert all provided message info to database.
+    def insert_message(self, message, user_id, attachment_id=None, mentioned=()):
+        r"""Insert all provided message info to database. Message sequence
+        and mention counters of mentioned users advance in the same transaction.
 
         ## Parameters:
             **message_content** (_str_): 
             Message to be inserted. <br>
 
             **user_id** (_str_): 
-            Author's unique identifier.
+            Author's unique identifier. <br>
+
+            **attachment_id** (_str_, optional):
+            Identifier of attached image. Defaults to _None_. <br>
+
+            **mentioned** (_List\[UUID\]_, optional):
+            Identifiers of users mentioned in message. Defaults to none.
 
         ### Returns:
-            _bool_:
-            _True_ if insert operation is completed successfully, otherwise _False_.
+            _dict_:
+            inserted message as JSON if operation is completed successfully,
+            otherwise _False_.
         """
         session = self.session()
         logger.debug("Starting a session.")
 
         try:
             new_message = Message(
-                message_id=random_strings_generator(),
+                message_id=time_ordered_id(),
                 message_content=message,
                 message_timestamp=str(datetime.now().timestamp()),
-                user_id=user_id
+                message_edited=False,
+                user_id=user_id,
+                attachment_id=attachment_id,
             )
 
+            inserted = new_message.to_json()
+
             session.add(new_message)
+            session.execute(ADVANCE_MESSAGE_SEQUENCE)
+            if mentioned:
+                session.execute(ADD_MENTIONS, {"user_ids": list(mentioned)})
             session.commit()
-            return True
-        except SQLAlchemyError:
-            logger.error("An error occured while establishing conection with PostgreSQL instance.")
+            return inserted
+        except SQLAlchemyError as error:
+            logger.error("An error occured while establishing conection with PostgreSQL instance: %s", error)
+            return False
+        finally:
+            logger.debug("Closing session.")
+            session.close()
+
+    def purge_messages(self, cutoff, limit):
+        """Delete one batch of messages older than cutoff. Each call is a short
+        transaction, so retention can run on a live table without long locks.
+
+        ## Parameters:
+            **cutoff** (_float_):
+            POSIX timestamp. Messages sent before it are deleted. <br>
+
+            **limit** (_int_):
+            Maximum number of messages deleted in this batch.
+
+        ### Returns:
+            _int_:
+            count of deleted messages. _None_ if exception is caught.
+        """
+        session = self.session()
+        logger.debug("Starting a session.")
+
+        try:
+            # Timestamps are stored as strings with 10 integer digits (until
+            # year 2286), so string comparison matches numeric order
+            result = session.execute(
+                PURGE_MESSAGES, {"cutoff": str(cutoff), "limit": limit}
+            )
+            session.commit()
+            return result.rowcount
+        except SQLAlchemyError as error:
+            logger.error("An error occured while establishing conection with PostgreSQL instance: %s", error)
+            return None
+        finally:
+            logger.debug("Closing session.")
+            session.close()
+
+    def moderate_messages(self, criteria, cursor, limit, hide=False):
+        r"""Delete or hide one batch of messages matching criteria, newest
+        first. A batch changing messages advances moderation revision in the
+        same transaction.
+
+        ## Parameters:
+            **criteria** (_dict_):
+            Values bound to present criteria, see `moderation.batch_criteria`. <br>
+
+            **cursor** (_UUID_):
+            Only messages older than this identifier are changed. <br>
+
+            **limit** (_int_):
+            Maximum number of messages changed in this batch. <br>
+
+            **hide** (_bool_, optional):
+            Set _True_ to hide messages instead of deleting them. Defaults to _False_.
+
+        ### Returns:
+            _List\[UUID\]_:
+            identifiers of changed messages. _None_ if exception is caught.
+        """
+        statement = moderation_batch(hide, **dict.fromkeys(criteria, True))
+
+        session = self.session()
+        logger.debug("Starting a session.")
+
+        try:
+            changed = session.scalars(
+                statement, {**criteria, "cursor": cursor, "limit": limit}
+            ).all()
+            if changed:
+                session.execute(ADVANCE_MODERATION_REVISION)
+            session.commit()
+            return changed
+        except SQLAlchemyError as error:
+            logger.error("An error occured while establishing conection with PostgreSQL instance: %s", error)
+            return None
+        finally:
+            logger.debug("Closing session.")
+            session.close()
+
+    def moderation_revision(self):
+        """Get moderation revision, advanced whenever moderators change messages.
+
+        ### Returns:
+            _int_:
+            revision. _None_ if exception is caught.
+        """
+        session = self.session()
+        logger.debug("Starting a session.")
+
+        try:
+            return session.scalar(MODERATION_REVISION) or 0
+        except SQLAlchemyError as error:
+            logger.error("An error occured while establishing conection with PostgreSQL instance: %s", error)
+            return None
+        finally:
+            logger.debug("Closing session.")
+            session.close()
+
+    def edit_message(self, message_id, user_id, message):
+        """Replace content of a message sent by user and mark it edited.
+        History revision advances in the same transaction.
+
+        ## Parameters:
+            **message_id** (_UUID_):
+            Identifier of the message. <br>
+
+            **user_id** (_str_):
+            Identifier of the user editing it; only its author may. <br>
+
+            **message** (_str_):
+            New content.
+
+        ### Returns:
+            _bool_:
+            _True_ if message was edited, _False_ if user has no such message.
+            _None_ if exception is caught.
+        """
+        session = self.session()
+        logger.debug("Starting a session.")
+
+        try:
+            result = session.execute(
+                EDIT_MESSAGE, {"target": message_id, "author": user_id, "content": message}
+            )
+            if result.rowcount:
+                session.execute(ADVANCE_MODERATION_REVISION)
+            session.commit()
+            return bool(result.rowcount)
+        except SQLAlchemyError as error:
+            logger.error("An error occured while establishing conection with PostgreSQL instance: %s", error)
+            return None
+        finally:
+            logger.debug("Closing session.")
+            session.close()
+
+    def delete_message(self, message_id, user_id=None):
+        """Delete one message. History revision advances in the same
+        transaction.
+
+        ## Parameters:
+            **message_id** (_UUID_):
+            Identifier of the message. <br>
+
+            **user_id** (_str_, optional):
+            Identifier of the user deleting it; only its author may. _None_
+            deletes message of any author, for moderators. Defaults to _None_.
+
+        ### Returns:
+            _bool_:
+            _True_ if message was deleted, _False_ if there is no such message
+            of the user. _None_ if exception is caught.
+        """
+        session = self.session()
+        logger.debug("Starting a session.")
+
+        try:
+            if user_id is None:
+                result = session.execute(DELETE_MESSAGE, {"target": message_id})
+            else:
+                result = session.execute(
+                    DELETE_OWN_MESSAGE, {"target": message_id, "author": user_id}
+                )
+            if result.rowcount:
+                session.execute(ADVANCE_MODERATION_REVISION)
+            session.commit()
+            return bool(result.rowcount)
+        except SQLAlchemyError as error:
+            logger.error("An error occured while establishing conection with PostgreSQL instance: %s", error)
+            return None
+        finally:
+            logger.debug("Closing session.")
+            session.close()
+
+    def insert_attachment(self, file_name, content_type, file_size, user_id):
+        """Insert info about stored image attachment. Thumbnail is added
+        later, once generated.
+
+        ## Parameters:
+            **file_name** (_str_):
+            Name of image in attachments storage. <br>
+
+            **content_type** (_str_):
+            MIME type of image. <br>
+
+            **file_size** (_int_):
+            Size of image in bytes. <br>
+
+            **user_id** (_str_):
+            Uploader's unique identifier.
+
+        ### Returns:
+            _UUID_:
+            identifier of inserted attachment. _None_ if exception is caught.
+        """
+        session = self.session()
+        logger.debug("Starting a session.")
+
+        try:
+            attachment_id = time_ordered_id()
+            session.add(
+                Attachment(
+                    attachment_id=attachment_id,
+                    file_name=file_name,
+                    content_type=content_type,
+                    file_size=file_size,
+                    user_id=user_id,
+                )
+            )
+            session.commit()
+            return attachment_id
+        except SQLAlchemyError as error:
+            logger.error("An error occured while establishing conection with PostgreSQL instance: %s", error)
+            return None
+        finally:
+            logger.debug("Closing session.")
+            session.close()
+
+    def get_attachment(self, attachment_id):
+        """Return Attachment object by its identifier.
+
+        ## Parameters:
+            **attachment_id** (_str_):
+            Attachment unique identifier.
+
+        ### Returns:
+            _Attachment_:
+            Attachment object. _None_ if not found or exception caught.
+        """
+        session = self.session()
+        logger.debug("Starting a session.")
+
+        try:
+            return session.scalars(ATTACHMENT_BY_ID, {"attachment_id": attachment_id}).first()
+        except SQLAlchemyError as error:
+            logger.error("An error occured while establishing conection with PostgreSQL instance: %s", error)
+            return None
+        finally:
+            logger.debug("Closing session.")
+            session.close()
+
+    def set_attachment_thumbnail(self, attachment_id, thumbnail_name):
+        """Record generated thumbnail of an attachment.
+
+        ## Parameters:
+            **attachment_id** (_UUID_):
+            Attachment unique identifier. <br>
+
+            **thumbnail_name** (_str_):
+            Name of thumbnail in attachments storage.
+
+        ### Returns:
+            _bool_:
+            _True_ if attachment was updated, otherwise _False_.
+        """
+        session = self.session()
+        logger.debug("Starting a session.")
+
+        try:
+            result = (
+                session.query(Attachment)
+                .filter_by(attachment_id=attachment_id)
+                .update({"thumbnail_name": thumbnail_name})
+            )
+            session.commit()
+            return result > 0
+        except SQLAlchemyError as error:
+            logger.error("An error occured while establishing conection with PostgreSQL instance: %s", error)
             return False
         finally:
             logger.debug("Closing session.")
@@ -253,32 +679,19 @@ class MessageService:
         logger.debug("Starting a session.")
 
         try:
-            query = session.query(
-                Message.message_id,
-                Message.message_content,
-                Message.message_timestamp,
-                Message.message_edited,
-                User.user_id,
-                User.username
-            ).join(User, Message.user_id==User.user_id)
-
-            if initial_load:
-                rows_returning_query = query.offset(
-                    0
-                    if session.query(Message).count() < MSG_LOAD_BATCH
-                    else session.query(Message).count() - MSG_LOAD_BATCH
-                ).limit(MSG_LOAD_BATCH)
-            else:
-                rows_returning_query = query.offset(
-                    0
-                    if session.query(Message).count() < MSG_LOAD_BATCH + counter
-                    else session.query(Message).count() - MSG_LOAD_BATCH - counter
-                ).limit(MSG_LOAD_BATCH)
-
-            result = rows_returning_query.all()
+            total_count = session.scalar(MESSAGES_COUNT)
+            already_loaded = 0 if initial_load else counter
+
+            result = session.execute(
+                MESSAGES_PAGE,
+                {
+                    "offset": max(total_count - MSG_LOAD_BATCH - already_loaded, 0),
+                    "limit": MSG_LOAD_BATCH,
+                },
+            ).all()
             logger.debug("%s rows retrieved: %s", len(result), result)
-        except SQLAlchemyError:
-            logger.error("An error occured while establishing conection with PostgreSQL instance.")
+        except SQLAlchemyError as error:
+            logger.error("An error occured while establishing conection with PostgreSQL instance: %s", error)
             return None
         finally:
             logger.debug("Closing session.")
@@ -289,3 +702,72 @@ class MessageService:
                 result[index] = message._mapping
 
         return result
+
+    def history_page(self, before=None, limit=MSG_LOAD_BATCH):
+        r"""Retrieve page of messages, newest first.
+
+        ## Parameters:
+            **before** (_UUID_, optional):
+            Identifier of a message; only older messages are returned. Newest
+            messages are returned if not specified. Defaults to _None_. <br>
+
+            **limit** (_int_, optional):
+            Maximum number of messages. Defaults to `MSG_LOAD_BATCH`.
+
+        ### Returns:
+            _List\[dict\]_:
+            messages with author username. _None_ if exception is caught.
+        """
+        session = self.session()
+        logger.debug("Starting a session.")
+
+        try:
+            if before is None:
+                result = session.execute(HISTORY_LATEST, {"limit": limit})
+            else:
+                result = session.execute(HISTORY_BEFORE, {"before": before, "limit": limit})
+            return [dict(row._mapping) for row in result]
+        except SQLAlchemyError as error:
+            logger.error("An error occured while establishing conection with PostgreSQL instance: %s", error)
+            return None
+        finally:
+            logger.debug("Closing session.")
+            session.close()
+
+    def user_history_page(self, user_id, before=None, limit=MSG_LOAD_BATCH):
+        r"""Retrieve page of messages sent by one user, newest first.
+
+        ## Parameters:
+            **user_id** (_UUID_):
+            Author's unique identifier. <br>
+
+            **before** (_UUID_, optional):
+            Identifier of a message; only older messages are returned. Newest
+            messages are returned if not specified. Defaults to _None_. <br>
+
+            **limit** (_int_, optional):
+            Maximum number of messages. Defaults to `MSG_LOAD_BATCH`.
+
+        ### Returns:
+            _List\[dict\]_:
+            messages with author username. _None_ if exception is caught.
+        """
+        session = self.session()
+        logger.debug("Starting a session.")
+
+        try:
+            if before is None:
+                result = session.execute(
+                    USER_HISTORY_LATEST, {"author": user_id, "limit": limit}
+                )
+            else:
+                result = session.execute(
+                    USER_HISTORY_BEFORE, {"author": user_id, "before": before, "limit": limit}
+                )
+            return [dict(row._mapping) for row in result]
+        except SQLAlchemyError as error:
+            logger.error("An error occured while establishing conection with PostgreSQL instance: %s", error)
+            return None
+        finally:
+            logger.debug("Closing session.")
+            session.close()
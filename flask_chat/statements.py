@@ -0,0 +1,312 @@
+"""Prebuilt statements for the hot queries of the service layer"""
+
+import logging
+from collections import defaultdict
+from functools import lru_cache
+
+from sqlalchemy import bindparam, delete, event, func, select, update
+from sqlalchemy.engine.default import CACHE_HIT
+
+from models import Attachment, ChatCounter, UnreadCounter, User, Message
+from utils.constants import MESSAGES_COUNTER, MODERATION_COUNTER
+
+logger = logging.getLogger("gunicorn.access")
+
+# Statements are built once at import and executed with bound parameters,
+# so each call skips query construction and reuses the memoized cache key.
+# Every statement carries a name used to collect per-statement stats.
+
+USER_BY_ID = select(User).where(
+    User.user_id == bindparam("user_id")
+).execution_options(statement_name="user_by_id")
+
+USER_BY_USERNAME = select(User).where(
+    User.username == bindparam("username")
+).execution_options(statement_name="user_by_username")
+
+USER_BY_EMAIL = select(User).where(
+    User.email == bindparam("email")
+).execution_options(statement_name="user_by_email")
+
+USERS_BY_USERNAMES = select(User.user_id, User.username).where(
+    User.username.in_(bindparam("usernames", expanding=True))
+).execution_options(statement_name="users_by_usernames")
+
+ALL_USERS = select(User).execution_options(statement_name="all_users")
+
+# Messages hidden by moderators stay in the table but are never read back
+_VISIBLE = Message.message_hidden.is_(False)
+
+MESSAGES_COUNT = select(func.count(Message.message_id)).where(_VISIBLE).execution_options(
+    statement_name="messages_count"
+)
+
+MESSAGES_PAGE = (
+    select(
+        Message.message_id,
+        Message.message_content,
+        Message.message_timestamp,
+        Message.message_edited,
+        Message.attachment_id,
+        User.user_id,
+        User.username,
+    )
+    .join(User, Message.user_id == User.user_id)
+    .where(_VISIBLE)
+    .offset(bindparam("offset"))
+    .limit(bindparam("limit"))
+    .execution_options(statement_name="messages_page")
+)
+
+# History pages for the HTTP endpoint: newest first, keyset paginated on
+# the time-ordered message id, so a page before a given message never
+# changes and is read straight from the primary key index
+_HISTORY_COLUMNS = select(
+    Message.message_id,
+    Message.message_content,
+    Message.message_timestamp,
+    Message.message_edited,
+    Message.attachment_id,
+    User.username,
+).join(User, Message.user_id == User.user_id).where(_VISIBLE)
+
+HISTORY_LATEST = (
+    _HISTORY_COLUMNS
+    .order_by(Message.message_id.desc())
+    .limit(bindparam("limit"))
+    .execution_options(statement_name="history_latest")
+)
+
+HISTORY_BEFORE = (
+    _HISTORY_COLUMNS
+    .where(Message.message_id < bindparam("before"))
+    .order_by(Message.message_id.desc())
+    .limit(bindparam("limit"))
+    .execution_options(statement_name="history_before")
+)
+
+# History of one author: walks the (user_id, message_id) index backwards,
+# so a page costs the same however many messages the author has sent
+USER_HISTORY_LATEST = (
+    _HISTORY_COLUMNS
+    .where(Message.user_id == bindparam("author"))
+    .order_by(Message.message_id.desc())
+    .limit(bindparam("limit"))
+    .execution_options(statement_name="user_history_latest")
+)
+
+USER_HISTORY_BEFORE = (
+    _HISTORY_COLUMNS
+    .where(Message.user_id == bindparam("author"))
+    .where(Message.message_id < bindparam("before"))
+    .order_by(Message.message_id.desc())
+    .limit(bindparam("limit"))
+    .execution_options(statement_name="user_history_before")
+)
+
+# Batch of messages older than cutoff, deleted by primary key so every
+# statement touches a bounded number of rows and holds locks briefly
+PURGE_MESSAGES = (
+    delete(Message)
+    .where(
+        Message.message_id.in_(
+            select(Message.message_id)
+            .where(Message.message_timestamp < bindparam("cutoff"))
+            .limit(bindparam("limit"))
+        )
+    )
+    .execution_options(synchronize_session=False, statement_name="purge_messages")
+)
+
+# Moderation revision: advanced with every changed batch, edit or deletion
+# and added to history page URLs, so pages cached before a change of their
+# messages are no longer requested
+MODERATION_REVISION = select(ChatCounter.counter_value).where(
+    ChatCounter.counter_name == MODERATION_COUNTER
+).execution_options(statement_name="moderation_revision")
+
+ADVANCE_MODERATION_REVISION = (
+    update(ChatCounter)
+    .where(ChatCounter.counter_name == MODERATION_COUNTER)
+    .values(counter_value=ChatCounter.counter_value + 1)
+    .execution_options(synchronize_session=False, statement_name="advance_moderation_revision")
+)
+
+
+# Edits and deletions of one message: the author is part of the condition,
+# so ownership is checked by the same statement that changes the row. Only
+# moderators delete without it.
+EDIT_MESSAGE = (
+    update(Message)
+    .where(
+        Message.message_id == bindparam("target"),
+        Message.user_id == bindparam("author"),
+        _VISIBLE,
+    )
+    .values(message_content=bindparam("content"), message_edited=True)
+    .execution_options(synchronize_session=False, statement_name="edit_message")
+)
+
+DELETE_OWN_MESSAGE = (
+    delete(Message)
+    .where(
+        Message.message_id == bindparam("target"),
+        Message.user_id == bindparam("author"),
+        _VISIBLE,
+    )
+    .execution_options(synchronize_session=False, statement_name="delete_own_message")
+)
+
+DELETE_MESSAGE = (
+    delete(Message)
+    .where(Message.message_id == bindparam("target"), _VISIBLE)
+    .execution_options(synchronize_session=False, statement_name="delete_message")
+)
+
+
+@lru_cache(maxsize=None)
+def moderation_batch(hide, author=False, since=False, until=False, pattern=False):
+    """Build statement deleting or hiding one batch of messages matching
+    given criteria, newest first below the `cursor` message. Each criterion
+    adds a condition bound by parameter of the same name; statements are
+    built once per combination.
+
+    ## Parameters:
+        **hide** (_bool_):
+        _True_ to hide messages, _False_ to delete them. <br>
+
+        **author**, **since**, **until**, **pattern** (_bool_, optional):
+        Criteria present in the request. Default to _False_.
+
+    ### Returns:
+        _Delete_ | _Update_:
+        statement returning identifiers of changed messages.
+    """
+    batch = select(Message.message_id).where(Message.message_id < bindparam("cursor"))
+    if author:
+        batch = batch.where(Message.user_id == bindparam("author"))
+    if since:
+        batch = batch.where(Message.message_timestamp >= bindparam("since"))
+    if until:
+        batch = batch.where(Message.message_timestamp < bindparam("until"))
+    if pattern:
+        batch = batch.where(Message.message_content.ilike(bindparam("pattern"), escape="\\"))
+    if hide:
+        batch = batch.where(_VISIBLE)
+    batch = batch.order_by(Message.message_id.desc()).limit(bindparam("limit"))
+
+    if hide:
+        statement = update(Message).values(message_hidden=True)
+    else:
+        statement = delete(Message)
+
+    return (
+        statement.where(Message.message_id.in_(batch))
+        .returning(Message.message_id)
+        .execution_options(
+            synchronize_session=False,
+            statement_name="hide_messages" if hide else "delete_messages",
+        )
+    )
+
+
+ATTACHMENT_BY_ID = select(Attachment).where(
+    Attachment.attachment_id == bindparam("attachment_id")
+).execution_options(statement_name="attachment_by_id")
+
+# Unread state: every message advances one sequence, users keep the value
+# they have read up to, so unread counts are a subtraction of two rows
+MESSAGE_SEQUENCE = select(ChatCounter.counter_value).where(
+    ChatCounter.counter_name == MESSAGES_COUNTER
+).execution_options(statement_name="message_sequence")
+
+_MESSAGE_SEQUENCE = MESSAGE_SEQUENCE.scalar_subquery()
+
+ADVANCE_MESSAGE_SEQUENCE = (
+    update(ChatCounter)
+    .where(ChatCounter.counter_name == MESSAGES_COUNTER)
+    .values(counter_value=ChatCounter.counter_value + 1)
+    .execution_options(synchronize_session=False, statement_name="advance_message_sequence")
+)
+
+ADD_MENTIONS = (
+    update(UnreadCounter)
+    .where(UnreadCounter.user_id.in_(bindparam("user_ids", expanding=True)))
+    .values(mentions=UnreadCounter.mentions + 1)
+    .execution_options(synchronize_session=False, statement_name="add_mentions")
+)
+
+UNREAD_COUNTERS = select(
+    func.coalesce(_MESSAGE_SEQUENCE - UnreadCounter.read_mark, 0).label("unread"),
+    UnreadCounter.mentions,
+).where(
+    UnreadCounter.user_id == bindparam("user_id")
+).execution_options(statement_name="unread_counters")
+
+MARK_READ = (
+    update(UnreadCounter)
+    .where(UnreadCounter.user_id == bindparam("reader_id"))
+    .values(read_mark=func.coalesce(_MESSAGE_SEQUENCE, 0), mentions=0)
+    .execution_options(synchronize_session=False, statement_name="mark_read")
+)
+
+PROFILE_PICTURES = (
+    select(User.profile_picture)
+    .where(User.profile_picture.is_not(None))
+    .execution_options(statement_name="profile_pictures")
+)
+
+# Lookups available to `UserService.get_user_info` by filter column
+USER_LOOKUPS = {
+    "user_id": USER_BY_ID,
+    "username": USER_BY_USERNAME,
+    "email": USER_BY_EMAIL,
+}
+
+# Per-statement counters: executions and compiled cache hits
+_stats = defaultdict(lambda: {"executions": 0, "cache_hits": 0})
+
+
+def _record_execution(conn, cursor, statement, parameters, context, executemany):
+    """Engine hook counting executions of named statements"""
+    name = context.execution_options.get("statement_name")
+    if name is None:
+        return
+
+    stats = _stats[name]
+    stats["executions"] += 1
+    if context.cache_hit is CACHE_HIT:
+        stats["cache_hits"] += 1
+
+
+def register_statement_stats(engine):
+    """Start collecting per-statement stats for statements executed on engine.
+
+    ## Parameters:
+        **engine** (_Engine_):
+        SQLAlchemy engine to attach the hook to.
+    """
+    if not event.contains(engine, "after_cursor_execute", _record_execution):
+        event.listen(engine, "after_cursor_execute", _record_execution)
+
+
+def statement_cache_stats():
+    r"""Return collected stats of prebuilt statements.
+
+    ### Returns:
+        _dict\[str, dict\]_:
+        executions, compiled cache hits and hit ratio keyed by statement name.
+    """
+    return {
+        name: {
+            **stats,
+            "hit_ratio": stats["cache_hits"] / stats["executions"],
+        }
+        for name, stats in _stats.items()
+        if stats["executions"]
+    }
+
+
+def reset_statement_cache_stats():
+    """Drop all collected per-statement stats"""
+    _stats.clear()
@@ -1,7 +1,93 @@
-// initialising socket connection
-const socket = io.connect("https://" + document.location.hostname + ":" + document.location.port + "/");
+// initialising socket connection: binary MessagePack payloads are requested
+// when the decoder is available, otherwise the server falls back to JSON.
+// WebSocket only: polling requests could reach another server worker
+const socket = io.connect(
+  "https://" + document.location.hostname + ":" + document.location.port + "/",
+  {
+    auth: { encoding: window.MessagePack ? "msgpack" : "json" },
+    transports: ["websocket"],
+  }
+);
 var messagesLoaded;
 
+// converts event payload to list of {id, username, message, timestamp,
+// attachment, edited} objects, timestamps in milliseconds. Binary payloads
+// hold [username, message, timestamp, attachment?, id?, edited?] tuples (or
+// a list of them), JSON payloads hold objects with string timestamps
+function decodeMessages(payload) {
+  if (payload instanceof ArrayBuffer || ArrayBuffer.isView(payload)) {
+    let decoded = MessagePack.decode(payload);
+    if (decoded.length > 0 && !Array.isArray(decoded[0])) {
+      decoded = [decoded];
+    }
+    return decoded.map(function (msg) {
+      return {
+        id: msg[4],
+        username: msg[0],
+        message: msg[1],
+        timestamp: msg[2],
+        attachment: msg[3] || undefined,
+        edited: Boolean(msg[5]),
+      };
+    });
+  }
+
+  return [].concat(payload).map(function (msg) {
+    return {
+      id: msg.message_id,
+      username: msg.username,
+      message: msg.message,
+      timestamp: parseFloat(msg.timestamp) * 1000,
+      attachment: msg.attachment,
+      edited: Boolean(msg.edited),
+    };
+  });
+}
+
+// builds DOM element for single message; author and timestamp (in seconds,
+// as rendered by the server) let tombstones find it later, its id lets
+// edits and deletions find it
+function renderMessage(msg) {
+  if (msg.id in edits) {
+    msg.message = edits[msg.id];
+    msg.edited = true;
+  }
+  const element = $("<div>")
+    .attr({
+      "data-id": msg.id,
+      "data-username": msg.username,
+      "data-timestamp": msg.timestamp / 1000,
+    })
+    .append(
+      $(`<a href=/profile/${msg.username}>`).text(msg.username),
+      $("<p class='content'>").text(msg.message)
+    );
+  if (msg.edited) {
+    element.append(editedMark());
+  }
+  if (msg.attachment) {
+    element.append(renderAttachment(msg.attachment));
+  }
+  element.append($("<p>").text(getTime(msg.timestamp)));
+  return addMessageControls(element);
+}
+
+// builds thumbnail linking to the full image; thumbnails of fresh uploads
+// are generated in background, so a missing one is requested again shortly
+function renderAttachment(attachmentId) {
+  const url = "/attachments/" + encodeURIComponent(attachmentId);
+  const image = $("<img>").attr({ src: url + "/thumbnail", alt: "attachment" });
+  let retries = 5;
+  image.on("error", function () {
+    if (retries-- > 0) {
+      setTimeout(function () {
+        image.attr("src", url + "/thumbnail?retry=" + retries);
+      }, 1000);
+    }
+  });
+  return $("<a>").attr({ href: url, target: "_blank" }).append(image);
+}
+
 // number of overall loaded messages on the page - works as counter
 function initCounter(counter) {
   messagesLoaded = counter;
@@ -15,6 +101,10 @@ document.addEventListener("DOMContentLoaded", function () {
     const formattedTimestamp = getTime(parseFloat(rawTimestamp) * 1000);
     timestampElement.textContent = formattedTimestamp;
   });
+
+  $("#messages > div").each(function () {
+    addMessageControls($(this));
+  });
 });
 
 // triggered when no more messages to load - then "load more" button disappears
@@ -23,31 +113,279 @@ socket.on("loading_finished", function () {
   loadButton.style.display = "none";
 });
 
-// receives group of messages with "load more" button
-socket.on("load", function (msg) {
-  var nestedDiv = $("<div>").append(
-    $(`<a href=/profile/${msg.username}>`).text(msg.username),
-    $("<p>").text(msg.message),
-    $("<p>").text(getTime(parseFloat(msg.timestamp) * 1000))
+// receives group of messages with "load more" button, newest first
+socket.on("load", function (payload) {
+  decodeMessages(payload).filter(isShown).forEach(function (msg) {
+    // inserts loaded messages before the existing list
+    $("#messages").prepend(renderMessage(msg));
+    messagesLoaded = (parseInt(messagesLoaded, 10) + 1).toString();
+  });
+});
+
+// displays messages received from socket, one per event or batched
+// per broadcast tick when the server coalesces bursts
+function appendMessages(payload) {
+  const messages = decodeMessages(payload);
+  messages.forEach(function (msg) {
+    // adds received messages to list
+    $("#messages").append(renderMessage(msg));
+    messagesLoaded = (parseInt(messagesLoaded, 10) + 1).toString();
+  });
+
+  // messages arriving in a background tab are unread until it is shown
+  if (document.hidden) {
+    unread.unread += messages.length;
+    renderUnread();
+  }
+  readPending = true;
+  scheduleMarkRead();
+}
+
+socket.on("message", appendMessages);
+socket.on("messages", appendMessages);
+
+// unread messages and mentions since the chat was last looked at: the server
+// sends counters on page load and pushes mention updates to this user only,
+// other messages are counted here
+var unread = { unread: 0, mentions: 0 };
+var readPending = false;
+var markReadTimer = null;
+var baseTitle;
+const MARK_READ_DELAY = 3000;
+
+function initUnread() {
+  const badge = document.getElementById("unread");
+  baseTitle = document.title;
+  unread = {
+    unread: parseInt(badge.dataset.unread, 10) || 0,
+    mentions: parseInt(badge.dataset.mentions, 10) || 0,
+  };
+  renderUnread();
+  scheduleMarkRead();
+}
+
+function renderUnread() {
+  const parts = [];
+  if (unread.unread > 0) {
+    parts.push(`${unread.unread} unread`);
+  }
+  if (unread.mentions > 0) {
+    parts.push(`${unread.mentions} mentioning you`);
+  }
+  document.getElementById("unread").textContent = parts.join(", ");
+  document.title = (unread.unread > 0 ? `(${unread.unread}) ` : "") + baseTitle;
+}
+
+// chat counts as read once it has been visible for a moment; at most one
+// request per delay while messages keep arriving
+function scheduleMarkRead() {
+  if (document.hidden || markReadTimer) {
+    return;
+  }
+  if (!readPending && unread.unread === 0 && unread.mentions === 0) {
+    return;
+  }
+  markReadTimer = setTimeout(function () {
+    markReadTimer = null;
+    if (!document.hidden) {
+      readPending = false;
+      socket.emit("mark_read");
+    }
+  }, MARK_READ_DELAY);
+}
+
+document.addEventListener("visibilitychange", scheduleMarkRead);
+
+socket.on("unread", function (counters) {
+  unread = counters;
+  renderUnread();
+  scheduleMarkRead();
+});
+
+// moderators deleted or hid messages: the tombstone holds their criteria
+// (author, time range, text) rather than identifiers, so it is matched
+// against shown messages and remembered for history loaded afterwards
+var tombstones = [];
+
+function matchesTombstone(tombstone, msg) {
+  return (
+    (tombstone.username === undefined || msg.username === tombstone.username) &&
+    (tombstone.since === undefined || msg.timestamp >= tombstone.since * 1000) &&
+    msg.timestamp < tombstone.until * 1000 &&
+    (tombstone.match === undefined ||
+      msg.message.toLowerCase().includes(tombstone.match.toLowerCase()))
   );
+}
 
-  // inserts loaded messages before the existing list
-  $("#messages").prepend(nestedDiv);
-  messagesLoaded = (parseInt(messagesLoaded, 10) + 1).toString();
+function isShown(msg) {
+  return (
+    !deletions.has(msg.id) &&
+    !tombstones.some(function (tombstone) {
+      return matchesTombstone(tombstone, msg);
+    })
+  );
+}
+
+socket.on("messages_removed", function (tombstone) {
+  tombstones.push(tombstone);
+  $("#messages > div").each(function () {
+    const msg = {
+      username: this.dataset.username,
+      message: $(this).find(".content").text(),
+      timestamp: parseFloat(this.dataset.timestamp) * 1000,
+    };
+    if (matchesTombstone(tombstone, msg)) {
+      $(this).remove();
+      messagesLoaded = (parseInt(messagesLoaded, 10) - 1).toString();
+    }
+  });
 });
 
-// displays messages received from socket
-socket.on("message", function (msg) {
-  var timestamp = Date.now();
-  var nestedDiv = $("<div>").append(
-    $(`<a href=/profile/${msg.username}>`).text(msg.username),
-    $("<p>").text(msg.message),
-    $("<p>").text(getTime(timestamp))
+// current user may edit and delete its own messages, moderators may delete
+// any; the server checks both again
+var currentUser = { username: null, privileged: false };
+
+function initUser(username, privileged) {
+  currentUser = { username: username, privileged: privileged };
+}
+
+function addMessageControls(element) {
+  const id = element.attr("data-id");
+  const own = element.attr("data-username") === currentUser.username;
+  if (!id || !(own || currentUser.privileged)) {
+    return element;
+  }
+
+  const controls = $("<p class='controls'>");
+  if (own) {
+    controls.append(
+      $("<button>")
+        .text("Edit")
+        .on("click", function () {
+          editMessage(id, element.find(".content").text());
+        })
+    );
+  }
+  controls.append(
+    $("<button>")
+      .text("Delete")
+      .on("click", function () {
+        deleteMessage(id);
+      })
   );
+  return element.append(controls);
+}
+
+function editedMark() {
+  return $("<p class='edited'>").text("(edited)");
+}
 
-  // adds received messages to list
-  $("#messages").append(nestedDiv);
-  messagesLoaded = (parseInt(messagesLoaded, 10) + 1).toString();
+function editMessage(id, current) {
+  const message = window.prompt("Edit message", current);
+  if (message === null || message.trim() === "" || message === current) {
+    return;
+  }
+  socket.emit("edit_message", { message_id: id, message: message });
+}
+
+function deleteMessage(id) {
+  if (window.confirm("Delete this message?")) {
+    socket.emit("delete_message", { message_id: id });
+  }
+}
+
+// edits and deletions arrive as deltas holding the message id and are
+// applied in place; they are remembered for messages rendered afterwards,
+// e.g. from history pages cached before the change
+var edits = {};
+var deletions = new Set();
+
+function findMessage(id) {
+  return $("#messages > div").filter(function () {
+    return this.dataset.id === id;
+  });
+}
+
+socket.on("message_edited", function (change) {
+  edits[change.message_id] = change.message;
+  const element = findMessage(change.message_id);
+  element.find(".content").text(change.message);
+  if (element.length && !element.find(".edited").length) {
+    element.find(".content").after(editedMark());
+  }
+});
+
+socket.on("message_deleted", function (change) {
+  deletions.add(change.message_id);
+  const element = findMessage(change.message_id);
+  if (element.length) {
+    element.remove();
+    messagesLoaded = (parseInt(messagesLoaded, 10) - 1).toString();
+  }
+});
+
+// triggered when an edit or deletion was refused
+socket.on("message_change_rejected", function (data) {
+  $("#msg-panel").text(data.error);
+});
+
+// who's online: every server worker reports users connected to it, with a
+// snapshot once this client connects and join/leave deltas afterwards; the
+// list shows users reported by any worker. Heartbeats keep this client's
+// user online, at the interval the snapshot asks for
+var presence = {};
+var heartbeatTimer = null;
+
+function renderPresence() {
+  const list = document.getElementById("online");
+  if (!list) {
+    return;
+  }
+  const online = new Set();
+  Object.values(presence).forEach(function (users) {
+    users.forEach(function (username) {
+      online.add(username);
+    });
+  });
+  list.replaceChildren(
+    ...Array.from(online)
+      .sort()
+      .map(function (username) {
+        const link = document.createElement("a");
+        link.href = "/profile/" + encodeURIComponent(username);
+        link.textContent = username;
+        const item = document.createElement("li");
+        item.appendChild(link);
+        return item;
+      })
+  );
+}
+
+// reports of workers from before a reconnect may be stale
+socket.on("connect", function () {
+  presence = {};
+  socket.emit("request_presence");
+});
+
+socket.on("presence_snapshot", function (snapshot) {
+  presence[snapshot.worker] = new Set(snapshot.online);
+  renderPresence();
+
+  clearInterval(heartbeatTimer);
+  heartbeatTimer = setInterval(function () {
+    socket.emit("heartbeat");
+  }, snapshot.heartbeat * 1000);
+});
+
+socket.on("presence", function (delta) {
+  const users = presence[delta.worker] || (presence[delta.worker] = new Set());
+  delta.joined.forEach(function (username) {
+    users.add(username);
+  });
+  delta.left.forEach(function (username) {
+    users.delete(username);
+  });
+  renderPresence();
 });
 
 // triggered when message length is more than expected
@@ -71,14 +409,123 @@ function getTime(time) {
   return formattedTime;
 }
 
-// send request to database to load messages with socket
+// next page of history over HTTP: pages before a message are immutable,
+// so browser and nginx caches answer repeated scroll-backs
+var historyPage;
+
+function initHistory(cursor, revision) {
+  historyPage = cursor
+    ? "/messages?before=" + encodeURIComponent(cursor) + "&rev=" + encodeURIComponent(revision)
+    : null;
+}
+
+function finishLoading() {
+  const loadButton = document.getElementById("l");
+  loadButton.style.display = "none";
+}
+
+// loads older messages and prepends them, newest first
 function reqMessages() {
-  socket.emit("request_message", messagesLoaded);
+  if (!historyPage) {
+    finishLoading();
+    return;
+  }
+
+  fetch(historyPage, { credentials: "same-origin" }).then(function (response) {
+    if (response.status === 503) {
+      // server is shedding load: repeats the request after a pause
+      const retryAfter = parseInt(response.headers.get("Retry-After"), 10) || 5;
+      setTimeout(reqMessages, retryAfter * 1000);
+      return;
+    }
+    if (!response.ok) {
+      return;
+    }
+    return response.json().then(function (page) {
+      decodeMessages(page.messages).filter(isShown).forEach(function (msg) {
+        $("#messages").prepend(renderMessage(msg));
+        messagesLoaded = (parseInt(messagesLoaded, 10) + 1).toString();
+      });
+      historyPage = page.next;
+      if (!historyPage) {
+        finishLoading();
+      }
+    });
+  });
+}
+
+// csrf token paired with the session cookie, sent with state-changing requests
+function csrfToken() {
+  const match = document.cookie.match(/(?:^|; )csrf_access_token=([^;]*)/);
+  return match ? decodeURIComponent(match[1]) : "";
 }
 
-// sends messages to server with socket - the server log them into database
+// uploads image in chunks of the size given by server, one request per
+// chunk, and resolves with the identifier of the stored attachment
+function uploadAttachment(file) {
+  const headers = { "X-CSRF-TOKEN": csrfToken() };
+
+  return fetch("/uploads", { method: "POST", credentials: "same-origin", headers: headers })
+    .then(function (response) {
+      if (!response.ok) {
+        throw new Error("Unable to start upload");
+      }
+      return response.json();
+    })
+    .then(function (upload) {
+      function sendChunk(start) {
+        const end = Math.min(start + upload.chunk_size, file.size);
+        return fetch("/uploads/" + upload.upload_id, {
+          method: "PUT",
+          credentials: "same-origin",
+          headers: Object.assign(
+            { "Content-Range": `bytes ${start}-${end - 1}/${file.size}` },
+            headers
+          ),
+          body: file.slice(start, end),
+        }).then(function (response) {
+          return response.json().then(function (data) {
+            // 409: server has a different part of the file, resumes from there
+            if (response.status === 202 || response.status === 409) {
+              return sendChunk(data.received);
+            }
+            if (response.status === 201) {
+              return data.attachment_id;
+            }
+            throw new Error(data.error || "Upload failed");
+          });
+        });
+      }
+      return sendChunk(0);
+    });
+}
+
+// triggered when attachment does not belong to the sender
+socket.on("attachment_rejected", function () {
+  $("#msg-panel").text("The attachment could not be sent");
+});
+
+// sends messages to server with socket - the server log them into database;
+// a selected image is uploaded first and referenced by the message
 function sendMessage() {
   var message = $("#m").val();
+  const file = $("#f")[0].files[0];
+
+  if (file) {
+    $("#msg-panel").text("Uploading...");
+    uploadAttachment(file)
+      .then(function (attachmentId) {
+        socket.emit("message", { message: message, attachment: attachmentId });
+        $("#m").val("");
+        $("#f").val("");
+        $("#msg-panel").text("");
+      })
+      .catch(function (error) {
+        $("#msg-panel").text(error.message);
+      });
+    return;
+  }
+
   if (message.trim() !== "") {
 
     socket.emit("message", {
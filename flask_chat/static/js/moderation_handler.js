@@ -0,0 +1,48 @@
+// moderation page: requests run over the chat socket, the server answers
+// with the count of changed messages once all batches are done
+const moderationSocket = io.connect(
+  "https://" + document.location.hostname + ":" + document.location.port + "/",
+  { transports: ["websocket"] }
+);
+
+function setStatus(text) {
+  document.getElementById("moderation-status").textContent = text;
+}
+
+// datetime-local fields hold local time; the server expects POSIX seconds
+function toTimestamp(value) {
+  return value ? new Date(value).getTime() / 1000 : undefined;
+}
+
+function moderate(form) {
+  const request = {
+    action: form.action.value,
+    username: form.username.value.trim() || undefined,
+    since: toTimestamp(form.since.value),
+    until: toTimestamp(form.until.value),
+    match: form.match.value || undefined,
+  };
+  const verb = request.action === "delete" ? "Delete" : "Hide";
+  if (!confirm(`${verb} every message matching these criteria?`)) {
+    return false;
+  }
+
+  form.querySelector("button").disabled = true;
+  setStatus("In progress...");
+  moderationSocket.emit("moderate", request);
+  return false;
+}
+
+function finish(text) {
+  document.querySelector("#moderation button").disabled = false;
+  setStatus(text);
+}
+
+moderationSocket.on("moderation_done", function (result) {
+  const verb = result.action === "delete" ? "deleted" : "hidden";
+  finish(`${result.count} messages ${verb}.`);
+});
+
+moderationSocket.on("moderation_rejected", function (result) {
+  finish(result.error);
+});
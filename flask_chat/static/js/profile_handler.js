@@ -0,0 +1,7 @@
+// user's messages span days: timestamps are shown as local date and time
+document.addEventListener("DOMContentLoaded", function () {
+  document.querySelectorAll(".timestamp").forEach(function (timestampElement) {
+    const rawTimestamp = timestampElement.getAttribute("data-timestamp");
+    timestampElement.textContent = new Date(parseFloat(rawTimestamp) * 1000).toLocaleString();
+  });
+});
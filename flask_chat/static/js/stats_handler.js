@@ -0,0 +1,64 @@
+// live stats page: the whole window arrives once on connect, then one
+// complete second per tick; series are kept at the window length
+const statsSocket = io.connect(
+  "https://" + document.location.hostname + ":" + document.location.port + "/stats",
+  { transports: ["websocket"] }
+);
+let stats = null;
+
+// draws series as a line scaled to its peak, newest value on the right
+function drawSeries(canvas, values) {
+  const ctx = canvas.getContext("2d");
+  const peak = Math.max.apply(null, values) || 1;
+  const step = canvas.width / Math.max(values.length - 1, 1);
+
+  ctx.clearRect(0, 0, canvas.width, canvas.height);
+  ctx.beginPath();
+  values.forEach(function (value, i) {
+    const y = canvas.height - (value / peak) * (canvas.height - 2) - 1;
+    if (i === 0) {
+      ctx.moveTo(0, y);
+    } else {
+      ctx.lineTo(i * step, y);
+    }
+  });
+  ctx.stroke();
+}
+
+function render() {
+  document.querySelectorAll(".sparkline").forEach(function (canvas) {
+    const name = canvas.dataset.series;
+    const values = stats.series[name];
+    document.getElementById(name + "-now").textContent = values[values.length - 1];
+    document.getElementById(name + "-peak").textContent = Math.max.apply(null, values);
+    drawSeries(canvas, values);
+  });
+}
+
+statsSocket.on("stats_snapshot", function (snapshot) {
+  stats = snapshot;
+  document.getElementById("stats-status").textContent = "Live";
+  render();
+});
+
+statsSocket.on("stats_tick", function (tick) {
+  if (!stats || tick.second <= stats.second) {
+    return;
+  }
+  // seconds missed while disconnected are filled with zeros
+  const gap = Math.min(tick.second - stats.second, stats.window);
+  Object.keys(stats.series).forEach(function (name) {
+    const values = stats.series[name];
+    for (let i = 1; i < gap; i++) {
+      values.push(0);
+    }
+    values.push(tick.values[name]);
+    values.splice(0, values.length - stats.window);
+  });
+  stats.second = tick.second;
+  render();
+});
+
+statsSocket.on("connect_error", function () {
+  document.getElementById("stats-status").textContent = "Not authorized or disconnected.";
+});
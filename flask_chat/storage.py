@@ -0,0 +1,318 @@
+"""Storage backends for user uploaded files"""
+
+import io
+import os
+import abc
+import shutil
+import logging
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from flask import send_file
+
+from utils.helpers import random_strings_generator
+
+logger = logging.getLogger("gunicorn.access")
+
+
+class StorageError(Exception):
+    """Raised when a file can not be saved to or read from storage"""
+
+
+class FileStorage(abc.ABC):
+    """Base class for storages keeping files under random generated names.
+    Deletion of replaced files runs in background so it never blocks requests.
+    Backends implement every abstract method, or fail to be created.
+    """
+
+    def __init__(self):
+        self._deletion_executor = ThreadPoolExecutor(
+            max_workers=1, thread_name_prefix="storage-delete"
+        )
+        self._pending_lock = threading.Lock()
+        self._pending_deletions = 0
+
+    @abc.abstractmethod
+    def save(self, data, content_type=None):
+        """Store file content under a new random name.
+
+        ## Parameters:
+            **data** (_bytes_ | _BinaryIO_):
+            File content, or binary file copied without loading it into memory. <br>
+
+            **content_type** (_str_, optional):
+            MIME type of content. Defaults to _None_.
+
+        ### Returns:
+            _str_:
+            name of stored file.
+        """
+
+    @abc.abstractmethod
+    def send(self, name, **kwargs):
+        """Build response with file content.
+
+        ### Returns:
+            _Response_:
+            response streaming the file. _None_ if file does not exist.
+        """
+
+    @abc.abstractmethod
+    def delete(self, name):
+        """Remove stored file. Missing files are ignored.
+
+        ## Parameters:
+            **name** (_str_):
+            Name of stored file.
+
+        ### Returns:
+            _bool_:
+            _True_ if file was removed, _False_ if it did not exist.
+        """
+
+    @abc.abstractmethod
+    def iter_files(self):
+        r"""Iterate over all stored files.
+
+        ### Yields:
+            _Tuple\[str, int, float\]_:
+            name, size in bytes and POSIX modification time of each stored file.
+        """
+
+    def delete_async(self, name):
+        """Schedule file removal in background.
+
+        ## Parameters:
+            **name** (_str_):
+            Name of stored file.
+        """
+        with self._pending_lock:
+            self._pending_deletions += 1
+        self._deletion_executor.submit(self._delete_task, name)
+
+    @property
+    def pending_deletions(self):
+        """Count of scheduled removals not completed yet"""
+        return self._pending_deletions
+
+    def _delete_task(self, name):
+        try:
+            self.delete(name)
+            logger.debug("Stored file %s is removed.", name)
+        except Exception:  # pylint: disable=broad-exception-caught
+            logger.exception("Failed to remove stored file %s", name)
+        finally:
+            with self._pending_lock:
+                self._pending_deletions -= 1
+
+
+class LocalStorage(FileStorage):
+    """Files kept on local disk in sharded directories: `<root>/ab/cd/abcd...`,
+    so no single directory grows to hundreds of thousands of entries.
+    """
+
+    def __init__(self, root, shard_depth=2):
+        super().__init__()
+        self.root = root
+        self.shard_depth = shard_depth
+
+    def path(self, name):
+        """Return sharded path of file with provided name"""
+        shards = [name[i * 2 : i * 2 + 2] for i in range(self.shard_depth)]
+        return os.path.join(self.root, *shards, name)
+
+    def _existing_path(self, name):
+        """Return path of stored file, also looking up files stored flat
+        in root directory before sharding was introduced"""
+        for path in (self.path(name), os.path.join(self.root, name)):
+            if os.path.isfile(path):
+                return path
+        return None
+
+    def save(self, data, content_type=None):
+        name = random_strings_generator()
+        path = self.path(name)
+        directory = os.path.dirname(path)
+
+        try:
+            os.makedirs(directory, exist_ok=True)
+
+            # Write to temporary file first: readers never see partial files
+            fd, temp_path = tempfile.mkstemp(dir=directory, prefix=".tmp-")
+            try:
+                with os.fdopen(fd, "wb") as file:
+                    if isinstance(data, bytes):
+                        file.write(data)
+                    else:
+                        shutil.copyfileobj(data, file)
+                os.replace(temp_path, path)
+            except BaseException:
+                os.unlink(temp_path)
+                raise
+        except OSError as error:
+            raise StorageError(f"Unable to save file: {error}") from error
+
+        return name
+
+    def send(self, name, **kwargs):
+        path = self._existing_path(name)
+        if path is None:
+            return None
+        return send_file(path, **kwargs)
+
+    def delete(self, name):
+        path = self._existing_path(name)
+        if path is None:
+            return False
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            return False
+        return True
+
+    def iter_files(self):
+        for root, _, files in os.walk(self.root):
+            for name in files:
+                if name.startswith(".tmp-"):
+                    continue
+                try:
+                    stat = os.stat(os.path.join(root, name))
+                except FileNotFoundError:
+                    continue
+                yield name, stat.st_size, stat.st_mtime
+
+
+class S3Storage(FileStorage):
+    """Files kept in an S3-compatible object store (AWS S3, MinIO, etc.),
+    shared by every node running the application. Requires `boto3`.
+    """
+
+    def __init__(self, bucket, prefix="", **client_kwargs):
+        super().__init__()
+        try:
+            import boto3  # pylint: disable=import-outside-toplevel
+        except ImportError as error:
+            raise StorageError("S3 storage requires 'boto3' package installed") from error
+
+        self.bucket = bucket
+        self.prefix = prefix
+        self.client = boto3.client("s3", **client_kwargs)
+        self._bucket_checked = False
+
+    def key(self, name):
+        """Return object key of file with provided name"""
+        return f"{self.prefix}{name}"
+
+    def _ensure_bucket(self):
+        if self._bucket_checked:
+            return
+        try:
+            self.client.head_bucket(Bucket=self.bucket)
+        except self.client.exceptions.ClientError:
+            logger.info("Creating storage bucket %s", self.bucket)
+            self.client.create_bucket(Bucket=self.bucket)
+        self._bucket_checked = True
+
+    def save(self, data, content_type=None):
+        name = random_strings_generator()
+        extra = {"ContentType": content_type} if content_type else {}
+
+        try:
+            self._ensure_bucket()
+            # Object stores publish objects atomically on successful upload
+            self.client.put_object(
+                Bucket=self.bucket, Key=self.key(name), Body=data, **extra
+            )
+        except Exception as error:  # pylint: disable=broad-exception-caught
+            raise StorageError(f"Unable to save file: {error}") from error
+
+        return name
+
+    def send(self, name, **kwargs):
+        try:
+            obj = self.client.get_object(Bucket=self.bucket, Key=self.key(name))
+        except self.client.exceptions.NoSuchKey:
+            return None
+        except Exception as error:  # pylint: disable=broad-exception-caught
+            raise StorageError(f"Unable to read file: {error}") from error
+
+        kwargs.setdefault("mimetype", obj.get("ContentType", "application/octet-stream"))
+        return send_file(io.BytesIO(obj["Body"].read()), **kwargs)
+
+    def delete(self, name):
+        self.client.delete_object(Bucket=self.bucket, Key=self.key(name))
+        return True
+
+    def iter_files(self):
+        paginator = self.client.get_paginator("list_objects_v2")
+        for page in paginator.paginate(Bucket=self.bucket, Prefix=self.prefix):
+            for obj in page.get("Contents", []):
+                yield (
+                    obj["Key"][len(self.prefix) :],
+                    obj["Size"],
+                    obj["LastModified"].timestamp(),
+                )
+
+
+def check_storage(storage, content=b"storage check"):
+    """Save a small file, read it back and delete it. Runs in a request
+    context, as files are read back through `send`. _StorageError_ naming
+    the failed step is raised if the file does not round-trip.
+
+    ## Parameters:
+        **storage** (_FileStorage_):
+        Backend to check. <br>
+
+        **content** (_bytes_, optional):
+        Content of the checked file. Defaults to `b"storage check"`.
+    """
+    name = storage.save(content, content_type="application/octet-stream")
+    try:
+        response = storage.send(name)
+        if response is None:
+            raise StorageError(f"Saved file {name} is not found")
+        response.direct_passthrough = False
+        with response:
+            if response.get_data() != content:
+                raise StorageError(f"Content of file {name} differs from the saved one")
+    finally:
+        storage.delete(name)
+
+    if storage.send(name) is not None:
+        raise StorageError(f"File {name} is still stored after deletion")
+
+
+def create_storage(config, root, bucket):
+    """Build storage backend for uploaded files from application config.
+
+    ## Parameters:
+        **config** (_Config_):
+        Application configuration. <br>
+
+        **root** (_str_):
+        Directory of files in local storage. <br>
+
+        **bucket** (_str_):
+        Bucket of files in S3 storage.
+
+    ### Returns:
+        _FileStorage_:
+        configured storage backend.
+    """
+    backend = config["PROFILE_PICTURE_STORAGE"]
+
+    if backend == "local":
+        return LocalStorage(root)
+
+    if backend == "s3":
+        return S3Storage(
+            bucket,
+            prefix=config["S3_PREFIX"],
+            endpoint_url=config["S3_ENDPOINT_URL"],
+            aws_access_key_id=config["S3_ACCESS_KEY_ID"],
+            aws_secret_access_key=config["S3_SECRET_ACCESS_KEY"],
+            region_name=config["S3_REGION"],
+        )
+
+    raise StorageError(f"Unknown storage backend: {backend}")
@@ -0,0 +1,96 @@
+"""Mentions in chat messages and cached per-user unread counters"""
+
+import re
+import time
+import threading
+from collections import OrderedDict
+
+from utils.constants import MENTIONS_MAX, UNREAD_CACHE_SIZE, UNREAD_CACHE_TTL
+
+# `@username` not preceded by a word character, so e-mail addresses do not match
+MENTION = re.compile(r"(?<![\w@])@([A-Za-z0-9_]{1,32})")
+
+
+def parse_mentions(message, limit=MENTIONS_MAX):
+    r"""Extract mentioned usernames from message.
+
+    ## Parameters:
+        **message** (_str_):
+        Message content. <br>
+
+        **limit** (_int_, optional):
+        Maximum number of usernames returned. Defaults to `MENTIONS_MAX`.
+
+    ### Returns:
+        _List\[str\]_:
+        distinct usernames in order of first mention.
+    """
+    usernames = []
+    for match in MENTION.finditer(message):
+        if match.group(1) not in usernames:
+            usernames.append(match.group(1))
+            if len(usernames) == limit:
+                break
+    return usernames
+
+
+def user_room(user_id):
+    """Return name of room joined by all sockets of a user"""
+    return f"user:{user_id}"
+
+
+class UnreadCache:
+    """Unread counters of recently seen users, kept for a few seconds so
+    repeated page views do not query the database. Counters changed by this
+    process replace cached ones at once; changes made by other workers show
+    up when entries expire."""
+
+    def __init__(self, ttl, size):
+        self.ttl = ttl
+        self.size = size
+        # Ordered by last write, which with a fixed ttl is also expiry order
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, user_id):
+        """Return cached counters of user, _None_ if missing or expired"""
+        entry = self._entries.get(str(user_id))
+        if entry is None or entry[1] < time.monotonic():
+            return None
+        return entry[0]
+
+    def put(self, user_id, counters):
+        """Cache counters of user"""
+        now = time.monotonic()
+        key = str(user_id)
+        with self._lock:
+            self._entries.pop(key, None)
+            # Oldest entries go first, expired or not, so size stays bounded
+            while self._entries and len(self._entries) >= self.size:
+                self._entries.popitem(last=False)
+            self._entries[key] = (counters, now + self.ttl)
+
+    def load(self, user_service, user_id):
+        """Return counters of user from cache, loading them on a miss.
+
+        ## Parameters:
+            **user_service** (_UserService_):
+            Service used on cache miss. <br>
+
+            **user_id** (_str_):
+            User unique identifier.
+
+        ### Returns:
+            _dict_:
+            `unread` and `mentions` counts. _None_ if they could not be loaded.
+        """
+        counters = self.get(user_id)
+        if counters is None:
+            counters = user_service.get_unread_counters(user_id)
+            if counters is not None:
+                self.put(user_id, counters)
+        return counters
+
+
+# Counters cache of this process
+unread_cache = UnreadCache(UNREAD_CACHE_TTL, UNREAD_CACHE_SIZE)
@@ -0,0 +1,116 @@
+"""Fingerprinted static assets: build step and template helper"""
+
+import gzip
+import hashlib
+import json
+import logging
+import os
+import shutil
+from functools import lru_cache
+
+from flask import current_app, url_for
+
+logger = logging.getLogger("gunicorn.access")
+
+MANIFEST_NAME = "manifest.json"
+
+# Files that benefit from pre-compression (images are already compressed)
+COMPRESSIBLE_EXTENSIONS = {".js", ".css", ".svg", ".json", ".txt", ".html"}
+
+
+def _fingerprint(path):
+    """Return short content hash of file at path"""
+    digest = hashlib.sha256()
+    with open(path, "rb") as file:
+        for chunk in iter(lambda: file.read(64 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()[:12]
+
+
+def build_assets(static_dir, output_dir):
+    r"""Copy static files under content-hashed names, pre-compress them and
+    write a manifest mapping original names to fingerprinted ones.
+
+    ## Parameters:
+        **static_dir** (_str_):
+        Directory with source static files. <br>
+
+        **output_dir** (_str_):
+        Directory where fingerprinted files and manifest are written.
+
+    ### Returns:
+        _dict\[str, str\]_:
+        manifest mapping relative source paths to relative fingerprinted paths.
+    """
+    manifest = {}
+
+    for root, _, files in os.walk(static_dir):
+        for name in sorted(files):
+            source = os.path.join(root, name)
+            relative = os.path.relpath(source, static_dir).replace(os.sep, "/")
+
+            stem, extension = os.path.splitext(relative)
+            hashed = f"{stem}.{_fingerprint(source)}{extension}"
+            target = os.path.join(output_dir, hashed)
+
+            manifest[relative] = hashed
+
+            # Content-addressed: existing file with same name is identical
+            if os.path.exists(target):
+                continue
+
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            shutil.copyfile(source, target)
+
+            if extension not in COMPRESSIBLE_EXTENSIONS:
+                continue
+
+            with open(source, "rb") as file:
+                content = file.read()
+
+            with open(f"{target}.gz", "wb") as file:
+                file.write(gzip.compress(content, compresslevel=9, mtime=0))
+
+    # Write manifest atomically so running workers never read a partial one
+    manifest_path = os.path.join(output_dir, MANIFEST_NAME)
+    with open(f"{manifest_path}.tmp", "w", encoding="utf-8") as file:
+        json.dump(manifest, file, indent=2, sort_keys=True)
+    os.replace(f"{manifest_path}.tmp", manifest_path)
+
+    logger.info("%s static assets fingerprinted into %s", len(manifest), output_dir)
+    return manifest
+
+
+@lru_cache(maxsize=None)
+def load_manifest(output_dir):
+    r"""Read manifest produced by `build_assets`. Cached per process.
+
+    ### Returns:
+        _dict\[str, str\]_:
+        manifest mapping, empty if assets were not built.
+    """
+    try:
+        with open(os.path.join(output_dir, MANIFEST_NAME), encoding="utf-8") as file:
+            return json.load(file)
+    except (FileNotFoundError, json.JSONDecodeError):
+        logger.debug("No static asset manifest found: serving unversioned files")
+        return {}
+
+
+def asset_url(filename):
+    """Template helper resolving static filename to its fingerprinted URL.
+    Falls back to the regular static endpoint when assets were not built.
+
+    ## Parameters:
+        **filename** (_str_):
+        Path relative to static folder, e.g. `js/message_handler.js`.
+
+    ### Returns:
+        _str_:
+        URL to reference in templates.
+    """
+    manifest = load_manifest(current_app.config["ASSETS_OUTPUT_PATH"])
+    hashed = manifest.get(filename)
+    if hashed is None:
+        return url_for("static", filename=filename)
+    return current_app.config["ASSETS_URL_PREFIX"] + hashed
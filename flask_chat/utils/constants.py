@@ -5,12 +5,101 @@ WEBSITE_NAME="yappSpace"
 
 # In-app paths
 PROFILE_PICTURE_STORAGE_PATH = "/profile_pictures"
+ATTACHMENT_STORAGE_PATH = "/attachments"
+ATTACHMENT_UPLOAD_PATH = "/tmp/attachment_uploads"
 DEFAULT_PROFILE_PICTURE_PATH = "./static/images/default.jpg"
+STATIC_FILES_PATH = "./static"
+# Secret key shared by all workers and kept across restarts
+SECRET_KEY_PATH = "/secrets/secret_key"
+
+# Fingerprinted static assets (served by nginx with immutable caching)
+ASSETS_OUTPUT_PATH = "/static_assets"
+ASSETS_URL_PREFIX = "/assets/"
+ASSETS_MAX_AGE = 365 * 24 * 60 * 60
 
 # Chat propertires
 MSG_LOAD_BATCH = 5
 MSG_MAX_LENGTH = 4096
 
+# Mentions: usernames looked up per message; unread counters are cached
+# for UNREAD_CACHE_TTL seconds, expired entries dropped past UNREAD_CACHE_SIZE users
+MENTIONS_MAX = 10
+UNREAD_CACHE_TTL = 10
+UNREAD_CACHE_SIZE = 10000
+MESSAGES_COUNTER = "messages"
+
+# Presence: clients send a heartbeat every PRESENCE_HEARTBEAT seconds and
+# are dropped PRESENCE_TTL seconds after the last one (browsers may delay
+# timers of background tabs up to a minute); expiry and join/leave deltas
+# are processed once per PRESENCE_TICK seconds
+PRESENCE_HEARTBEAT = 20
+PRESENCE_TTL = 90
+PRESENCE_TICK = 2
+
+# Uploaded images: bytes read to detect file type, accepted dimensions
+SIGNATURE_LENGTH = 2048
+PROFILE_PICTURE_MIN_SIZE = (200, 200)
+ATTACHMENT_MIN_SIZE = (1, 1)
+ATTACHMENT_MAX_SIZE = (4096, 4096)
+
+# Image attachments of chat messages: uploaded in chunks of at most
+# ATTACHMENT_CHUNK_SIZE bytes, each copied to disk in blocks of
+# ATTACHMENT_COPY_BLOCK bytes; unfinished uploads expire after ATTACHMENT_UPLOAD_TTL
+ATTACHMENT_MAX_BYTES = 8 * 1024 * 1024
+ATTACHMENT_CHUNK_SIZE = 256 * 1024
+ATTACHMENT_COPY_BLOCK = 64 * 1024
+ATTACHMENT_UPLOAD_TTL = 60 * 60
+ATTACHMENT_THUMBNAIL_SIZE = (320, 320)
+ATTACHMENT_MAX_AGE = 365 * 24 * 60 * 60
+
+# HTTP history pages before a given message are immutable: cached this long
+HISTORY_PAGE_MAX_AGE = 24 * 60 * 60
+HISTORY_PAGE_MAX_LIMIT = 100
+
+# Messages per page of a user's history on the public profile
+PROFILE_HISTORY_PAGE = 20
+
+# Maintenance: retention is disabled by default, messages are kept forever
+MAINTENANCE_INTERVAL = 60 * 60
+MAINTENANCE_BATCH_SIZE = 1000
+PROFILE_PICTURE_GRACE_PERIOD = 60 * 60
+
+# Moderation of /manage/moderation: messages changed per transaction, pause
+# between batches in seconds, and counter advanced by every changed batch
+MODERATION_BATCH_SIZE = 1000
+MODERATION_PAUSE = 0.05
+MODERATION_COUNTER = "moderation"
+
+# Query log of /manage/queries: statements at least this slow are logged
+# with their plan; shapes past the limit are logged but not aggregated
+SLOW_QUERY_MS = 100
+QUERY_LOG_MAX_SHAPES = 500
+QUERY_LOG_MAX_PARAMETERS = 20
+
+# Sampling profiler of /manage
+PROFILER_DEFAULT_DURATION = 10
+PROFILER_MAX_DURATION = 120
+PROFILER_DEFAULT_INTERVAL_MS = 5
+PROFILER_TOP_FUNCTIONS = 30
+
+# Live stats of /manage/stats: seconds of history kept in memory
+STATS_WINDOW = 5 * 60
+
+# Load shedding of history loads and profile views when database degrades
+LOAD_SHED_LATENCY_MS = 250
+LOAD_SHED_MAX_IN_FLIGHT = 64
+LOAD_SHED_HALF_LIFE = 5
+LOAD_SHED_RETRY_AFTER = 5
+
+# Threads running synchronous views in ASGI serving mode
+ASGI_VIEW_THREADS = 16
+
+# Argon2 calibration: parameters file and default budget of one hash
+ARGON2_PARAMS_PATH = "./argon2_params.json"
+ARGON2_TARGET_MS = 250
+ARGON2_MAX_MEMORY = 64 * 1024
+ARGON2_PARALLELISM = 2
+
 # Roles constants
 ADMIN_ROLE_ID = 1
 MOD_ROLE_ID = 2
@@ -18,3 +107,8 @@ USER_ROLE_ID = 3
 
 # Session token expiry (in seconds)
 SESSION_EXPIRY = 86400
+
+# Gunicorn: seconds given to old workers to finish requests on reload or
+# shutdown, and pid file of the master process receiving signals
+GRACEFUL_TIMEOUT = 30
+GUNICORN_PIDFILE = "/tmp/gunicorn.pid"
@@ -3,29 +3,60 @@
 import uuid
 import logging
 import io
-import magic
+import secrets
+import threading
+import time
 from flask import current_app, request
-from PIL import Image, UnidentifiedImageError
+
+from utils.constants import PROFILE_PICTURE_MIN_SIZE, SIGNATURE_LENGTH
 
 logger = logging.getLogger("gunicorn.access")
 
 
 # Functions to use with uploaded images
-def verify_image(data):
-    """Verify the received image as having appropriate format and no
+def detect_content_type(data):
+    """Detect MIME type of file content by its signature.
+
+    ## Parameters:
+        **data** (_bytes_):
+        full file stored in bytestream, or at least its first kilobytes
+    ### Returns:
+        _str_:
+        detected MIME type, e.g. `image/png`.
+    """
+    # Imported on first use: libmagic is only needed on upload paths
+    import magic  # pylint: disable=import-outside-toplevel
+
+    return magic.from_buffer(data, mime=True)
+
+
+def verify_image(data, min_size=PROFILE_PICTURE_MIN_SIZE, max_size=None):
+    r"""Verify the received image as having appropriate format and no
     corruptions/malicious modifications and finally appropriate dimensions.
 
     ## Parameters:
-        **data** (_bytes_): 
-        full file stored in bytestream
+        **data** (_bytes_ | _BinaryIO_):
+        full file stored in bytestream, or binary file opened for reading;
+        files are verified without being loaded into memory at once <br>
+
+        **min_size** (_Tuple\[int, int\]_, optional):
+        smallest accepted width and height. Defaults to minimal profile picture size. <br>
+
+        **max_size** (_Tuple\[int, int\]_, optional):
+        largest accepted width and height. Defaults to _None_ (no limit).
     ### Returns:
-        _bool_: 
+        _bool_:
         _True_ if image is appropriate format and not corrupted, otherwise _False_.
     """
 
+    # Imported on first use: image libraries are only needed on upload paths
+    from PIL import Image, UnidentifiedImageError  # pylint: disable=import-outside-toplevel
+
     allowed_image_types = ["image/jpeg", "image/png"]
 
-    content_type = magic.from_buffer(data, mime=True)
+    stream = io.BytesIO(data) if isinstance(data, bytes) else data
+    content_type = detect_content_type(stream.read(SIGNATURE_LENGTH))
+    stream.seek(0)
     if content_type not in allowed_image_types:
         logger.error("Error while verifying image: signature does not match allowed formats")
         return False
@@ -33,7 +64,7 @@ def verify_image(data):
     logger.debug("Signature is verified")
 
     try:
-        image = Image.open(io.BytesIO(data))
+        image = Image.open(stream)
         image.verify()
         logger.debug("Image's integrity is verified")
     except UnidentifiedImageError:
@@ -42,8 +73,11 @@ def verify_image(data):
     except OSError:
         logger.debug("Error while verifying image: the file is likely truncated")
         return False
+    finally:
+        stream.seek(0)
 
-    if any(x > y for x, y in zip((200, 200), image.size)):
+    too_large = max_size is not None and any(x > y for x, y in zip(image.size, max_size))
+    if too_large or any(x > y for x, y in zip(min_size, image.size)):
 
         logger.debug("Unacceptable resolution of the uploaded photo: %s", image.size)
         return False
@@ -55,7 +89,8 @@ def verify_image(data):
 # To mitigate security risks, all the received files from client side
 # will be renamed to some random uuid
 def random_strings_generator():
-    """Generate random strings for filenames and other ids.
+    """Generate random strings for filenames. Random names spread files
+    evenly across storage shards, so they are not used as row ids.
 
     ### Returns:
         _string_: 
@@ -65,6 +100,40 @@ def random_strings_generator():
     return newname
 
 
+# Last identifier issued by this process, keeps identifiers strictly increasing
+_last_id = 0
+_id_lock = threading.Lock()
+
+
+def time_ordered_id():
+    """Generate UUIDv7 identifier for database rows: 48-bit millisecond
+    timestamp followed by random bits. New rows land at the right edge of
+    primary key indexes and ordering by identifier follows creation order.
+    Identifiers made by one process within the same millisecond are still
+    increasing.
+
+    ### Returns:
+        _UUID_:
+        time-ordered uuid.
+    """
+    global _last_id  # pylint: disable=global-statement
+
+    # 48 bits of timestamp and 74 random bits, before version and variant are inserted
+    value = (time.time_ns() // 1_000_000) << 74 | secrets.randbits(74)
+    with _id_lock:
+        if value <= _last_id:
+            value = _last_id + 1
+        _last_id = value
+
+    return uuid.UUID(
+        int=(value >> 74) << 80  # unix_ts_ms
+        | 0x7 << 76  # version
+        | ((value >> 62) & 0xFFF) << 64  # rand_a
+        | 0b10 << 62  # variant
+        | value & ((1 << 62) - 1)  # rand_b
+    )
+
+
 # Function to send custom log messages for each instances
 def log_request():
     """Debug-level log to dump useful info about received requests"""
@@ -0,0 +1,125 @@
+"""Argon2 parameters: calibration against a latency budget and persistence"""
+
+import json
+import logging
+import os
+import statistics
+import time
+from datetime import datetime, timezone
+
+from argon2 import PasswordHasher
+
+logger = logging.getLogger("gunicorn.access")
+
+# Parameters persisted by calibration; other PasswordHasher arguments keep defaults
+PARAMETER_NAMES = ("time_cost", "memory_cost", "parallelism")
+
+
+def measure_hash(time_cost, memory_cost, parallelism, samples=5):
+    """Return median latency of one argon2 hash in milliseconds.
+
+    ## Parameters:
+        **time_cost** (_int_):
+        Number of iterations. <br>
+
+        **memory_cost** (_int_):
+        Memory in kibibytes. <br>
+
+        **parallelism** (_int_):
+        Number of lanes. <br>
+
+        **samples** (_int_, optional):
+        Number of measured hashes. Defaults to 5.
+
+    ### Returns:
+        _float_:
+        median hash latency.
+    """
+    hasher = PasswordHasher(
+        time_cost=time_cost, memory_cost=memory_cost, parallelism=parallelism
+    )
+    hasher.hash("calibration")  # warm up allocator
+
+    timings = []
+    for _ in range(samples):
+        started = time.perf_counter()
+        hasher.hash("calibration")
+        timings.append((time.perf_counter() - started) * 1000)
+    return statistics.median(timings)
+
+
+def calibrate(target_ms, max_memory, parallelism):
+    """Find parameters whose hash latency gets closest to the target from
+    below. Memory is preferred over iterations, as it is what makes attacks
+    on dedicated hardware expensive: it starts at `max_memory` and is halved
+    while a single iteration is over budget, then iterations are added
+    while they fit.
+
+    ## Parameters:
+        **target_ms** (_float_):
+        Latency budget of one hash in milliseconds. <br>
+
+        **max_memory** (_int_):
+        Upper bound of memory in kibibytes. <br>
+
+        **parallelism** (_int_):
+        Number of lanes.
+
+    ### Returns:
+        _dict_:
+        calibrated parameters with measured latency.
+    """
+    # argon2 needs at least 8 KiB per lane
+    min_memory = 8 * parallelism
+    memory_cost = max(max_memory, min_memory)
+
+    latency = measure_hash(1, memory_cost, parallelism)
+    while latency > target_ms and memory_cost // 2 >= min_memory:
+        memory_cost //= 2
+        latency = measure_hash(1, memory_cost, parallelism)
+
+    time_cost = 1
+    while True:
+        next_latency = measure_hash(time_cost + 1, memory_cost, parallelism)
+        if next_latency > target_ms:
+            break
+        time_cost, latency = time_cost + 1, next_latency
+
+    return {
+        "time_cost": time_cost,
+        "memory_cost": memory_cost,
+        "parallelism": parallelism,
+        "measured_ms": round(latency, 1),
+        "target_ms": target_ms,
+        "calibrated_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+    }
+
+
+def save_params(path, params):
+    """Write calibrated parameters to path atomically"""
+    temporary = f"{path}.tmp"
+    with open(temporary, "w", encoding="utf-8") as file:
+        json.dump(params, file, indent=2)
+    os.replace(temporary, path)
+
+
+def load_params(path):
+    r"""Read calibrated parameters.
+
+    ## Parameters:
+        **path** (_str_):
+        File written by calibration.
+
+    ### Returns:
+        _dict\[str, int\]_:
+        `PasswordHasher` arguments. _None_ if file is missing or invalid.
+    """
+    try:
+        with open(path, encoding="utf-8") as file:
+            params = json.load(file)
+        return {name: int(params[name]) for name in PARAMETER_NAMES}
+    except FileNotFoundError:
+        return None
+    except (ValueError, KeyError, TypeError) as error:
+        logger.error("Invalid argon2 parameters file %s: %s", path, error)
+        return None
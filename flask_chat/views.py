@@ -1,15 +1,21 @@
 """routes for app"""
 
-import os
+import hashlib
+import uuid
 import logging
 from flask import (
     Blueprint,
     abort,
     flash,
+    jsonify,
+    make_response,
     redirect,
     render_template,
     request,
     send_file,
+    send_from_directory,
+    current_app,
+    url_for,
 )
 from flask_jwt_extended import (
     create_access_token,
@@ -17,19 +23,47 @@ from flask_jwt_extended import (
     jwt_required,
     set_access_cookies,
     unset_jwt_cookies,
+    verify_jwt_in_request,
+)
+from flask_jwt_extended.exceptions import JWTExtendedException
+from jwt import PyJWTError
+
+from attachments import UploadError, parse_content_range
+from extensions import (
+    user_service,
+    message_service,
+    profile_pictures,
+    attachments,
+    uploads,
+    thumbnails,
 )
-
-from services import UserService, MessageService
 from decorators import privilege_required
-from forms import RegForm, LogForm, EditProfileForm
+from loadshed import shed_request
+from metrics import LOGINS, live_stats
+from querylog import query_log
+from payloads import JSON, encode_message
+from forms import RegForm, LogForm, EditProfileForm, ProfilerForm
+from storage import StorageError
+from unread import unread_cache
 
 from utils.constants import (
-    PROFILE_PICTURE_STORAGE_PATH,
     DEFAULT_PROFILE_PICTURE_PATH,
     WEBSITE_NAME,
+    ASSETS_MAX_AGE,
+    PROFILER_TOP_FUNCTIONS,
+    MSG_LOAD_BATCH,
+    HISTORY_PAGE_MAX_AGE,
+    HISTORY_PAGE_MAX_LIMIT,
+    MODERATION_BATCH_SIZE,
+    PROFILE_HISTORY_PAGE,
+    ATTACHMENT_CHUNK_SIZE,
+    ATTACHMENT_MIN_SIZE,
+    ATTACHMENT_MAX_SIZE,
+    ATTACHMENT_MAX_AGE,
+    SIGNATURE_LENGTH,
 )
 from utils.helpers import (
-    random_strings_generator,
+    detect_content_type,
     log_request,
     verify_image,
 )
@@ -40,10 +74,6 @@ views_bp = Blueprint("routes", __name__)
 # Init root logger
 logger = logging.getLogger("gunicorn.access")
 
-# Init custom services
-user_service = UserService()
-message_service = MessageService()
-
 
 @views_bp.route("/", methods=["GET"])
 @jwt_required()
@@ -73,8 +103,22 @@ def main():
 
     logger.debug("Info about user retrieved successfully: %s", user_data)
 
+    # Older history is fetched page by page before the oldest shown message
+    history_cursor = None
+    if message_data:
+        history_cursor = min(msg["message_id"] for msg in message_data)
+
+    # Part of history page URLs: pages cached before a moderation are skipped
+    revision = message_service.moderation_revision() or 0
+
+    # Counters of messages sent since last visit, from cache or two row reads
+    unread = unread_cache.load(user_service, user_id) or {"unread": 0, "mentions": 0}
+
     return render_template(
         "index.html",
+        history_cursor=history_cursor,
+        revision=revision,
+        unread=unread,
         msg_data=message_data,
         usr_data=user_data.to_json(),
         web_name=WEBSITE_NAME,
@@ -157,6 +201,14 @@ def login():
         logger.info("Login failed")
         return render_template("login.html", form=form)
 
+    # Upgrade hash made with outdated argon2 parameters while the plain
+    # password is at hand; login proceeds even if the update fails
+    if user_data.password_needs_rehash():
+        if user_service.update_user(user_data.user_id, passwd=user_data.set_password(password)):
+            logger.info("Password rehashed with current parameters.")
+        else:
+            logger.error("Password rehash failed.")
+
     # Creating session token for user, considering it as successful login,
     # redirecting to main page
     response = redirect("/")
@@ -164,6 +216,7 @@ def login():
     set_access_cookies(response, access_token)
 
     logger.info("Login successful.")
+    live_stats.record(LOGINS)
 
     return response
 
@@ -241,31 +294,28 @@ def profile():
             flash("The file is inappropriate or corrupted. Try again")
             return redirect(request.url)
 
-        # Generate new random name for file that will be stored
-        picture_name = random_strings_generator()
-
-        # Saving file to it's defined path
-        with open(
-            os.path.join(PROFILE_PICTURE_STORAGE_PATH, picture_name), "wb"
-        ) as file:
-            file.write(content_clean)
+        # Saving file to storage under new random name
+        try:
+            picture_name = profile_pictures.save(
+                content_clean, content_type=detect_content_type(content_clean)
+            )
+        except StorageError as error:
+            logger.error("Profile picture saving failed: %s", error)
+            flash("Unable to renew your profile picture. Try again later.")
+            return redirect(request.url)
 
         # Update profile picture filename in database
         result = user_service.update_user(user_id, profile_picture=picture_name)
         if not result:
             logger.debug("Profile picture update failed.")
+            profile_pictures.delete_async(picture_name)
             flash("Unable to renew your profile picture. Try again later.")
             return redirect(request.url)
 
-        # remove old picture to avoid trashing
+        # remove old picture in background to avoid trashing
         if user_data.get("profile_picture") is not None:
-            try:
-                os.remove(
-                    os.path.join(PROFILE_PICTURE_STORAGE_PATH, user_data.get("profile_picture"))
-                )
-                logger.debug("Previous picture is removed.")
-            except FileNotFoundError:
-                logger.debug("No picture to remove: proceeding...")
+            profile_pictures.delete_async(user_data.get("profile_picture"))
+            logger.debug("Previous picture is scheduled for removal.")
 
         return render_template(
             "profile.html",
@@ -342,6 +392,7 @@ def profile():
 
 @views_bp.route("/profile/<user>", methods=["GET"])
 @jwt_required()
+@shed_request
 def public_profile(user):
     """Display profile page in public mode"""
 
@@ -359,24 +410,47 @@ def public_profile(user):
     current_user = current_user_info.username
     logger.debug("Current user: %s", current_user)
 
+    # Older messages of the user are paged by identifier of the oldest shown
+    before = request.args.get("before")
+    if before is not None:
+        try:
+            before = uuid.UUID(before)
+        except ValueError:
+            return abort(400)
+
     # Check whether user exists. If not, throw 404
-    if not user_service.get_user_info(username=user):
+    user_info = user_service.get_user_info(username=user)
+    if not user_info:
         logger.debug("The username profile that was tried to access does not exist")
         return abort(404)
 
     logger.debug("Info about user retrieved successfully")
-    user_data = user_service.get_user_info(username=user)[0].to_json()
+    user_data = user_info[0].to_json()
+
+    messages = message_service.user_history_page(
+        user_data["user_id"], before=before, limit=PROFILE_HISTORY_PAGE
+    )
+    if messages is None:
+        logger.error("Failed to load messages of user.")
+        messages = []
+
+    older = None
+    if len(messages) == PROFILE_HISTORY_PAGE:
+        older = url_for("routes.public_profile", user=user, before=messages[-1]["message_id"])
 
     return render_template(
         "profile_public.html",
         current_user=current_user,
         data=user_data,
+        messages=messages,
+        older=older,
         web_name=WEBSITE_NAME,
     )
 
 
 @views_bp.route("/profile-picture/<user>", methods=["GET"])
 @jwt_required()
+@shed_request
 def profile_picture(user):
     """Retrieve users' profile pictures"""
 
@@ -398,20 +472,330 @@ def profile_picture(user):
         logger.debug("Profile picture not set: using default.")
         return send_file(DEFAULT_PROFILE_PICTURE_PATH)
 
-    profile_picture_path = os.path.join(PROFILE_PICTURE_STORAGE_PATH, profile_picture_name)
+    try:
+        response = profile_pictures.send(profile_picture_name)
+    except StorageError as error:
+        logger.error("Profile picture loading failed: %s", error)
+        response = None
 
-    if not os.path.exists(profile_picture_path):
+    if response is None:
         logger.debug("Profile picture not found: using default.")
         return send_file(DEFAULT_PROFILE_PICTURE_PATH)
 
-    return send_file(profile_picture_path)
+    return response
+
+
+@views_bp.route("/session", methods=["GET"])
+def session_check():
+    """Tell whether request carries a valid session: 204 if it does, 401
+    otherwise. nginx asks it before serving history pages from its cache,
+    which would skip the check of the view."""
+
+    try:
+        verify_jwt_in_request()
+    except (JWTExtendedException, PyJWTError):
+        return "", 401
+    return "", 204
+
+
+@views_bp.route("/messages", methods=["GET"])
+@jwt_required()
+@shed_request
+def messages_history():
+    """Page of message history as JSON, newest first. Pages before a given
+    message never change, so they are cacheable by browsers and nginx."""
+
+    log_request()
+
+    before = request.args.get("before")
+    try:
+        limit = int(request.args.get("limit", MSG_LOAD_BATCH))
+        if before is not None:
+            before = uuid.UUID(before)
+    except ValueError:
+        return abort(400)
+    if not 1 <= limit <= HISTORY_PAGE_MAX_LIMIT:
+        return abort(400)
+
+    page = message_service.history_page(before=before, limit=limit)
+    if page is None:
+        logger.error("Failed to load messages history.")
+        return abort(500)
+
+    logger.debug("%s messages of history retrieved.", len(page))
+
+    next_page = None
+    if len(page) == limit:
+        # Moderation revision keys cached pages: after messages are deleted or
+        # hidden, clients follow links to pages not cached yet
+        next_page = url_for(
+            "routes.messages_history",
+            before=page[-1]["message_id"],
+            limit=limit,
+            rev=message_service.moderation_revision() or 0,
+        )
+
+    response = jsonify(
+        messages=[
+            encode_message(
+                msg["username"],
+                msg["message_content"],
+                msg["message_timestamp"],
+                JSON,
+                msg["attachment_id"],
+                msg["message_id"],
+                msg["message_edited"],
+            )
+            for msg in page
+        ],
+        next=next_page,
+    )
+
+    response.set_etag(hashlib.sha256(response.get_data()).hexdigest()[:32])
+    if before is None:
+        # Newest page changes with every message: revalidate each time
+        response.headers["Cache-Control"] = "private, no-cache"
+        response.headers["X-Accel-Expires"] = "0"
+    else:
+        response.headers["Cache-Control"] = (
+            f"private, max-age={HISTORY_PAGE_MAX_AGE}, immutable"
+        )
+        # Lifetime in the nginx cache, shared by all authenticated users
+        response.headers["X-Accel-Expires"] = str(HISTORY_PAGE_MAX_AGE)
+
+    return response.make_conditional(request)
+
+
+@views_bp.route("/uploads", methods=["POST"])
+@jwt_required()
+def start_upload():
+    """Start chunked upload of an image attachment. Chunks are sent with
+    `PUT /uploads/<upload_id>` and a `Content-Range` header, in order."""
+
+    log_request()
+
+    try:
+        upload_id = uploads.create(get_jwt_identity())
+    except OSError as error:
+        logger.error("Unable to start upload: %s", error)
+        return abort(500)
+
+    return jsonify(upload_id=upload_id, chunk_size=ATTACHMENT_CHUNK_SIZE), 201
+
+
+@views_bp.route("/uploads/<upload_id>", methods=["PUT"])
+@jwt_required()
+def upload_chunk(upload_id):
+    """Receive one chunk of an upload. Answers 202 with the count of bytes
+    received while the upload is incomplete, and 201 with the attachment
+    once the last chunk is verified and stored."""
+
+    log_request()
+
+    user_id = get_jwt_identity()
+
+    content_range = parse_content_range(request.headers.get("Content-Range"))
+    if content_range is None:
+        return abort(400)
+
+    try:
+        received = uploads.write_chunk(user_id, upload_id, content_range, request.stream)
+    except UploadError as error:
+        logger.debug("Chunk of upload %s rejected: %s", upload_id, error)
+        return jsonify(error=str(error), received=error.received), error.status
+
+    _, _, total = content_range
+    if received < total:
+        return jsonify(received=received), 202
+
+    # Upload is complete: verified and stored without being read into memory
+    path = uploads.path(user_id, upload_id)
+    with open(path, "rb") as file:
+        if not verify_image(file, ATTACHMENT_MIN_SIZE, ATTACHMENT_MAX_SIZE):
+            uploads.discard(user_id, upload_id)
+            return jsonify(error="The file is inappropriate or corrupted"), 422
+
+        content_type = detect_content_type(file.read(SIGNATURE_LENGTH))
+        file.seek(0)
+
+        try:
+            file_name = attachments.save(file, content_type=content_type)
+        except StorageError as error:
+            logger.error("Attachment saving failed: %s", error)
+            uploads.discard(user_id, upload_id)
+            return abort(500)
+
+    attachment_id = message_service.insert_attachment(file_name, content_type, total, user_id)
+    if attachment_id is None:
+        logger.error("Unable to save attachment info.")
+        attachments.delete_async(file_name)
+        uploads.discard(user_id, upload_id)
+        return abort(500)
+
+    # Thumbnail is rendered from the spooled file, which is removed afterwards
+    thumbnails.submit(attachment_id, path)
+
+    return jsonify(attachment_id=str(attachment_id)), 201
+
+
+@views_bp.route("/attachments/<attachment_id>", methods=["GET"])
+@jwt_required()
+@shed_request
+def attachment_image(attachment_id):
+    """Retrieve image attached to a message"""
+
+    return send_attachment(attachment_id, thumbnail=False)
+
+
+@views_bp.route("/attachments/<attachment_id>/thumbnail", methods=["GET"])
+@jwt_required()
+@shed_request
+def attachment_thumbnail(attachment_id):
+    """Retrieve thumbnail of image attached to a message. Answers 404 until
+    the thumbnail is generated."""
+
+    return send_attachment(attachment_id, thumbnail=True)
+
+
+def send_attachment(attachment_id, thumbnail):
+    """Build response with attachment image or its thumbnail. Attachments
+    never change, so they are cached by browsers for good."""
+
+    log_request()
+
+    attachment = message_service.get_attachment(attachment_id)
+    if attachment is None:
+        return abort(404)
+
+    name = attachment.thumbnail_name if thumbnail else attachment.file_name
+    if name is None:
+        return abort(404)
+
+    try:
+        response = attachments.send(name, mimetype=attachment.content_type)
+    except StorageError as error:
+        logger.error("Attachment loading failed: %s", error)
+        return abort(500)
+
+    if response is None:
+        return abort(404)
+
+    response.headers["Cache-Control"] = f"private, max-age={ATTACHMENT_MAX_AGE}, immutable"
+    return response
+
+
+@views_bp.route("/assets/<path:filename>", methods=["GET"])
+def assets(filename):
+    """Serve fingerprinted static assets when nginx is not in front of the app"""
+
+    response = send_from_directory(
+        current_app.config["ASSETS_OUTPUT_PATH"], filename, max_age=ASSETS_MAX_AGE
+    )
+    response.headers["Cache-Control"] = f"public, max-age={ASSETS_MAX_AGE}, immutable"
+    return response
 
 
 @views_bp.route("/manage")
 @privilege_required
 def manage_chat():
-    """Page to handle chat settings"""
+    """Admin panel: sampling profiler of the serving worker"""
+
+    log_request()
+
+    form = ProfilerForm()
+    form.csrf_token.data = request.cookies.get("csrf_access_token")
+
+    profiler = current_app.extensions["profiler"]
+
+    return render_template(
+        "manage.html",
+        form=form,
+        profiler=profiler,
+        hot_functions=profiler.top(PROFILER_TOP_FUNCTIONS),
+    )
+
+
+@views_bp.route("/manage/stats", methods=["GET"])
+@privilege_required
+def live_stats_page():
+    """Live throughput of this worker, streamed over the stats namespace"""
+
+    log_request()
+
+    return render_template("manage_stats.html", window=live_stats.window)
+
+
+@views_bp.route("/manage/queries", methods=["GET"])
+@privilege_required
+def query_stats_page():
+    """Statements run by this worker grouped by shape, slowest in total first"""
 
     log_request()
 
-    return "Welcome to admin panel! Under maintainance. Stand by"
+    return render_template(
+        "manage_queries.html",
+        shapes=query_log.stats(),
+        threshold=query_log.threshold_ms,
+        csrf_token=request.cookies.get("csrf_access_token"),
+    )
+
+
+@views_bp.route("/manage/queries/reset", methods=["POST"])
+@privilege_required
+def reset_query_stats():
+    """Drop collected query stats and plans of this worker"""
+
+    log_request()
+
+    query_log.reset()
+    return redirect("/manage/queries")
+
+
+@views_bp.route("/manage/moderation", methods=["GET"])
+@privilege_required
+def moderation_page():
+    """Bulk deletion and hiding of messages, run over the chat socket"""
+
+    log_request()
+
+    return render_template("manage_moderation.html", batch_size=MODERATION_BATCH_SIZE)
+
+
+@views_bp.route("/manage/profile", methods=["POST"])
+@privilege_required
+def start_profile():
+    """Start time-bounded sampling profile of this worker"""
+
+    log_request()
+
+    form = ProfilerForm(request.form)
+    if not form.validate():
+        for errors in form.errors.values():
+            for error in errors:
+                flash(error)
+        return redirect("/manage")
+
+    profiler = current_app.extensions["profiler"]
+    if not profiler.start(form.duration.data, form.interval.data / 1000):
+        flash("Profiling is already in progress.")
+
+    return redirect("/manage")
+
+
+@views_bp.route("/manage/profile.collapsed", methods=["GET"])
+@privilege_required
+def profile_collapsed():
+    """Download collected profile as collapsed stacks for flamegraph tools"""
+
+    log_request()
+
+    profiler = current_app.extensions["profiler"]
+    if profiler.started_at is None:
+        abort(404)
+
+    response = make_response(profiler.collapsed())
+    response.mimetype = "text/plain"
+    response.headers["Content-Disposition"] = (
+        f"attachment; filename=profile-{int(profiler.started_at)}.collapsed"
+    )
+    return response
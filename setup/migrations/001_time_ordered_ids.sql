@@ -0,0 +1,52 @@
+-- Move users and messages to compact, time-ordered identifiers.
+--
+-- Identifiers change from VARCHAR(36) text to the native 16-byte uuid type.
+-- Existing user ids keep their value, so issued sessions stay valid; new
+-- users get UUIDv7 ids from the application. Messages are re-keyed with
+-- UUIDv7 ids derived from their timestamps, so ordering by id follows
+-- sending order and ids serve as history cursors.
+--
+-- Apply once, as the database owner:
+--   docker compose exec -T postgres psql -U postgres -d chat_db \
+--       -v ON_ERROR_STOP=1 < setup/migrations/001_time_ordered_ids.sql
+
+BEGIN;
+
+-- UUIDv7 for a POSIX timestamp in seconds: 48-bit millisecond timestamp
+-- written over a random UUID, whose version bits are turned from 4 to 7
+CREATE FUNCTION pg_temp.uuid7_at(ts DOUBLE PRECISION) RETURNS UUID AS $$
+    SELECT encode(
+        set_bit(
+            set_bit(
+                overlay(
+                    uuid_send(gen_random_uuid())
+                    PLACING substring(int8send(floor(ts * 1000)::BIGINT) FROM 3)
+                    FROM 1 FOR 6
+                ),
+                52, 1
+            ),
+            53, 1
+        ),
+        'hex'
+    )::UUID
+$$ LANGUAGE SQL VOLATILE;
+
+-- Referencing and referenced columns must change type together
+ALTER TABLE messages DROP CONSTRAINT messages_user_id_fkey;
+
+ALTER TABLE users
+    ALTER COLUMN user_id TYPE UUID USING user_id::UUID;
+
+ALTER TABLE messages
+    ALTER COLUMN user_id TYPE UUID USING user_id::UUID,
+    ALTER COLUMN message_id TYPE UUID
+        USING pg_temp.uuid7_at(message_timestamp::DOUBLE PRECISION);
+
+ALTER TABLE messages
+    ADD CONSTRAINT messages_user_id_fkey FOREIGN KEY (user_id) REFERENCES users(user_id);
+
+COMMIT;
+
+-- Tables were rewritten: refresh planner statistics
+ANALYZE users;
+ANALYZE messages;
@@ -0,0 +1,31 @@
+-- Add image attachments of chat messages.
+--
+-- Messages refer to an attachment by identifier only; images and their
+-- thumbnails are kept in attachments storage.
+--
+-- Apply once, as the database owner, after 001_time_ordered_ids.sql:
+--   docker compose exec -T postgres psql -U postgres -d chat_db \
+--       -v ON_ERROR_STOP=1 -v app_user=user < setup/migrations/002_message_attachments.sql
+
+BEGIN;
+
+CREATE TABLE attachments (
+    attachment_id UUID PRIMARY KEY,
+    file_name VARCHAR(36) NOT NULL,
+    thumbnail_name VARCHAR(36),
+    content_type VARCHAR(32) NOT NULL,
+    file_size INTEGER NOT NULL,
+    user_id UUID,
+
+    FOREIGN KEY (user_id) REFERENCES users(user_id)
+);
+
+-- Nullable column without default: added without rewriting the table
+ALTER TABLE messages
+    ADD COLUMN attachment_id UUID
+        REFERENCES attachments(attachment_id) ON DELETE SET NULL;
+
+-- Application role, as POSTGRES_USERNAME in .env
+GRANT SELECT, INSERT, UPDATE, DELETE ON attachments TO :"app_user";
+
+COMMIT;
@@ -0,0 +1,34 @@
+-- Add mentions and per-user unread counters.
+--
+-- Every message advances the `messages` counter; users keep the value they
+-- have read up to. Existing users start with nothing unread.
+--
+-- Apply once, as the database owner, after 002_message_attachments.sql:
+--   docker compose exec -T postgres psql -U postgres -d chat_db \
+--       -v ON_ERROR_STOP=1 -v app_user=user < setup/migrations/003_unread_counters.sql
+
+BEGIN;
+
+CREATE TABLE chat_counters (
+    counter_name VARCHAR(32) PRIMARY KEY,
+    counter_value BIGINT NOT NULL DEFAULT 0
+);
+
+CREATE TABLE unread_counters (
+    user_id UUID PRIMARY KEY,
+    read_mark BIGINT NOT NULL DEFAULT 0,
+    mentions INTEGER NOT NULL DEFAULT 0,
+
+    FOREIGN KEY (user_id) REFERENCES users(user_id) ON DELETE CASCADE
+);
+
+INSERT INTO chat_counters VALUES ('messages', (SELECT count(*) FROM messages));
+
+INSERT INTO unread_counters (user_id, read_mark)
+SELECT user_id, (SELECT counter_value FROM chat_counters WHERE counter_name = 'messages')
+FROM users;
+
+-- Application role, as POSTGRES_USERNAME in .env
+GRANT SELECT, INSERT, UPDATE, DELETE ON chat_counters, unread_counters TO :"app_user";
+
+COMMIT;
@@ -0,0 +1,20 @@
+-- Add moderation: hidden messages, moderation revision and author index.
+--
+-- Hidden messages stay in the table but are never read back. The revision
+-- is part of history page URLs, so pages cached before a moderation are no
+-- longer requested. Building the index locks writes to messages briefly;
+-- on large tables create it beforehand with CREATE INDEX CONCURRENTLY.
+--
+-- Apply once, as the database owner, after 003_unread_counters.sql:
+--   docker compose exec -T postgres psql -U postgres -d chat_db \
+--       -v ON_ERROR_STOP=1 -v app_user=user < setup/migrations/004_message_moderation.sql
+
+BEGIN;
+
+ALTER TABLE messages ADD COLUMN message_hidden BOOLEAN NOT NULL DEFAULT FALSE;
+
+CREATE INDEX IF NOT EXISTS ix_messages_user_id_message_id ON messages (user_id, message_id);
+
+INSERT INTO chat_counters VALUES ('moderation', 0);
+
+COMMIT;
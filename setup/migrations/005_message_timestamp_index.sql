@@ -0,0 +1,17 @@
+-- Add the timestamp index used by message retention.
+--
+-- Every retention batch looks up messages older than a cutoff; without
+-- this index each batch scans the whole messages table. Databases created
+-- by setup.sh since retention was added have it already. The index is
+-- built concurrently, so writes to messages are not blocked meanwhile;
+-- this cannot run inside a transaction block.
+--
+-- Apply once, as the database owner; may be applied at any point of the
+-- migration sequence:
+--   docker compose exec -T postgres psql -U postgres -d chat_db \
+--       -v ON_ERROR_STOP=1 < setup/migrations/005_message_timestamp_index.sql
+
+CREATE INDEX CONCURRENTLY IF NOT EXISTS ix_messages_message_timestamp
+    ON messages (message_timestamp);
+
+ANALYZE messages;
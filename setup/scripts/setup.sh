@@ -10,8 +10,9 @@ psql -c "CREATE TABLE roles (
     role_name VARCHAR(16)
 );"
 
+# Identifiers are time-ordered UUIDv7 generated by the application
 psql -c "CREATE TABLE users (
-    user_id VARCHAR(36) PRIMARY KEY,
+    user_id UUID PRIMARY KEY,
     username VARCHAR(32) NOT NULL,
     passwd VARCHAR(256) NOT NULL,
     email VARCHAR(320) NOT NULL,
@@ -22,30 +23,69 @@ psql -c "CREATE TABLE users (
     FOREIGN KEY (role_id) REFERENCES roles(role_id)
 );"
 
+# Images attached to messages, kept in attachments storage
+psql -c "CREATE TABLE attachments (
+    attachment_id UUID PRIMARY KEY,
+    file_name VARCHAR(36) NOT NULL,
+    thumbnail_name VARCHAR(36),
+    content_type VARCHAR(32) NOT NULL,
+    file_size INTEGER NOT NULL,
+    user_id UUID,
+
+    FOREIGN KEY (user_id) REFERENCES users(user_id)
+);"
+
 psql -c "CREATE TABLE messages (
-    message_id VARCHAR(36) PRIMARY KEY,
+    message_id UUID PRIMARY KEY,
     message_content VARCHAR(4096) NOT NULL,
     message_timestamp VARCHAR(32) NOT NULL, 
     message_edited BOOLEAN NOT NULL,
-    user_id VARCHAR(36),
+    message_hidden BOOLEAN NOT NULL DEFAULT FALSE,
+    user_id UUID,
+    attachment_id UUID,
 
-    FOREIGN KEY (user_id) REFERENCES users(user_id)
+    FOREIGN KEY (user_id) REFERENCES users(user_id),
+    FOREIGN KEY (attachment_id) REFERENCES attachments(attachment_id) ON DELETE SET NULL
+);"
+
+# Unread state: sequence advanced by every message, per-user read marks
+psql -c "CREATE TABLE chat_counters (
+    counter_name VARCHAR(32) PRIMARY KEY,
+    counter_value BIGINT NOT NULL DEFAULT 0
+);"
+
+psql -c "CREATE TABLE unread_counters (
+    user_id UUID PRIMARY KEY,
+    read_mark BIGINT NOT NULL DEFAULT 0,
+    mentions INTEGER NOT NULL DEFAULT 0,
+
+    FOREIGN KEY (user_id) REFERENCES users(user_id) ON DELETE CASCADE
 );"
 
+# Index used by retention to find expired messages
+psql -c "CREATE INDEX ix_messages_message_timestamp ON messages (message_timestamp);"
+
+# Index used by moderation to walk messages of one author
+psql -c "CREATE INDEX ix_messages_user_id_message_id ON messages (user_id, message_id);"
+
 # Create user who will communicate with database
 psql -c "CREATE ROLE \"${POSTGRES_USERNAME}\" LOGIN PASSWORD '${POSTGRES_PASSWORD}' INHERIT;"
 
 # Set inly required permissions
 psql -c "GRANT SELECT, INSERT, UPDATE, DELETE ON \"roles\" TO \"${POSTGRES_USERNAME}\";" \
     -c "GRANT SELECT, INSERT, UPDATE, DELETE ON \"users\" TO \"${POSTGRES_USERNAME}\";" \
-    -c "GRANT SELECT, INSERT, UPDATE, DELETE ON \"messages\" TO \"${POSTGRES_USERNAME}\";"
+    -c "GRANT SELECT, INSERT, UPDATE, DELETE ON \"messages\" TO \"${POSTGRES_USERNAME}\";" \
+    -c "GRANT SELECT, INSERT, UPDATE, DELETE ON \"attachments\" TO \"${POSTGRES_USERNAME}\";" \
+    -c "GRANT SELECT, INSERT, UPDATE, DELETE ON \"chat_counters\" TO \"${POSTGRES_USERNAME}\";" \
+    -c "GRANT SELECT, INSERT, UPDATE, DELETE ON \"unread_counters\" TO \"${POSTGRES_USERNAME}\";"
 
 # Insert starter data
 PGPASSWORD=${POSTGRES_PASSWORD} psql -U ${POSTGRES_USERNAME} -c \
     "INSERT INTO roles VALUES 
     (1, 'Admin'),
     (2, 'Moderator'),
-    (3, 'User');"
+    (3, 'User');" \
+    -c "INSERT INTO chat_counters VALUES ('messages', 0), ('moderation', 0);"
 
 # Set access rules into pg_hba.conf
 echo "local ${PGDATABASE} ${POSTGRES_USERNAME} password